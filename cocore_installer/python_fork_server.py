@@ -0,0 +1,347 @@
+import ast
+import collections
+import importlib
+import json
+import os
+import resource
+import runpy
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import traceback
+from task_limits import apply_limits
+from task_process import CapturedOutput, ProcessResult, drain
+from task_timings import combine_usage, record_usage, usage_from_rusage
+
+FORK_SERVER_ENABLED = os.getenv("COCORE_PYTHON_FORK_SERVER", "1") == "1"
+MAX_FORK_SERVERS = int(os.getenv("COCORE_PYTHON_FORK_SERVERS", "8"))  # One warm parent per dependency environment
+# Imports run in the shared parent, outside any execution's limits, so only well-known
+# packages are preloaded and only for a bounded time
+PRELOAD_MODULES = set(filter(None, os.getenv(
+    "COCORE_PYTHON_PRELOAD_MODULES",
+    "numpy,pandas,scipy,sklearn,matplotlib,PIL,requests,urllib3,certifi,idna,charset_normalizer,"
+    "yaml,dateutil,pytz,six,bs4,lxml,sympy,networkx,pydantic,attrs,jinja2,orjson,ujson,simplejson",
+).split(",")))
+PRELOAD_TIMEOUT_SECONDS = float(os.getenv("COCORE_PYTHON_PRELOAD_TIMEOUT_SECONDS", "10"))
+STARTED_TIMEOUT_SECONDS = 60  # For the child's pid when no execution limits apply
+READY_LINE = "ready"
+READ_BUFFER_BYTES = 64 * 1024
+
+class PythonForkServer:
+    """
+    A pre-warmed Python parent process for one dependency environment.
+
+    Every execution is forked from the parent, so interpreter startup and any module the
+    parent has already imported are free. Before forking, the parent imports those of the
+    task's top-level imports that are on the PRELOAD_MODULES allow-list, which warms it
+    for the next task with the same imports. That import code runs in the parent, outside
+    the execution's limits, and its side effects persist across tasks; the allow-list and
+    PRELOAD_TIMEOUT_SECONDS bound what it can do. The task's own code and modules only
+    run in the forked child.
+    """
+
+    _servers = collections.OrderedDict()
+    _servers_lock = threading.Lock()
+
+    @classmethod
+    def for_environment(cls, env):
+        """Return a running fork server for the given environment, starting one if needed."""
+        env = env or {}
+        key = env.get("PYTHONPATH", "")
+        with cls._servers_lock:
+            server = cls._servers.get(key)
+            if server and server.process.poll() is None:
+                cls._servers.move_to_end(key)
+                return server
+            server = cls(env)
+            cls._servers[key] = server
+            while len(cls._servers) > MAX_FORK_SERVERS:
+                _, evicted = cls._servers.popitem(last=False)
+                evicted.stop()
+            return server
+
+    def __init__(self, env):
+        self.socket_dir = tempfile.mkdtemp(prefix="cocore_zygote_")
+        self.socket_path = os.path.join(self.socket_dir, "socket")
+        self.process = subprocess.Popen(
+            ["python", os.path.abspath(__file__), self.socket_path],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            text=True,
+            env=dict(os.environ, **env),
+        )
+        # The parent reports readiness once it is listening
+        ready = self.process.stdout.readline().strip()
+        if ready != READY_LINE:
+            self.stop()
+            raise RuntimeError(f"Python fork server failed to start: {ready!r}")
+
+    def run(self, code_path, cwd, input_data, env=None, limits=None):
+        """
+        Execute code_path in a forked child with env added to its environment, returning a
+        ProcessResult. With limits (an entered ExecutionLimits), the child applies them to
+        itself before running the task and its process group is killed on timeout.
+        """
+        stdin_path = os.path.join(cwd, ".cocore_stdin")
+        with open(stdin_path, 'w') as stdin_file:
+            stdin_file.write(input_data)
+
+        request = {
+            "code_path": code_path,
+            "cwd": cwd,
+            "stdin_path": stdin_path,
+            "env": env or {},
+            "limits": limits.child_config() if limits else None,
+        }
+        # The child writes its output into pipes drained here, so it is bounded like any other execution's
+        stdout = CapturedOutput(os.path.join(cwd, ".cocore_stdout"))
+        stderr = CapturedOutput(os.path.join(cwd, ".cocore_stderr"))
+        stdout_read, stdout_write = os.pipe()
+        stderr_read, stderr_write = os.pipe()
+        threads = [
+            threading.Thread(target=drain, args=(os.fdopen(stdout_read, 'rb'), stdout), daemon=True),
+            threading.Thread(target=drain, args=(os.fdopen(stderr_read, 'rb'), stderr), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        timed_out = False
+        disk_exceeded = False
+        spawn_ns = time.perf_counter_ns()
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            try:
+                connection.connect(self.socket_path)
+                send_request(connection, request, [stdout_write, stderr_write])
+            finally:
+                # Only the child holds the write ends from here on, so the pipes close when it exits
+                os.close(stdout_write)
+                os.close(stderr_write)
+            responses = connection.makefile('r')
+            # The child reports its pid before it runs any task code, then its exit code.
+            # A parent that cannot fork within the execution's time budget is stuck, e.g.
+            # in an import, and is replaced.
+            connection.settimeout(limits.timeout if limits and limits.timeout else STARTED_TIMEOUT_SECONDS)
+            try:
+                started = responses.readline()
+            except socket.timeout:
+                started = ""
+                timed_out = True
+                print("Python fork server did not start the task in time, restarting it")
+                self.stop()
+            response = ""
+            if started:
+                pid = json.loads(started)["pid"]
+                if limits:
+                    limits.watch_disk(pid, cwd)
+                connection.settimeout(limits.timeout if limits else None)
+                try:
+                    response = responses.readline()
+                except socket.timeout:
+                    timed_out = True
+                if limits:
+                    disk_exceeded = limits.unwatch_disk()
+                    limits.kill(pid)
+
+        for thread in threads:
+            thread.join()
+        first_byte_ns = None
+        if stdout.first_write_ns is not None:
+            first_byte_ns = stdout.first_write_ns - spawn_ns
+        stdout = stdout.text()
+        stderr = stderr.text()
+        usage = {}
+        if response:
+            response = json.loads(response)
+            returncode = response["returncode"]
+            usage = response["usage"]
+        else:
+            # The child died without reporting back, e.g. it was killed by a signal
+            returncode = 1
+            stderr += "\nTask process terminated unexpectedly."
+        oom_killed = limits.oom_killed() if limits else False
+        if limits:
+            usage.update(limits.usage())
+        record_usage(usage)
+        return ProcessResult(["python", code_path], returncode, stdout, stderr, timed_out, oom_killed, first_byte_ns, usage, disk_exceeded)
+
+    def stop(self):
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        try:
+            os.remove(self.socket_path)
+            os.rmdir(self.socket_dir)
+        except OSError:
+            pass
+
+def send_request(connection, request, fds):
+    """Send request as a line of JSON, passing fds along with it."""
+    payload = (json.dumps(request) + "\n").encode()
+    sent = socket.send_fds(connection, [payload], fds)
+    connection.sendall(payload[sent:])
+
+def receive_request(connection):
+    """Read a request sent by send_request, returning it with the file descriptors passed along."""
+    data, fds, _, _ = socket.recv_fds(connection, READ_BUFFER_BYTES, 2)
+    try:
+        while not data.endswith(b"\n"):
+            chunk = connection.recv(READ_BUFFER_BYTES)
+            if not chunk:
+                raise ValueError("Connection closed before the request was complete")
+            data += chunk
+        if len(fds) != 2:
+            raise ValueError(f"Expected 2 output file descriptors, received {len(fds)}")
+        return json.loads(data), fds
+    except Exception:
+        for fd in fds:
+            os.close(fd)
+        raise
+
+class PreloadTimeout(Exception):
+    pass
+
+def _preload_timed_out(signum, frame):
+    raise PreloadTimeout()
+
+_failed_preloads = set()
+
+def preload_imports(code_path):
+    """
+    Import the allow-listed top-level modules a task imports so that forked children
+    inherit them, giving up after PRELOAD_TIMEOUT_SECONDS.
+    """
+    try:
+        with open(code_path) as code_file:
+            tree = ast.parse(code_file.read())
+    except (OSError, SyntaxError, ValueError):
+        return
+    code_dir = os.path.dirname(code_path)
+    names = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            names.append(node.module)
+    names = [
+        name for name in names
+        if name.split(".")[0] in PRELOAD_MODULES and name not in sys.modules and name not in _failed_preloads
+        # Never import a module that ships with the task itself into the shared parent
+        and not os.path.exists(os.path.join(code_dir, name.split(".")[0] + ".py"))
+    ]
+    if not names:
+        return
+    signal.signal(signal.SIGALRM, _preload_timed_out)
+    signal.setitimer(signal.ITIMER_REAL, PRELOAD_TIMEOUT_SECONDS)
+    try:
+        for name in names:
+            try:
+                importlib.import_module(name)
+            except PreloadTimeout:
+                raise
+            except BaseException:
+                # The child will raise the same error when the task imports it
+                _failed_preloads.add(name)
+    except PreloadTimeout:
+        # Left to the children; they import it under their own limits
+        _failed_preloads.update(name for name in names if name not in sys.modules)
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+def run_child(request, output_fds):
+    """
+    Body of a forked child: wire up stdio, with stdout and stderr going to the worker's
+    pipes in output_fds, run the task as __main__ and return its exit code.
+    """
+    # Lead a new process group so that a timeout kills everything the task started
+    os.setsid()
+    if request.get("limits"):
+        apply_limits(**request["limits"])
+    stdin_fd = os.open(request["stdin_path"], os.O_RDONLY)
+    os.dup2(stdin_fd, 0)
+    os.dup2(output_fds[0], 1)
+    os.dup2(output_fds[1], 2)
+    for fd in [stdin_fd] + output_fds:
+        os.close(fd)
+
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.environ.update(request["env"])
+    os.chdir(request["cwd"])
+    code_path = request["code_path"]
+    sys.argv = [code_path]
+    sys.path[0] = os.path.dirname(code_path)
+    try:
+        runpy.run_path(code_path, run_name="__main__")
+        returncode = 0
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            print(e.code, file=sys.stderr)
+            returncode = 1
+    except BaseException:
+        traceback.print_exc()
+        returncode = 1
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return returncode
+
+def serve(socket_path):
+    # sys.path[0] is this installer directory; children replace it with their task directory
+    sys.path[0] = os.path.dirname(socket_path)
+    # Forked children are reaped automatically
+    signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+    worker_pid = os.getppid()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path)
+    server.listen(128)
+    server.settimeout(5)
+    print(READY_LINE, flush=True)
+
+    while True:
+        try:
+            connection, _ = server.accept()
+        except socket.timeout:
+            # Exit with the worker instead of lingering as an orphan
+            if os.getppid() != worker_pid:
+                return
+            continue
+        connection.settimeout(None)
+        output_fds = []
+        try:
+            request, output_fds = receive_request(connection)
+            preload_imports(request["code_path"])
+        except Exception:
+            for fd in output_fds:
+                os.close(fd)
+            connection.close()
+            continue
+
+        pid = os.fork()
+        if pid == 0:
+            server.close()
+            returncode = 1
+            try:
+                connection.sendall((json.dumps({"pid": os.getpid()}) + "\n").encode())
+                returncode = run_child(request, output_fds)
+                # The parent reaps children automatically, so the child reports its own usage
+                usage = combine_usage(
+                    usage_from_rusage(resource.getrusage(resource.RUSAGE_SELF)),
+                    usage_from_rusage(resource.getrusage(resource.RUSAGE_CHILDREN)),
+                )
+                connection.sendall((json.dumps({"returncode": returncode, "usage": usage}) + "\n").encode())
+            finally:
+                os._exit(returncode)
+        for fd in output_fds:
+            os.close(fd)
+        connection.close()
+
+if __name__ == "__main__":
+    serve(sys.argv[1])
@@ -0,0 +1,76 @@
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE_URL = os.getenv("COCORE_API_URL", "https://cocore.io")
+API_CONNECT_TIMEOUT_SECONDS = float(os.getenv("COCORE_API_CONNECT_TIMEOUT_SECONDS", "5"))
+API_READ_TIMEOUT_SECONDS = float(os.getenv("COCORE_API_READ_TIMEOUT_SECONDS", "30"))
+API_MAX_RETRIES = int(os.getenv("COCORE_API_MAX_RETRIES", "4"))
+API_BACKOFF_SECONDS = float(os.getenv("COCORE_API_BACKOFF_SECONDS", "0.5"))
+API_MAX_BACKOFF_SECONDS = float(os.getenv("COCORE_API_MAX_BACKOFF_SECONDS", "10"))
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+class CocoreApiClient:
+    """
+    A keep-alive client for the cocore.io API, shared by every thread of the worker.
+
+    Connections are pooled per host up to pool_size, so concurrent executions reuse
+    established TLS sessions instead of handshaking for every call. Failed connections,
+    timeouts and retryable status codes are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, auth_key, pool_size, base_url=API_BASE_URL):
+        self.base_url = base_url.rstrip("/")
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {auth_key}",
+            "Content-Type": "application/json",
+        })
+
+    def get(self, path, **kwargs):
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request("POST", path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request("PATCH", path, **kwargs)
+
+    def request(self, method, path, **kwargs):
+        """
+        Send a request to path under the API base URL and return the response. Raises the
+        last connection error, or returns the last retryable response, once retries run out.
+        """
+        kwargs.setdefault("timeout", (API_CONNECT_TIMEOUT_SECONDS, API_READ_TIMEOUT_SECONDS))
+        url = f"{self.base_url}{path}"
+        for attempt in range(API_MAX_RETRIES + 1):
+            last_attempt = attempt == API_MAX_RETRIES
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last_attempt:
+                    raise
+                print(f"{method} {path} failed ({e}), retrying")
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or last_attempt:
+                    return response
+                print(f"{method} {path} returned {response.status_code}, retrying")
+            # Full jitter keeps many workers from retrying in lockstep after an outage
+            time.sleep(random.uniform(0, min(API_MAX_BACKOFF_SECONDS, API_BACKOFF_SECONDS * 2 ** attempt)))
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_api_client(auth_key, pool_size):
+    """Return the process-wide API client, creating it on first use."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = CocoreApiClient(auth_key, pool_size)
+        return _client
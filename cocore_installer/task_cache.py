@@ -0,0 +1,207 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import traceback
+
+CACHE_ROOT = os.getenv("COCORE_CACHE_DIR", "/var/cache/cocore")
+# Never evict entries used this recently; longer than COCORE_BUILD_TIMEOUT_SECONDS, so a
+# build that looked an entry up is done with it before it can be evicted
+CACHE_GRACE_SECONDS = int(os.getenv("COCORE_CACHE_GRACE_SECONDS", "1800"))
+READY_MARKER = ".cocore_ready"
+LOCK_SUFFIX = ".lock"
+
+_thread_builds = threading.local()
+
+def builds_in_thread():
+    """Number of cache entries built by the calling thread so far, to tell hits from misses."""
+    return getattr(_thread_builds, "count", 0)
+
+def directory_size(path):
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                continue
+    return total
+
+class DependencyCache:
+    """
+    A content-addressed store of prebuilt dependency directories.
+
+    Each entry lives in <CACHE_ROOT>/<name>/<key> and is only visible once its
+    ready marker has been written, so a half-finished build is never handed out.
+    The marker's mtime doubles as the last-used time for LRU eviction.
+    """
+
+    def __init__(self, name, max_bytes):
+        self.name = name
+        self.root = os.path.join(CACHE_ROOT, name)
+        self.max_bytes = max_bytes
+        self._locks_guard = threading.Lock()
+        self._locks = {}
+
+    @classmethod
+    def key_for(cls, *parts):
+        digest = hashlib.sha256()
+        for part in parts:
+            digest.update(str(part).encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.root, key)
+
+    def lookup(self, key):
+        """Return the entry path for key if it has been fully built, marking it as used."""
+        path = self.path_for(key)
+        marker_path = os.path.join(path, READY_MARKER)
+        try:
+            os.utime(marker_path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_build(self, key, builder):
+        """
+        Return the entry path for key, calling builder(path) to populate it on a miss.
+
+        The builder runs in the final location (some toolchains bake absolute paths
+        into their output) and must return a truthy value on success. Returns None
+        if the build failed.
+        """
+        path = self.lookup(key)
+        if path:
+            return path
+
+        with self._key_lock(key):
+            path = self.lookup(key)
+            if path:
+                return path
+
+            path = self.path_for(key)
+            shutil.rmtree(path, ignore_errors=True)  # Leftovers from an interrupted build
+            os.makedirs(path)
+            _thread_builds.count = builds_in_thread() + 1
+            try:
+                if not builder(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                    return None
+            except Exception:
+                shutil.rmtree(path, ignore_errors=True)
+                raise
+
+            self._write_marker(path, time.time())
+
+        self.evict()
+        return path
+
+    @contextlib.contextmanager
+    def in_use(self, key):
+        """
+        Hold key's entry lock while the caller builds in the entry, e.g. with it as a cargo
+        target dir, so that it can be neither evicted nor modified by another build
+        meanwhile, and record the entry's new size afterwards. Yields the entry path, or
+        None if the entry was evicted before the lock was taken.
+        """
+        with self._key_lock(key):
+            path = self.lookup(key)
+            try:
+                yield path
+            finally:
+                if path:
+                    created = None
+                    try:
+                        with open(os.path.join(path, READY_MARKER)) as marker_file:
+                            created = json.load(marker_file).get("created")
+                    except (OSError, ValueError):
+                        pass
+                    self._write_marker(path, created or time.time())
+        self.evict()
+
+    def _write_marker(self, path, created):
+        marker_path = os.path.join(path, READY_MARKER)
+        # Written beside the marker and renamed over it, so lookups never see it half written
+        with open(marker_path + ".tmp", 'w') as marker_file:
+            json.dump({"size": directory_size(path), "created": created}, marker_file)
+        os.replace(marker_path + ".tmp", marker_path)
+
+    def evict(self):
+        """Remove least recently used entries until the store fits in max_bytes."""
+        try:
+            entries = []
+            for key in os.listdir(self.root):
+                marker_path = os.path.join(self.root, key, READY_MARKER)
+                try:
+                    with open(marker_path) as marker_file:
+                        size = json.load(marker_file).get("size", 0)
+                    entries.append((os.stat(marker_path).st_mtime, key, size))
+                except (OSError, ValueError):
+                    continue
+
+            total = sum(size for _, _, size in entries)
+            now = time.time()
+            for last_used, key, size in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                if now - last_used < CACHE_GRACE_SECONDS:
+                    continue
+                with self._key_lock(key):
+                    # The entry may have been used while the lock was held elsewhere
+                    try:
+                        if time.time() - os.stat(os.path.join(self.root, key, READY_MARKER)).st_mtime < CACHE_GRACE_SECONDS:
+                            continue
+                    except FileNotFoundError:
+                        continue
+                    self._remove(key)
+                total -= size
+                print(f"Evicted {self.name} cache entry {key} ({size} bytes)")
+        except Exception as e:
+            print(f"Error evicting {self.name} cache entries: {e}")
+            print(traceback.format_exc())
+
+    def _remove(self, key):
+        path = self.path_for(key)
+        # Drop the marker first so concurrent lookups miss instead of seeing a partial tree
+        try:
+            os.remove(os.path.join(path, READY_MARKER))
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(path, ignore_errors=True)
+
+    def _key_lock(self, key):
+        with self._locks_guard:
+            thread_lock = self._locks.setdefault(key, threading.Lock())
+        return _EntryLock(thread_lock, self.path_for(key) + LOCK_SUFFIX)
+
+class _EntryLock:
+    """Serialises work on one cache entry across threads and worker processes."""
+
+    def __init__(self, thread_lock, lock_path):
+        self.thread_lock = thread_lock
+        self.lock_path = lock_path
+        self.lock_file = None
+
+    def __enter__(self):
+        self.thread_lock.acquire()
+        try:
+            os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+            self.lock_file = open(self.lock_path, 'w')
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX)
+        except Exception:
+            self.thread_lock.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_UN)
+            self.lock_file.close()
+        finally:
+            self.thread_lock.release()
@@ -0,0 +1,197 @@
+import collections
+import os
+import statistics
+import threading
+import time
+import psutil
+
+SAMPLE_INTERVAL_SECONDS = float(os.getenv("COCORE_SAMPLE_INTERVAL_SECONDS", "0.5"))
+CPU_THRESHOLD = float(os.getenv("COCORE_CPU_THRESHOLD", "80"))  # Percent of all cores
+# Busy CPUs are only an overload once work queues for them: more runnable threads per core
+# than this, or tasks running this much slower than their baseline
+CPU_RUN_QUEUE_THRESHOLD = float(os.getenv("COCORE_CPU_RUN_QUEUE_THRESHOLD", "1.25"))
+CPU_LATENCY_INFLATION_THRESHOLD = float(os.getenv("COCORE_CPU_LATENCY_INFLATION_THRESHOLD", "1.25"))
+MEMORY_THRESHOLD = float(os.getenv("COCORE_MEMORY_THRESHOLD", "90"))  # Percent of RAM in use
+MEMORY_PRESSURE_THRESHOLD = float(os.getenv("COCORE_MEMORY_PRESSURE_THRESHOLD", "10"))  # PSI some avg10
+LOAD_THRESHOLD = float(os.getenv("COCORE_LOAD_THRESHOLD", "1.5"))  # 1 minute load average per core
+LATENCY_INFLATION_THRESHOLD = float(os.getenv("COCORE_LATENCY_INFLATION_THRESHOLD", "2"))
+DECREASE_FACTOR = float(os.getenv("COCORE_CONCURRENCY_DECREASE_FACTOR", "0.75"))
+DECREASE_COOLDOWN_SECONDS = float(os.getenv("COCORE_CONCURRENCY_DECREASE_COOLDOWN_SECONDS", "5"))  # Signals lag a cut
+LATENCY_BASELINES = 1000  # Tasks and inputs whose recent latencies are remembered
+LATENCY_WINDOW = int(os.getenv("COCORE_LATENCY_WINDOW", "20"))  # Recent runs a baseline is the median of
+LATENCY_MIN_SAMPLES = 3  # Runs of a task kind needed before its latency is compared
+MEMORY_PRESSURE_FILE = "/proc/pressure/memory"
+PROC_STAT_FILE = "/proc/stat"
+
+def memory_pressure():
+    """The kernel's PSI 'some avg10' for memory, or None where PSI is unavailable."""
+    try:
+        with open(MEMORY_PRESSURE_FILE) as pressure_file:
+            for line in pressure_file:
+                fields = line.split()
+                if fields[0] == "some":
+                    return float(fields[1].split("=")[1])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+def run_queue():
+    """Threads currently runnable or running, not counting the one asking, or None off Linux."""
+    try:
+        with open(PROC_STAT_FILE) as stat_file:
+            for line in stat_file:
+                if line.startswith("procs_running "):
+                    return max(0, int(line.split()[1]) - 1)
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+class ConcurrencyController:
+    """
+    Sets how many executions may run at once from a background sample of the host.
+
+    Every SAMPLE_INTERVAL_SECONDS the sampler thread reads CPU and memory usage, memory
+    pressure, the load average, the run queue and the latency inflation of recent
+    executions (how much slower each task kind ran than the median of its recent runs).
+    If any of them is over its threshold the limit is cut by DECREASE_FACTOR, at most
+    once per DECREASE_COOLDOWN_SECONDS; otherwise, if the limit was fully used, it grows
+    by one. CPU usage alone is not an overload, since fully used cores are the goal; it
+    counts once the run queue or latency shows work waiting for them. Admission is a
+    non-blocking comparison against the current limit.
+    """
+
+    def __init__(self, max_limit, min_limit=1):
+        self.max_limit = max_limit
+        self.min_limit = min_limit
+        self.limit = float(max(min_limit, max_limit // 2))
+        self.in_use = 0
+        self.samples = {}
+        self.reason = "starting"
+        self.latency_inflation = 1.0
+        self.baselines = collections.OrderedDict()
+        self.last_decrease = 0
+        self.listeners = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self._sample_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def target(self):
+        return int(self.limit)
+
+    @property
+    def overloaded(self):
+        return self.reason.startswith("overloaded")
+
+    def admit(self, in_use):
+        """Whether another execution may start while in_use are running."""
+        self.in_use = in_use
+        return in_use < self.target
+
+    def on_change(self, listener):
+        """Call listener() whenever the target changes."""
+        self.listeners.append(listener)
+
+    def record_latency(self, key, seconds):
+        """
+        Report how long one run of a kind of task took. Only runs that are comparable with
+        each other should share a key: the same task on the same input, timed without
+        installs or compiles.
+        """
+        with self.lock:
+            # The median of a window of recent runs, unlike the fastest one, is not thrown
+            # off by a single outlier in either direction
+            window = self.baselines.pop(key, None) or collections.deque(maxlen=LATENCY_WINDOW)
+            self.baselines[key] = window
+            while len(self.baselines) > LATENCY_BASELINES:
+                self.baselines.popitem(last=False)
+            if len(window) >= LATENCY_MIN_SAMPLES:
+                baseline = statistics.median(window)
+                if baseline > 0:
+                    self.latency_inflation = 0.8 * self.latency_inflation + 0.2 * (seconds / baseline)
+            window.append(seconds)
+
+    def decisions(self):
+        """The controller's current state, for logs and metrics."""
+        with self.lock:
+            return {
+                "target": self.target,
+                "limit": self.limit,
+                "in_use": self.in_use,
+                "reason": self.reason,
+                "latency_inflation": self.latency_inflation,
+                **self.samples,
+            }
+
+    def _sample_forever(self):
+        psutil.cpu_percent(interval=None)  # The first reading only sets the reference point
+        while True:
+            time.sleep(SAMPLE_INTERVAL_SECONDS)
+            try:
+                self._adjust(self._sample())
+            except Exception as e:
+                print(f"Error sampling host resources: {e}")
+
+    def _sample(self):
+        samples = {
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": psutil.virtual_memory().percent,
+            "load_per_cpu": os.getloadavg()[0] / (psutil.cpu_count(logical=True) or 1),
+        }
+        pressure = memory_pressure()
+        if pressure is not None:
+            samples["memory_pressure"] = pressure
+        runnable = run_queue()
+        if runnable is not None:
+            samples["run_queue_per_cpu"] = runnable / (psutil.cpu_count(logical=True) or 1)
+        return samples
+
+    def _overload(self, samples):
+        if samples["cpu_percent"] >= CPU_THRESHOLD:
+            if samples.get("run_queue_per_cpu", 0) >= CPU_RUN_QUEUE_THRESHOLD:
+                return f"overloaded: CPU at {samples['cpu_percent']:.0f}% with {samples['run_queue_per_cpu']:.2f} runnable per core"
+            if self.latency_inflation >= CPU_LATENCY_INFLATION_THRESHOLD:
+                return f"overloaded: CPU at {samples['cpu_percent']:.0f}% with tasks running {self.latency_inflation:.1f}x slower"
+        if samples["memory_percent"] >= MEMORY_THRESHOLD:
+            return f"overloaded: memory at {samples['memory_percent']:.0f}%"
+        if samples.get("memory_pressure", 0) >= MEMORY_PRESSURE_THRESHOLD:
+            return f"overloaded: memory pressure at {samples['memory_pressure']:.1f}"
+        if samples["load_per_cpu"] >= LOAD_THRESHOLD:
+            return f"overloaded: load {samples['load_per_cpu']:.2f} per core"
+        if self.latency_inflation >= LATENCY_INFLATION_THRESHOLD:
+            return f"overloaded: tasks running {self.latency_inflation:.1f}x slower than their baseline"
+        return None
+
+    def _adjust(self, samples):
+        with self.lock:
+            previous = self.target
+            self.samples = samples
+            overload = self._overload(samples)
+            if overload:
+                if time.monotonic() - self.last_decrease >= DECREASE_COOLDOWN_SECONDS:
+                    self.limit = max(float(self.min_limit), self.limit * DECREASE_FACTOR)
+                    self.last_decrease = time.monotonic()
+                    # Start measuring inflation afresh at the new level
+                    self.latency_inflation = 1.0
+                self.reason = overload
+            elif self.in_use >= self.target and self.limit < self.max_limit:
+                self.limit = min(float(self.max_limit), self.limit + 1)
+                self.reason = "increasing: all slots in use"
+            else:
+                self.reason = "steady"
+            changed = self.target != previous
+        if changed:
+            print(f"Concurrency target {previous} -> {self.target} ({self.reason})")
+            for listener in self.listeners:
+                listener()
+
+_controller = None
+_controller_lock = threading.Lock()
+
+def get_concurrency_controller(max_limit):
+    """Return the process-wide controller, starting its sampler on first use."""
+    global _controller
+    with _controller_lock:
+        if _controller is None:
+            _controller = ConcurrencyController(max_limit)
+        return _controller
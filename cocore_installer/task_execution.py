@@ -7,6 +7,7 @@ import json
 import sys
 import time
 import traceback
+from task_concurrency import get_concurrency_controller
 from task_runners import TaskRunners
 from task_extensions import TaskExtensions
 MAX_THREADS = 10
@@ -23,17 +24,17 @@ LANGUAGE_MAP = {
 def run_task(task_language_id, task_requirements, task_code, input_args):
     task_language = LANGUAGE_MAP.get(str(task_language_id))
     if "python" in task_language:
-        return TaskRunners.run_python_task(task_requirements, task_code, input_args, TaskExtensions.python_extension(input_args))
+        return TaskRunners.run_python_task(task_requirements, task_code, input_args, TaskExtensions.python_extension())
     elif "node" in task_language:
-        return TaskRunners.run_node_task(task_requirements, task_code, input_args, TaskExtensions.node_extension(input_args))
+        return TaskRunners.run_node_task(task_requirements, task_code, input_args, TaskExtensions.node_extension())
     elif "ruby" in task_language:
-        return TaskRunners.run_ruby_task(task_requirements, task_code, input_args, TaskExtensions.ruby_extension(input_args))
+        return TaskRunners.run_ruby_task(task_requirements, task_code, input_args, TaskExtensions.ruby_extension())
     elif "go" in task_language:
-        return TaskRunners.run_go_task(task_requirements, task_code, input_args, TaskExtensions.go_extension(input_args))
+        return TaskRunners.run_go_task(task_requirements, task_code, input_args, TaskExtensions.go_extension())
     elif "rust" in task_language:
-        return TaskRunners.run_rust_task(task_requirements, task_code, input_args, TaskExtensions.rust_extension(input_args))
+        return TaskRunners.run_rust_task(task_requirements, task_code, input_args, TaskExtensions.rust_extension())
     elif "java" in task_language:
-        return TaskRunners.run_java_task(task_requirements, task_code, input_args, TaskExtensions.java_extension(input_args))
+        return TaskRunners.run_java_task(task_requirements, task_code, input_args, TaskExtensions.java_extension())
     else:
         return {"error": "UnsupportedLanguage", "error_message": f"Language '{task_language}' is not supported."}
 
@@ -91,6 +92,6 @@ async def process_task(input):
 
 def adjust_concurrency(current_concurrency):
     """
-    Adjusts the concurrency level based on the current request rate.
+    Adjusts the concurrency level based on the host's load and task latency.
     """
-    return 10
+    return get_concurrency_controller(MAX_THREADS).target
@@ -1,41 +1,68 @@
-import json
 DEMARCATION = "-=-=-=-=-=-=-=-=-=-=-"
+RESULT_PATH_ENV = "COCORE_RESULT_PATH"
+BATCH_ENV = "COCORE_BATCH"
 class TaskExtensions:
+    """
+    Entry points appended to task code. The input arguments are never embedded in the
+    generated source; run_generic_task writes them to the task's stdin as a JSON array,
+    so the task code plus extension is identical across executions and can be compiled
+    or cached once. The result is written as JSON to the file named by RESULT_PATH_ENV,
+    leaving stdout to whatever the task itself prints.
+
+    When BATCH_ENV is "1", stdin holds an array of argument arrays instead; run is called
+    once per item and the result file holds the array of per-item results.
+    """
+
     @classmethod
-    def python_extension(cls, args):
-        arg_data = json.dumps(args)
+    def python_extension(cls):
         return f"""
 if __name__ == '__main__':
     import json
-    json_string = \"\"\"{arg_data}\"\"\"
-    json_string = json_string.replace("\\n", "\\\\n")
-    args = json.loads(json_string)
-    result = run(*args)
-    print("{DEMARCATION}")
-    print(json.dumps(result))
+    import sys
+    import os
+    args = json.load(sys.stdin)
+    if os.environ.get("{BATCH_ENV}") == "1":
+        result = [run(*item_args) for item_args in args]
+    else:
+        result = run(*args)
+    with open(os.environ["{RESULT_PATH_ENV}"], "w") as result_file:
+        json.dump(result, result_file)
 """
 
     @classmethod
-    def node_extension(cls, args):
+    def node_extension(cls):
         return f"""
-const args = JSON.parse('{json.dumps(args)}');
-const result = run(...args);
-console.log("{DEMARCATION}");
-console.log(JSON.stringify(result, null, 2));
+const args = JSON.parse(require('fs').readFileSync(0, 'utf8'));
+const orNull = (value) => (value === undefined ? null : value);
+const result = process.env.{BATCH_ENV} === '1'
+  ? args.map((itemArgs) => orNull(run(...itemArgs)))
+  : orNull(run(...args));
+require('fs').writeFileSync(process.env.{RESULT_PATH_ENV}, JSON.stringify(result));
 """
 
     @classmethod
-    def ruby_extension(cls, args):
+    def ruby_extension(cls):
         return f"""
 require 'json'
-args = JSON.parse('{json.dumps(args)}')
-result = run(*args)
-puts "{DEMARCATION}"
-puts JSON.pretty_generate(result)
+args = JSON.parse(STDIN.read)
+result = ENV['{BATCH_ENV}'] == '1' ? args.map {{ |item_args| run(*item_args) }} : run(*args)
+File.write(ENV['{RESULT_PATH_ENV}'], JSON.generate(result))
+"""
+
+    @classmethod
+    def node_module_extension(cls):
+        # Used instead of node_extension when the code is loaded by a warm worker
+        return """
+module.exports = { run };
 """
 
     @classmethod
-    def go_extension(cls, args):
+    def ruby_module_extension(cls):
+        # Warm Ruby workers evaluate the code into an anonymous module and call run on it
+        return ""
+
+    @classmethod
+    def go_extension(cls):
         return f"""
 package main
 
@@ -47,37 +74,61 @@ import (
 
 func main() {{
     var args []interface{{}}
-    err := json.Unmarshal([]byte(`{json.dumps(args)}`), &args)
+    err := json.NewDecoder(os.Stdin).Decode(&args)
     if err != nil {{
         fmt.Println("Error:", err)
         os.Exit(1)
     }}
 
-    result := run(args)
-    jsonResult, err := json.MarshalIndent(result, "", "  ")
+    var result interface{{}}
+    if os.Getenv("{BATCH_ENV}") == "1" {{
+        results := make([]interface{{}}, len(args))
+        for i, item := range args {{
+            itemArgs, ok := item.([]interface{{}})
+            if !ok {{
+                fmt.Println("Error: batch items should be JSON arrays")
+                os.Exit(1)
+            }}
+            results[i] = run(itemArgs)
+        }}
+        result = results
+    }} else {{
+        result = run(args)
+    }}
+
+    jsonResult, err := json.Marshal(result)
     if err != nil {{
         fmt.Println("Error serializing result:", err)
         os.Exit(1)
     }}
 
-    fmt.Println("{DEMARCATION}")
-    fmt.Println(string(jsonResult))
+    if err := os.WriteFile(os.Getenv("{RESULT_PATH_ENV}"), jsonResult, 0644); err != nil {{
+        fmt.Println("Error writing result:", err)
+        os.Exit(1)
+    }}
 }}
 """
 
     @classmethod
-    def rust_extension(cls, args):
+    def rust_extension(cls):
         return f"""
 use serde_json::{{Value, to_string_pretty}};
 
 fn main() {{
-    let args: Value = serde_json::from_str("{json.dumps(args)}").unwrap();
+    let args: Value = serde_json::from_reader(std::io::stdin()).unwrap();
 
     if let Value::Array(vec) = args {{
-        let result = run(vec);  // Pass the args directly to the run function provided in task_code
-        let json_result = to_string_pretty(&result).unwrap();
-        println!("{DEMARCATION}");
-        println!("{{}}", json_result);  // Print the JSON string of the result
+        let json_result = if std::env::var("{BATCH_ENV}").map(|v| v == "1").unwrap_or(false) {{
+            let results: Vec<Value> = vec.into_iter().map(|item| match item {{
+                Value::Array(item_args) => serde_json::to_value(run(item_args)).unwrap(),
+                _ => panic!("Error: batch items should be JSON arrays"),
+            }}).collect();
+            to_string_pretty(&results).unwrap()
+        }} else {{
+            let result = run(vec);  // Pass the args directly to the run function provided in task_code
+            to_string_pretty(&result).unwrap()
+        }};
+        std::fs::write(std::env::var("{RESULT_PATH_ENV}").unwrap(), json_result).unwrap();  // Hand the JSON result back to the worker
     }} else {{
         println!("Error: Arguments should be a JSON array");
     }}
@@ -85,9 +136,7 @@ fn main() {{
 """
 
     @classmethod
-    def java_extension(cls, args):
-        args_json = json.dumps(args)
-
+    def java_extension(cls):
         return f"""
 import com.fasterxml.jackson.databind.JsonNode;
 import com.fasterxml.jackson.databind.ObjectMapper;
@@ -97,20 +146,32 @@ public class TaskCode {{
     public static void main(String[] args) {{
         try {{
             ObjectMapper mapper = new ObjectMapper();
-            JsonNode rootNode = mapper.readTree("{args_json}");
-            JsonNode[] inputs = new JsonNode[rootNode.size()];
-            int index = 0;
-            for (Iterator<JsonNode> it = rootNode.elements(); it.hasNext(); index++) {{
-                inputs[index] = it.next();
+            JsonNode rootNode = mapper.readTree(System.in);
+            JsonNode result;
+            if ("1".equals(System.getenv("{BATCH_ENV}"))) {{
+                com.fasterxml.jackson.databind.node.ArrayNode results = mapper.createArrayNode();
+                for (Iterator<JsonNode> items = rootNode.elements(); items.hasNext();) {{
+                    results.add(run(taskInputs(items.next())));
+                }}
+                result = results;
+            }} else {{
+                result = run(taskInputs(rootNode));
             }}
-            JsonNode result = run(inputs);
-            System.out.println("{DEMARCATION}");
-            System.out.println(mapper.writerWithDefaultPrettyPrinter().writeValueAsString(result));
+            java.nio.file.Files.write(java.nio.file.Paths.get(System.getenv("{RESULT_PATH_ENV}")), mapper.writeValueAsBytes(result));
         }} catch (Exception e) {{
             e.printStackTrace();
         }}
     }}
 
+    private static JsonNode[] taskInputs(JsonNode argsNode) {{
+        JsonNode[] inputs = new JsonNode[argsNode.size()];
+        int index = 0;
+        for (Iterator<JsonNode> it = argsNode.elements(); it.hasNext(); index++) {{
+            inputs[index] = it.next();
+        }}
+        return inputs;
+    }}
+
     /*METHOD_PLACEHOLDER*/
 }}
 """
\ No newline at end of file
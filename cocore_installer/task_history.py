@@ -0,0 +1,137 @@
+import collections
+import os
+import sqlite3
+import threading
+import time
+import psutil
+from task_cache import CACHE_ROOT
+
+HISTORY_DB_PATH = os.getenv("COCORE_HISTORY_DB", os.path.join(CACHE_ROOT, "history.sqlite3"))
+HISTORY_SMOOTHING = float(os.getenv("COCORE_HISTORY_SMOOTHING", "0.3"))  # Weight of the newest run
+DEFAULT_TASK_CPUS = float(os.getenv("COCORE_DEFAULT_TASK_CPUS", "1"))
+DEFAULT_TASK_MEMORY_BYTES = int(os.getenv("COCORE_DEFAULT_TASK_MEMORY_MB", "256")) * 1024 * 1024
+DEFAULT_TASK_SECONDS = 1.0
+WALL_TIME_EXCLUDED = {"first_byte"}  # Sub-intervals of another phase
+MIN_TASK_CPUS = 0.05  # Even a task that mostly waits holds a thread and a process
+
+TaskCost = collections.namedtuple("TaskCost", ["cpus", "memory_bytes", "seconds"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS task_costs (
+    task_key TEXT PRIMARY KEY,
+    language TEXT NOT NULL,
+    runs INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    cpu_seconds REAL NOT NULL,
+    peak_rss_bytes INTEGER NOT NULL,
+    install_hits INTEGER NOT NULL,
+    compile_hits INTEGER NOT NULL,
+    compiles INTEGER NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+def cold_key(language):
+    # First runs of a task pay for installs and compiles that later runs get from the caches,
+    # so they are tracked per language as the estimate for tasks without history
+    return f"cold:{language}"
+
+def summarize(result):
+    """Wall seconds, CPU seconds, peak RSS and cache hits of one result from run_language_task."""
+    timings = result.get("timings") or {}
+    # first_byte is measured inside run, so counting it would inflate the wall time
+    seconds = sum(
+        value for name, value in timings.items()
+        if name not in WALL_TIME_EXCLUDED and not isinstance(value, bool)
+    ) / 1000000
+    cpu_seconds = 0.0
+    peak_rss_bytes = 0
+    for usage in (result.get("resource_usage") or {}).values():
+        cpu_seconds += usage.get("user_cpu_seconds", 0) + usage.get("system_cpu_seconds", 0)
+        peak_rss_bytes = max(peak_rss_bytes, usage.get("max_rss_bytes", 0))
+    return seconds, cpu_seconds, peak_rss_bytes, timings.get("install_cache_hit", True), timings.get("compile_cache_hit")
+
+class ExecutionHistory:
+    """
+    A small SQLite store of what executions of each task cost, smoothed across runs.
+
+    Every finished execution updates its task's row with an exponentially weighted
+    average of its wall time and CPU time, its peak RSS and its cache hit counts.
+    estimate() turns that into the CPU share and memory the next run is expected to
+    need, falling back to the language's first-run costs for tasks never seen before.
+    """
+
+    def __init__(self, path=HISTORY_DB_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+
+    def record(self, task_key, language, result):
+        if "timings" not in result:
+            return
+        seconds, cpu_seconds, peak_rss_bytes, install_hit, compile_hit = summarize(result)
+        cold = not install_hit or compile_hit is False
+        with self.lock:
+            self._update(task_key, language, seconds, cpu_seconds, peak_rss_bytes, install_hit, compile_hit)
+            if cold:
+                self._update(cold_key(language), language, seconds, cpu_seconds, peak_rss_bytes, install_hit, compile_hit)
+
+    def _update(self, task_key, language, seconds, cpu_seconds, peak_rss_bytes, install_hit, compile_hit):
+        self.connection.execute(
+            """
+            INSERT INTO task_costs VALUES (
+                :task_key, :language, 1, :seconds, :cpu_seconds, :peak_rss_bytes,
+                :install_hits, :compile_hits, :compiles, :updated_at
+            )
+            ON CONFLICT(task_key) DO UPDATE SET
+                runs = runs + 1,
+                seconds = seconds * (1 - :weight) + excluded.seconds * :weight,
+                cpu_seconds = cpu_seconds * (1 - :weight) + excluded.cpu_seconds * :weight,
+                peak_rss_bytes = MAX(CAST(peak_rss_bytes * (1 - :weight) AS INTEGER), excluded.peak_rss_bytes),
+                install_hits = install_hits + excluded.install_hits,
+                compile_hits = compile_hits + excluded.compile_hits,
+                compiles = compiles + excluded.compiles,
+                updated_at = excluded.updated_at
+            """,
+            {
+                "task_key": task_key,
+                "language": language,
+                "seconds": seconds,
+                "cpu_seconds": cpu_seconds,
+                "peak_rss_bytes": peak_rss_bytes,
+                "install_hits": int(bool(install_hit)),
+                "compile_hits": int(bool(compile_hit)),
+                "compiles": int(compile_hit is not None),
+                "updated_at": time.time(),
+                "weight": HISTORY_SMOOTHING,
+            },
+        )
+
+    def stats(self, task_key):
+        with self.lock:
+            cursor = self.connection.execute("SELECT * FROM task_costs WHERE task_key = ?", (task_key,))
+            row = cursor.fetchone()
+            return dict(zip([column[0] for column in cursor.description], row)) if row else None
+
+    def estimate(self, task_key, language):
+        """The TaskCost expected for the next run of a task."""
+        stats = self.stats(task_key) or self.stats(cold_key(language))
+        if not stats:
+            return TaskCost(DEFAULT_TASK_CPUS, DEFAULT_TASK_MEMORY_BYTES, DEFAULT_TASK_SECONDS)
+        seconds = max(stats["seconds"], 0.001)
+        cpus = min(max(stats["cpu_seconds"] / seconds, MIN_TASK_CPUS), psutil.cpu_count(logical=True) or 1)
+        return TaskCost(cpus, stats["peak_rss_bytes"] or DEFAULT_TASK_MEMORY_BYTES, seconds)
+
+_history = None
+_history_lock = threading.Lock()
+
+def get_execution_history():
+    """Return the process-wide history store, opening it on first use."""
+    global _history
+    with _history_lock:
+        if _history is None:
+            _history = ExecutionHistory()
+        return _history
@@ -0,0 +1,5 @@
+import os
+import socket
+
+# Names this host wherever the worker identifies itself, e.g. its queue leases and traces
+HOST_ID = os.getenv("COCORE_HOST_ID", socket.gethostname())
@@ -1,129 +1,241 @@
+import functools
+import json
 import os
+import shutil
 import subprocess
 import tempfile
 import traceback
 import sys
+from task_cache import CACHE_ROOT, DependencyCache
+from task_limits import BUILD_TIMEOUT_SECONDS
+from task_process import run_command
+from task_tracing import traced
+
+PYTHON_ENV_CACHE = DependencyCache("python", int(os.getenv("COCORE_PYTHON_CACHE_MAX_BYTES", str(5 * 1024 ** 3))))
+NODE_MODULES_CACHE = DependencyCache("node", int(os.getenv("COCORE_NODE_CACHE_MAX_BYTES", str(5 * 1024 ** 3))))
+RUBY_BUNDLE_CACHE = DependencyCache("ruby", int(os.getenv("COCORE_RUBY_CACHE_MAX_BYTES", str(5 * 1024 ** 3))))
+GO_MOD_CACHE_DIR = os.path.join(CACHE_ROOT, "go", "mod")
+GO_BUILD_CACHE_DIR = os.path.join(CACHE_ROOT, "go", "build")
+RUST_TARGET_CACHE = DependencyCache("rust", int(os.getenv("COCORE_RUST_CACHE_MAX_BYTES", str(20 * 1024 ** 3))))
+RUST_BUILD_PROFILE = os.getenv("COCORE_RUST_PROFILE", "release")
+JAVA_CLASSPATH_CACHE = DependencyCache("java", int(os.getenv("COCORE_JAVA_CACHE_MAX_BYTES", str(5 * 1024 ** 3))))
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version(*command):
+    """Version string of a toolchain, used to keep cached native builds apart."""
+    try:
+        result = subprocess.run(list(command), capture_output=True, text=True, timeout=60)
+        # Some toolchains (javac, older JDKs) report their version on stderr
+        return (result.stdout + result.stderr).strip()
+    except (OSError, subprocess.TimeoutExpired):
+        return ""
 
 class TaskInstallers:
+    """
+    Each installer prepares a task's dependencies and returns a dict of environment
+    variables the task must run with, or None if installation failed.
+    """
+
     @classmethod
+    def normalize_python_requirements(cls, task_requirements):
+        # Strip comments, blank lines and ordering so equivalent requirements share one environment
+        lines = set()
+        for line in (task_requirements or "").splitlines():
+            line = line.split(" #", 1)[0].strip()
+            if line and not line.startswith("#"):
+                lines.add(line)
+        return "\n".join(sorted(lines))
+
+    @classmethod
+    @traced("install_python_packages")
     def install_python_packages(cls, temp_dir, task_requirements):
         try:
-            # Path to the requirements.txt file within the temporary directory
-            requirements_txt_path = os.path.join(temp_dir, "requirements.txt")
-            # Write the task requirements to the requirements.txt file
-            with open(requirements_txt_path, 'w') as req_file:
-                req_file.write(task_requirements)
-            # Install the packages using pip in the temporary directory
-            subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", requirements_txt_path])
-            # subprocess.check_call([sys.executable, "-m", "pip", "install", "-r", requirements_txt_path, "--target", temp_dir])
-            print("Packages from requirements.txt installed successfully.")
-            return temp_dir
+            requirements = cls.normalize_python_requirements(task_requirements)
+            if not requirements:
+                return {}
+
+            def build_environment(target_dir):
+                # Path to the requirements.txt file within the temporary directory
+                requirements_txt_path = os.path.join(temp_dir, "requirements.txt")
+                # Write the task requirements to the requirements.txt file
+                with open(requirements_txt_path, 'w') as req_file:
+                    req_file.write(requirements)
+                # Install the packages into the cache entry rather than the worker's own site-packages
+                command = [sys.executable, "-m", "pip", "install", "--no-input", "-r", requirements_txt_path, "--target", target_dir]
+                result = run_command(command, timeout=BUILD_TIMEOUT_SECONDS)
+                if result.returncode != 0:
+                    print(f"Failed to install packages from requirements.txt: {result.stdout}{result.stderr}")
+                    return False
+                return True
+
+            # Installed wheels are tied to the interpreter, so it is part of the key
+            key = DependencyCache.key_for(sys.version, requirements)
+            env_dir = PYTHON_ENV_CACHE.get_or_build(key, build_environment)
+            if not env_dir:
+                return None
+            print(f"Python environment for requirements.txt ready at {env_dir}.")
+            python_path = os.pathsep.join(filter(None, [env_dir, os.environ.get("PYTHONPATH")]))
+            return {"PYTHONPATH": python_path}
         except Exception as e:
             print(f"Failed to install packages from requirements.txt: {e}")
             print(traceback.format_exc())
             return None
     
     @classmethod
+    def normalize_package_json(cls, task_requirements):
+        # Key formatting does not change what npm resolves, so hash the canonical JSON form
+        try:
+            return json.dumps(json.loads(task_requirements), sort_keys=True, separators=(",", ":"))
+        except ValueError:
+            return task_requirements.strip()
+
+    @classmethod
+    @traced("install_node_packages")
     def install_node_packages(cls, temp_dir, task_requirements):
-        if task_requirements:
-            try:
-                # Path to the package.json file within the temporary directory
-                package_json_path = os.path.join(temp_dir, "package.json")
-                # Write the task requirements to the package.json file
-                with open(package_json_path, 'w') as package_json_file:
+        if not task_requirements or not task_requirements.strip():
+            return {}
+        try:
+            package_json = cls.normalize_package_json(task_requirements)
+
+            def build_node_modules(store_dir):
+                # Write the task requirements to the package.json file of the store entry
+                with open(os.path.join(store_dir, "package.json"), 'w') as package_json_file:
                     package_json_file.write(task_requirements)
-                # Run npm install in the temporary directory
-                command = ["npm", "install", "--prefix", temp_dir, "--no-save"]
-                result = subprocess.run(command, capture_output=True, text=True)
+                # Run npm install once for this manifest
+                command = ["npm", "install", "--prefix", store_dir, "--no-save", "--no-audit", "--no-fund"]
+                result = run_command(command, timeout=BUILD_TIMEOUT_SECONDS)
                 if result.returncode != 0:
                     print(f"Error installing Node.js packages: {result.stderr}")
-                    return None
-                return temp_dir
-            except Exception as e:
-                print(f"Error installing Node.js packages: {e}")
+                    return False
+                return True
+
+            key = DependencyCache.key_for(toolchain_version("node", "--version"), package_json)
+            store_dir = NODE_MODULES_CACHE.get_or_build(key, build_node_modules)
+            if not store_dir:
                 return None
-        return None
+
+            # Node resolves modules by walking up from the script, so a symlink in the task dir is enough
+            node_modules_path = os.path.join(store_dir, "node_modules")
+            if os.path.isdir(node_modules_path):
+                os.symlink(node_modules_path, os.path.join(temp_dir, "node_modules"), target_is_directory=True)
+            with open(os.path.join(temp_dir, "package.json"), 'w') as package_json_file:
+                package_json_file.write(task_requirements)
+            return {}
+        except Exception as e:
+            print(f"Error installing Node.js packages: {e}")
+            return None
     
     @classmethod
+    def normalize_gemfile(cls, task_requirements):
+        # Gemfiles are Ruby code, so only comments and blank lines are safe to drop
+        lines = []
+        for line in task_requirements.splitlines():
+            line = line.strip()
+            if line and not line.startswith("#"):
+                lines.append(line)
+        return "\n".join(lines)
+
+    @classmethod
+    @traced("install_ruby_gems")
     def install_ruby_gems(cls, temp_dir, task_requirements):
-        if task_requirements:
-            try:
-                # Path to the Gemfile within the temporary directory
-                gemfile_path = os.path.join(temp_dir, "Gemfile")
+        if not task_requirements or not task_requirements.strip():
+            return {}
+        try:
+            gemfile_contents = cls.normalize_gemfile(task_requirements)
+
+            def build_bundle(bundle_dir):
+                # Path to the Gemfile within the bundle store entry
+                gemfile_path = os.path.join(bundle_dir, "Gemfile")
                 # Write the task requirements to the Gemfile
                 with open(gemfile_path, 'w') as gemfile:
                     gemfile.write('source "https://rubygems.org"\n')
-                    gemfile.write(task_requirements)
-                # Install the gems using bundle in the temporary directory
-                # command = ["bundle", "install", "--gemfile", gemfile_path, "--path", os.path.join(temp_dir, "ruby_gems")]
+                    gemfile.write(gemfile_contents)
+                    gemfile.write("\n")
+                # Install the gems into the entry's own bundle path rather than the global Ruby environment
                 command = ["bundle", "install", "--gemfile", gemfile_path]
-                result = subprocess.run(command, capture_output=True, text=True)
+                bundle_env = dict(os.environ, BUNDLE_PATH=os.path.join(bundle_dir, "gems"), BUNDLE_APP_CONFIG=os.path.join(bundle_dir, ".bundle"))
+                result = run_command(command, env=bundle_env, timeout=BUILD_TIMEOUT_SECONDS)
                 if result.returncode != 0:
                     print(f"Error installing Ruby gems: {result.stderr}")
-                    return None
-                return temp_dir
-            except Exception as e:
-                print(f"Error installing Ruby gems: {e}")
+                    return False
+                return True
+
+            key = DependencyCache.key_for(toolchain_version("ruby", "--version"), gemfile_contents)
+            bundle_dir = RUBY_BUNDLE_CACHE.get_or_build(key, build_bundle)
+            if not bundle_dir:
                 return None
-        return None
+
+            # Load the frozen bundle at startup so a warm task never re-resolves
+            ruby_opt = " ".join(filter(None, ["-rbundler/setup", os.environ.get("RUBYOPT")]))
+            return {
+                "BUNDLE_GEMFILE": os.path.join(bundle_dir, "Gemfile"),
+                "BUNDLE_PATH": os.path.join(bundle_dir, "gems"),
+                "BUNDLE_APP_CONFIG": os.path.join(bundle_dir, ".bundle"),
+                "BUNDLE_FROZEN": "true",
+                "RUBYOPT": ruby_opt,
+            }
+        except Exception as e:
+            print(f"Error installing Ruby gems: {e}")
+            return None
     
     @classmethod
+    @traced("install_go_modules")
     def install_go_modules(cls, temp_dir, task_requirements):
-        if task_requirements:
-            try:
-                # Ensure the task_requirements contain a module declaration and Go version
-                if "module" not in task_requirements:
-                    cleaned = str.join("\n", ["\t"+e.strip() for e in task_requirements.split("\n")])
-                    task_requirements = f"module temporary_package\n\nrequire (\n{cleaned}\n)"
-
-                # Path to the go.mod file within the temporary directory
-                go_mod_path = os.path.join(temp_dir, "go.mod")
-
-                # Write the go.mod file
-                with open(go_mod_path, 'w') as go_mod_file:
-                    go_mod_file.write(task_requirements)
-
-                # Run go mod tidy to ensure all dependencies are fetched
-                command = ["go", "mod", "tidy", "-modfile", go_mod_path]
-                result = subprocess.run(command, capture_output=True, text=True, cwd=temp_dir)
-                if result.returncode != 0:
-                    print(f"Error installing Go modules: {result.stderr}")
-                    return None
+        try:
+            task_requirements = (task_requirements or "").strip()
+            # Ensure the task_requirements contain a module declaration
+            if not task_requirements:
+                task_requirements = "module temporary_package\n"
+            elif "module" not in task_requirements:
+                cleaned = str.join("\n", ["\t"+e.strip() for e in task_requirements.split("\n")])
+                task_requirements = f"module temporary_package\n\nrequire (\n{cleaned}\n)"
 
-                return temp_dir
-            except Exception as e:
-                print(f"Error installing Go modules: {e}")
-                return None
-        return None
+            # Path to the go.mod file within the temporary directory
+            go_mod_path = os.path.join(temp_dir, "go.mod")
+
+            # Write the go.mod file
+            with open(go_mod_path, 'w') as go_mod_file:
+                go_mod_file.write(task_requirements)
+
+            # Modules are fetched by `go mod tidy` in the compile step, which only runs when the
+            # binary is not cached yet; both caches are shared by every Go execution on the host
+            return {
+                "GOMODCACHE": GO_MOD_CACHE_DIR,
+                "GOCACHE": GO_BUILD_CACHE_DIR,
+            }
+        except Exception as e:
+            print(f"Error installing Go modules: {e}")
+            return None
 
     @classmethod
+    @traced("install_rust_crates")
     def install_rust_crates(cls, temp_dir, task_requirements):
-        if task_requirements:
-            try:
-                # Check for the presence of serde and serde_json
-                has_serde = "serde" in task_requirements
-                has_serde_json = "serde_json" in task_requirements
-
-                # Add serde and/or serde_json if they are missing
-                additional_dependencies = ""
-                if not has_serde:
-                    additional_dependencies += "serde = \"1.0\"\n"
-                if not has_serde_json:
-                    additional_dependencies += "serde_json = \"1.0\"\n"
-
-                if additional_dependencies:
-                    # If task_requirements already has [dependencies], append to it
-                    if "[dependencies]" in task_requirements:
-                        task_requirements += "\n" + additional_dependencies
-                    else:
-                        task_requirements = "[dependencies]\n" + additional_dependencies + task_requirements
+        try:
+            task_requirements = task_requirements or ""
+            # Check for the presence of serde and serde_json
+            has_serde = "serde" in task_requirements
+            has_serde_json = "serde_json" in task_requirements
+
+            # Add serde and/or serde_json if they are missing
+            additional_dependencies = ""
+            if not has_serde:
+                additional_dependencies += "serde = \"1.0\"\n"
+            if not has_serde_json:
+                additional_dependencies += "serde_json = \"1.0\"\n"
+
+            if additional_dependencies:
+                # If task_requirements already has [dependencies], append to it
+                if "[dependencies]" in task_requirements:
+                    task_requirements += "\n" + additional_dependencies
                 else:
-                    # Ensure [dependencies] header is present
-                    if "[dependencies]" not in task_requirements:
-                        task_requirements = "[dependencies]\n" + task_requirements
+                    task_requirements = "[dependencies]\n" + additional_dependencies + task_requirements
+            else:
+                # Ensure [dependencies] header is present
+                if "[dependencies]" not in task_requirements:
+                    task_requirements = "[dependencies]\n" + task_requirements
 
-                # Path to the Cargo.toml file within the temporary directory
-                cargo_toml_content = f"""\
+            # Path to the Cargo.toml file within the temporary directory
+            cargo_toml_content = f"""\
 [package]
 name = "temporary_package"
 version = "0.1.0"
@@ -136,23 +248,44 @@ name = "temporary_package"
 path = "src/main.rs"
 """
 
-                # Write the Cargo.toml file
-                cargo_toml_path = os.path.join(temp_dir, "Cargo.toml")
-                with open(cargo_toml_path, 'w') as cargo_toml_file:
+            def build_dependency_skeleton(skeleton_dir):
+                # Compile the dependencies once against an empty main so task builds only compile task code
+                os.makedirs(os.path.join(skeleton_dir, "src"))
+                with open(os.path.join(skeleton_dir, "src", "main.rs"), 'w') as main_rs_file:
+                    main_rs_file.write("fn main() {}\n")
+                with open(os.path.join(skeleton_dir, "Cargo.toml"), 'w') as cargo_toml_file:
                     cargo_toml_file.write(cargo_toml_content)
+                command = ["cargo", "build", "--profile", RUST_BUILD_PROFILE, "--manifest-path", os.path.join(skeleton_dir, "Cargo.toml")]
+                build_env = dict(os.environ, CARGO_TARGET_DIR=os.path.join(skeleton_dir, "target"))
+                result = run_command(command, env=build_env, timeout=BUILD_TIMEOUT_SECONDS)
+                if result.returncode != 0:
+                    print(f"Error installing Rust crates: {result.stderr}")
+                    return False
+                return True
 
-                return temp_dir
-            except Exception as e:
-                print(f"Error installing Rust crates: {e}")
+            key = DependencyCache.key_for(toolchain_version("rustc", "--version"), RUST_BUILD_PROFILE, cargo_toml_content)
+            skeleton_dir = RUST_TARGET_CACHE.get_or_build(key, build_dependency_skeleton)
+            if not skeleton_dir:
                 return None
-        return None
+
+            # Write the Cargo.toml file, pinned to the versions the skeleton was built with
+            cargo_toml_path = os.path.join(temp_dir, "Cargo.toml")
+            with open(cargo_toml_path, 'w') as cargo_toml_file:
+                cargo_toml_file.write(cargo_toml_content)
+            shutil.copyfile(os.path.join(skeleton_dir, "Cargo.lock"), os.path.join(temp_dir, "Cargo.lock"))
+
+            return {"CARGO_TARGET_DIR": os.path.join(skeleton_dir, "target")}
+        except Exception as e:
+            print(f"Error installing Rust crates: {e}")
+            return None
 
     @classmethod
+    @traced("install_java_dependencies")
     def install_java_dependencies(cls, temp_dir, task_requirements):
-        if task_requirements:
-            try:
-                # Base Jackson dependency
-                jackson_dependency = """
+        try:
+            task_requirements = task_requirements or ""
+            # Base Jackson dependency
+            jackson_dependency = """
 <dependency>
     <groupId>com.fasterxml.jackson.core</groupId>
     <artifactId>jackson-databind</artifactId>
@@ -160,12 +293,12 @@ path = "src/main.rs"
 </dependency>
 """
 
-                # Check if Jackson is already present in the task requirements
-                if "com.fasterxml.jackson.core" not in task_requirements:
-                    task_requirements += jackson_dependency
+            # Check if Jackson is already present in the task requirements
+            if "com.fasterxml.jackson.core" not in task_requirements:
+                task_requirements += jackson_dependency
 
-                # Base structure for the pom.xml file
-                pom_xml_template = f"""
+            # Base structure for the pom.xml file
+            pom_xml_template = f"""
 <project xmlns="http://maven.apache.org/POM/4.0.0" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
     xsi:schemaLocation="http://maven.apache.org/POM/4.0.0 http://maven.apache.org/xsd/maven-4.0.0.xsd">
     <modelVersion>4.0.0</modelVersion>
@@ -180,19 +313,36 @@ path = "src/main.rs"
 </project>
 """
 
+            def build_classpath(classpath_dir):
                 # Write the pom.xml file
-                pom_xml_path = os.path.join(temp_dir, "pom.xml")
+                pom_xml_path = os.path.join(classpath_dir, "pom.xml")
                 with open(pom_xml_path, 'w') as pom_xml_file:
                     pom_xml_file.write(pom_xml_template)
 
-                # Install the Maven dependencies in the temporary directory
-                command = ["mvn", "install", "-f", pom_xml_path]
-                result = subprocess.run(command, capture_output=True, text=True, cwd=temp_dir)
+                # Resolve the jars into a repository inside the entry and record their paths, so
+                # that the jars are counted against the cache size and evicted with the entry
+                command = [
+                    "mvn", "-q", "-B", "-f", pom_xml_path,
+                    f"-Dmaven.repo.local={os.path.join(classpath_dir, 'm2')}",
+                    "dependency:build-classpath",
+                    f"-Dmdep.outputFile={os.path.join(classpath_dir, 'classpath.txt')}",
+                ]
+                result = run_command(command, cwd=classpath_dir, timeout=BUILD_TIMEOUT_SECONDS)
                 if result.returncode != 0:
-                    print(f"Error installing Java dependencies: {result.stderr}")
-                    return None
-                return temp_dir
-            except Exception as e:
-                print(f"Error installing Java dependencies: {e}")
+                    # Maven reports build failures on stdout
+                    print(f"Error installing Java dependencies: {result.stdout}{result.stderr}")
+                    return False
+                return True
+
+            key = DependencyCache.key_for(pom_xml_template)
+            classpath_dir = JAVA_CLASSPATH_CACHE.get_or_build(key, build_classpath)
+            if not classpath_dir:
                 return None
-        return None
+
+            with open(os.path.join(classpath_dir, "classpath.txt")) as classpath_file:
+                classpath = classpath_file.read().strip()
+            # javac picks the resolved jars up from CLASSPATH
+            return {"CLASSPATH": classpath}
+        except Exception as e:
+            print(f"Error installing Java dependencies: {e}")
+            return None
@@ -0,0 +1,145 @@
+import collections
+import os
+import threading
+
+# Comma separated lanes as name:weight, or name=language+language:weight for a lane shared
+# by several languages. Each lane's budget is its weight's share of the scheduler's cores.
+LANES = os.getenv("COCORE_LANES", "python:2,node:2,ruby:1,go:1,rust:1,java:1")
+LANE_MAX_BORROW = float(os.getenv("COCORE_LANE_MAX_BORROW", "0.5"))  # Fraction of all cores a lane may use beyond its budget
+LANE_STATS_INTERVAL = int(os.getenv("COCORE_LANE_STATS_INTERVAL", "100"))  # Finished executions between stats reports
+DEFAULT_LANE = "other"
+
+def parse_lanes(spec):
+    """Map lane names to (weight, languages) from a COCORE_LANES value."""
+    lanes = {}
+    for entry in spec.split(","):
+        if not entry.strip():
+            continue
+        names, _, weight = entry.strip().partition(":")
+        name, _, languages = names.partition("=")
+        lanes[name] = (float(weight or 1), (languages or name).split("+"))
+    return lanes
+
+class Lane:
+    def __init__(self, name, budget):
+        self.name = name
+        self.budget = budget
+        self.cpus = 0.0
+        self.running = 0
+        self.queued = 0
+        self.started = 0
+        self.finished = 0
+        self.queue_seconds = 0.0  # Smoothed time from lease to start
+        self.run_seconds = 0.0  # Smoothed time from start to finish
+
+    @property
+    def share_used(self):
+        return self.cpus / self.budget if self.budget else float("inf")
+
+    def to_dict(self):
+        return {
+            "budget_cpus": round(self.budget, 2),
+            "cpus": round(self.cpus, 2),
+            "running": self.running,
+            "queued": self.queued,
+            "started": self.started,
+            "finished": self.finished,
+            "queue_seconds": round(self.queue_seconds, 4),
+            "run_seconds": round(self.run_seconds, 4),
+        }
+
+class ExecutionLanes:
+    """
+    Fair sharing of the scheduler's cores between languages.
+
+    Every lane has a budget of cores in proportion to its weight. Each scheduling pass
+    offers waiting work lane by lane, always to the lane using the smallest part of its
+    budget, so a burst of builds in one lane cannot keep another lane's executions
+    waiting behind it. A lane may borrow cores that the others leave idle, up to
+    LANE_MAX_BORROW of the total, but not while a lane under its budget has work waiting:
+    borrowed cores are only given back when the executions holding them finish, so the
+    cap and the reservation keep a burst of builds from taking every core.
+    """
+
+    def __init__(self, cpu_capacity, spec=LANES):
+        self.cpu_capacity = cpu_capacity
+        self.lock = threading.Lock()
+        self.lanes = {}
+        self.languages = {}
+        lanes = parse_lanes(spec)
+        total_weight = sum(weight for weight, _ in lanes.values()) or 1
+        for name, (weight, languages) in lanes.items():
+            self.lanes[name] = Lane(name, cpu_capacity * weight / total_weight)
+            for language in languages:
+                self.languages[language] = name
+
+    def lane_for(self, language):
+        name = self.languages.get(language, DEFAULT_LANE)
+        with self.lock:
+            if name not in self.lanes:
+                # Unlisted languages share a lane with the smallest configured budget
+                smallest = min((lane.budget for lane in self.lanes.values()), default=self.cpu_capacity)
+                self.lanes[name] = Lane(name, smallest)
+            return self.lanes[name]
+
+    def order(self, waiting):
+        """
+        Yield (lane, item) for waiting, a list of (language, item) oldest first, in the order
+        they should be offered. Call start() for each item that is started before asking
+        for the next, so that the order follows the lanes' usage and admits() knows which
+        lanes still have work waiting.
+        """
+        queues = collections.OrderedDict()
+        for language, item in waiting:
+            queues.setdefault(self.lane_for(language).name, collections.deque()).append(item)
+        with self.lock:
+            for name, lane in self.lanes.items():
+                lane.queued = len(queues.get(name, ()))
+        while queues:
+            with self.lock:
+                name = min(queues, key=lambda name: self.lanes[name].share_used)
+            item = queues[name].popleft()
+            if not queues[name]:
+                queues.pop(name)
+            yield self.lanes[name], item
+
+    def over_budget(self, lane):
+        with self.lock:
+            return lane.cpus >= lane.budget
+
+    def admits(self, lane, cpus):
+        """
+        Whether lane may start an execution of cpus: within its budget, or borrowing no more
+        than LANE_MAX_BORROW while no other lane under its budget has work waiting.
+        """
+        with self.lock:
+            if lane.running == 0 or lane.cpus + cpus <= lane.budget:
+                return True
+            if lane.cpus + cpus > lane.budget + LANE_MAX_BORROW * self.cpu_capacity:
+                return False
+            return not any(
+                other.queued and other.cpus < other.budget
+                for other in self.lanes.values() if other is not lane
+            )
+
+    def start(self, lane, cpus, queue_seconds):
+        with self.lock:
+            lane.cpus += cpus
+            lane.running += 1
+            lane.started += 1
+            lane.queued = max(lane.queued - 1, 0)
+            lane.queue_seconds = 0.8 * lane.queue_seconds + 0.2 * queue_seconds
+
+    def finish(self, lane, cpus, run_seconds):
+        with self.lock:
+            lane.cpus -= cpus
+            lane.running -= 1
+            lane.finished += 1
+            lane.run_seconds = 0.8 * lane.run_seconds + 0.2 * run_seconds
+            report = sum(lane.finished for lane in self.lanes.values()) % LANE_STATS_INTERVAL == 0
+        if report:
+            print(f"Lane stats: {self.stats()}")
+
+    def stats(self):
+        with self.lock:
+            return {name: lane.to_dict() for name, lane in self.lanes.items()}
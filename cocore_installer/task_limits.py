@@ -0,0 +1,282 @@
+import math
+import os
+import resource
+import signal
+import subprocess
+import threading
+import time
+import uuid
+from task_cache import directory_size
+
+TASK_TIMEOUT_SECONDS = float(os.getenv("COCORE_TASK_TIMEOUT_SECONDS", "300"))
+BUILD_TIMEOUT_SECONDS = float(os.getenv("COCORE_BUILD_TIMEOUT_SECONDS", "900"))  # Installs and compiles
+TASK_MEMORY_MAX_BYTES = int(os.getenv("COCORE_TASK_MEMORY_MB", "1024")) * 1024 * 1024
+TASK_CPUS = float(os.getenv("COCORE_TASK_CPUS", "1"))
+TASK_PIDS_MAX = int(os.getenv("COCORE_TASK_PIDS_MAX", "256"))
+# Installs and compiles run under their own, larger limits; by default they may use every core
+BUILD_MEMORY_MAX_BYTES = int(os.getenv("COCORE_BUILD_MEMORY_MB", "4096")) * 1024 * 1024
+BUILD_CPUS = float(os.getenv("COCORE_BUILD_CPUS", str(os.cpu_count() or 1)))
+BUILD_PIDS_MAX = int(os.getenv("COCORE_BUILD_PIDS_MAX", "1024"))
+CGROUP_ROOT = os.getenv("COCORE_CGROUP_ROOT", "/sys/fs/cgroup/cocore")
+CGROUP_CONTROLLERS = ("cpu", "memory", "pids")
+CPU_PERIOD_MICROSECONDS = 100000
+DISK_CHECK_INTERVAL_SECONDS = float(os.getenv("COCORE_DISK_CHECK_INTERVAL_SECONDS", "0.5"))
+
+_cgroups_checked = False
+_cgroups_available = False
+_cgroups_lock = threading.Lock()
+
+def cgroups_available():
+    """Whether per-execution cgroup v2 groups can be created under CGROUP_ROOT."""
+    global _cgroups_checked, _cgroups_available
+    with _cgroups_lock:
+        if not _cgroups_checked:
+            _cgroups_checked = True
+            try:
+                _enable_controllers()
+                _cgroups_available = True
+            except OSError as e:
+                print(f"cgroup v2 limits unavailable ({e}), falling back to rlimits")
+        return _cgroups_available
+
+def _enable_controllers():
+    parent = os.path.dirname(CGROUP_ROOT)
+    if not os.path.exists(os.path.join(parent, "cgroup.controllers")):
+        raise OSError(f"{parent} is not a cgroup v2 hierarchy")
+    os.makedirs(CGROUP_ROOT, exist_ok=True)
+    controls = " ".join(f"+{controller}" for controller in CGROUP_CONTROLLERS)
+    for path in (parent, CGROUP_ROOT):
+        with open(os.path.join(path, "cgroup.subtree_control"), 'w') as subtree_control:
+            subtree_control.write(controls)
+
+def apply_limits(cgroup_path, memory_max, cpu_seconds, file_size_max=None, pid=0):
+    """
+    Put process pid (0 for the calling process) under an execution's limits before it
+    runs any task code: join the execution's cgroup or, without one, set rlimits that
+    approximate its limits. A file_size_max caps every file the process writes either way.
+    """
+    if file_size_max:
+        resource.prlimit(pid, resource.RLIMIT_FSIZE, (file_size_max, file_size_max))
+    if cgroup_path:
+        with open(os.path.join(cgroup_path, "cgroup.procs"), 'w') as procs:
+            procs.write(str(pid or os.getpid()))
+        return
+    # RLIMIT_DATA rather than RLIMIT_AS: Go, Node and the JVM reserve far more address
+    # space than they ever touch. There is no per-tree equivalent of pids.max.
+    resource.prlimit(pid, resource.RLIMIT_DATA, (memory_max, memory_max))
+    if cpu_seconds:
+        resource.prlimit(pid, resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+
+class ExecutionLimits:
+    """
+    CPU, memory, process count, disk and wall-clock limits for one execution.
+
+    Used as a context manager around the run: on entry a cgroup is created for the
+    execution when cgroup v2 is available, and on exit anything left in it is killed
+    and the group removed. Processes started with spawn() join the group (or get
+    rlimits as a fallback) and lead their own process group, so kill() reaches the
+    whole tree either way.
+
+    With disk_max, no single file may grow beyond it (RLIMIT_FSIZE), and watch_disk()
+    kills the execution once the directory it writes to adds up to more than that.
+    """
+
+    def __init__(self, timeout=TASK_TIMEOUT_SECONDS, memory_max=TASK_MEMORY_MAX_BYTES, cpus=TASK_CPUS, pids_max=TASK_PIDS_MAX, disk_max=None):
+        self.timeout = timeout
+        self.memory_max = memory_max
+        self.cpus = cpus
+        self.pids_max = pids_max
+        self.disk_max = disk_max
+        self.disk_exceeded = False
+        self.cgroup_path = None
+        self._disk_watcher = None
+        self._disk_watch_stop = threading.Event()
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, *exc_info):
+        self.remove()
+
+    def create(self):
+        if cgroups_available():
+            try:
+                self.cgroup_path = os.path.join(CGROUP_ROOT, f"exec_{uuid.uuid4().hex}")
+                os.mkdir(self.cgroup_path)
+                self._write("memory.max", str(self.memory_max))
+                self._write("memory.swap.max", "0")
+                self._write("pids.max", str(self.pids_max))
+                self._write("cpu.max", f"{int(self.cpus * CPU_PERIOD_MICROSECONDS)} {CPU_PERIOD_MICROSECONDS}")
+            except OSError as e:
+                print(f"Error creating cgroup for execution, using rlimits: {e}")
+                self.remove()
+        return self
+
+    @property
+    def cpu_seconds(self):
+        # CPU time can never legitimately exceed the wall clock budget times the CPU share
+        if self.timeout is None:
+            return None
+        return max(1, math.ceil(self.timeout * self.cpus))
+
+    def child_config(self):
+        """Arguments for apply_limits() in a child started by something other than Popen."""
+        return {
+            "cgroup_path": self.cgroup_path,
+            "memory_max": self.memory_max,
+            "cpu_seconds": self.cpu_seconds,
+            "file_size_max": self.disk_max,
+        }
+
+    def spawn(self, command, **popen_kwargs):
+        """
+        subprocess.Popen(command, **popen_kwargs) in a new process group under these limits.
+
+        The limits are applied from this process rather than in a preexec_fn, which is
+        unsafe in a threaded worker. The child waits in a shell at a barrier until they
+        are in place and only then execs command, so no task code runs outside them.
+        """
+        barrier_read, barrier_write = os.pipe()
+        try:
+            pass_fds = (barrier_read,) + tuple(popen_kwargs.pop("pass_fds", ()))
+            process = subprocess.Popen(
+                ["bash", "-c", f'read -r _ <&{barrier_read} || exit 125; exec "$@" {barrier_read}<&-', "bash", *command],
+                process_group=0,
+                pass_fds=pass_fds,
+                **popen_kwargs,
+            )
+        except BaseException:
+            os.close(barrier_write)
+            raise
+        finally:
+            os.close(barrier_read)
+        try:
+            apply_limits(pid=process.pid, **self.child_config())
+        except BaseException:
+            os.close(barrier_write)
+            self.kill(process.pid)
+            process.wait()
+            raise
+        os.write(barrier_write, b"\n")
+        os.close(barrier_write)
+        return process
+
+    def kill(self, pid):
+        """Kill the process group led by pid and everything else in the execution's cgroup."""
+        try:
+            os.killpg(pid, signal.SIGKILL)
+        except (ProcessLookupError, PermissionError):
+            pass
+        if self.cgroup_path:
+            self._kill_cgroup()
+
+    def watch_disk(self, pid, path):
+        """
+        Poll the size of path every DISK_CHECK_INTERVAL_SECONDS until unwatch_disk(), and
+        kill the execution led by pid as soon as it is larger than disk_max.
+        """
+        if not self.disk_max:
+            return
+        self.unwatch_disk()
+        self.disk_exceeded = False
+        self._disk_watch_stop = threading.Event()
+        self._disk_watcher = threading.Thread(target=self._watch_disk, args=(pid, path, self._disk_watch_stop), daemon=True)
+        self._disk_watcher.start()
+
+    def unwatch_disk(self):
+        """Stop watching the disk; returns whether the execution was killed for exceeding disk_max."""
+        if self._disk_watcher is not None:
+            self._disk_watch_stop.set()
+            self._disk_watcher.join()
+            self._disk_watcher = None
+        return self.disk_exceeded
+
+    def _watch_disk(self, pid, path, stop):
+        while not stop.wait(DISK_CHECK_INTERVAL_SECONDS):
+            if directory_size(path) > self.disk_max:
+                self.disk_exceeded = True
+                self.kill(pid)
+                return
+
+    def oom_killed(self):
+        if not self.cgroup_path:
+            return False
+        try:
+            with open(os.path.join(self.cgroup_path, "memory.events")) as events:
+                for line in events:
+                    name, count = line.split()
+                    if name == "oom_kill" and int(count) > 0:
+                        return True
+        except (OSError, ValueError):
+            pass
+        return False
+
+    def usage(self):
+        """Resources used by everything that ran in the execution's cgroup, in usage dict form."""
+        if not self.cgroup_path:
+            return {}
+        usage = {}
+        try:
+            with open(os.path.join(self.cgroup_path, "cpu.stat")) as cpu_stat:
+                for line in cpu_stat:
+                    name, value = line.split()
+                    if name == "user_usec":
+                        usage["user_cpu_seconds"] = int(value) / 1000000
+                    elif name == "system_usec":
+                        usage["system_cpu_seconds"] = int(value) / 1000000
+            # memory.peak needs Linux 5.19
+            peak_path = os.path.join(self.cgroup_path, "memory.peak")
+            if os.path.exists(peak_path):
+                with open(peak_path) as memory_peak:
+                    usage["max_rss_bytes"] = int(memory_peak.read())
+            io_stat_path = os.path.join(self.cgroup_path, "io.stat")
+            if os.path.exists(io_stat_path):
+                usage["block_read_bytes"] = usage["block_write_bytes"] = 0
+                with open(io_stat_path) as io_stat:
+                    for line in io_stat:
+                        for field in line.split()[1:]:
+                            name, _, value = field.partition("=")
+                            if name == "rbytes":
+                                usage["block_read_bytes"] += int(value)
+                            elif name == "wbytes":
+                                usage["block_write_bytes"] += int(value)
+        except (OSError, ValueError) as e:
+            print(f"Error reading usage of cgroup {self.cgroup_path}: {e}")
+        return usage
+
+    def _write(self, name, value):
+        path = os.path.join(self.cgroup_path, name)
+        if os.path.exists(path):
+            with open(path, 'w') as control:
+                control.write(value)
+
+    def _kill_cgroup(self):
+        try:
+            self._write("cgroup.kill", "1")
+            # cgroup.kill needs Linux 5.14; signal the members one by one on older kernels
+            with open(os.path.join(self.cgroup_path, "cgroup.procs")) as procs:
+                for pid in procs.read().split():
+                    try:
+                        os.kill(int(pid), signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+        except OSError:
+            pass
+
+    def remove(self):
+        self.unwatch_disk()
+        if not self.cgroup_path:
+            return
+        self._kill_cgroup()
+        # Killed members take a moment to exit, and the group cannot be removed until they have
+        for attempt in range(50):
+            try:
+                os.rmdir(self.cgroup_path)
+                break
+            except FileNotFoundError:
+                break
+            except OSError as e:
+                if attempt == 49:
+                    print(f"Error removing cgroup {self.cgroup_path}: {e}")
+                time.sleep(0.02)
+        self.cgroup_path = None
@@ -0,0 +1,118 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from task_cache import CACHE_ROOT, DependencyCache
+
+RESULT_CACHE_ENABLED = os.getenv("COCORE_RESULT_CACHE", "1") != "0"
+RESULT_CACHE_PATH = os.getenv("COCORE_RESULT_CACHE_DB", os.path.join(CACHE_ROOT, "results.sqlite3"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("COCORE_RESULT_CACHE_TTL_SECONDS", "3600"))
+RESULT_CACHE_MAX_BYTES = int(os.getenv("COCORE_RESULT_CACHE_MAX_MB", "256")) * 1024 * 1024
+RESULT_CACHE_STATS_INTERVAL = int(os.getenv("COCORE_RESULT_CACHE_STATS_INTERVAL", "1000"))  # Lookups between stats reports
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    result TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+)
+"""
+
+def canonical_input(args):
+    return json.dumps(args, sort_keys=True, separators=(",", ":"))
+
+class ResultCache:
+    """
+    A local cache of the results of deterministic tasks, keyed by the task's language, code
+    and requirements and its canonical input JSON.
+
+    Only successful results are stored. Entries expire ttl seconds after they were
+    stored, and once the stored results exceed max_bytes the least recently used are
+    evicted. Hits, misses, stores, evictions and expirations are counted for stats().
+    """
+
+    def __init__(self, path=RESULT_CACHE_PATH, ttl=RESULT_CACHE_TTL_SECONDS, max_bytes=RESULT_CACHE_MAX_BYTES, clock=time.time):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "expirations": 0}
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(SCHEMA)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS results_last_used_at ON results (last_used_at)")
+
+    @classmethod
+    def key_for(cls, language, code, requirements, args):
+        return DependencyCache.key_for(
+            "result", language, code, json.dumps(requirements, sort_keys=True), canonical_input(args)
+        )
+
+    def get(self, key):
+        """The stored result for key, or None."""
+        now = self.clock()
+        with self.lock:
+            row = self.connection.execute("SELECT result, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row and now - row[1] > self.ttl:
+                self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.counters["expirations"] += 1
+                row = None
+            if row:
+                self.connection.execute("UPDATE results SET last_used_at = ? WHERE key = ?", (now, key))
+                self.counters["hits"] += 1
+            else:
+                self.counters["misses"] += 1
+            report = (self.counters["hits"] + self.counters["misses"]) % RESULT_CACHE_STATS_INTERVAL == 0
+        if report:
+            print(f"Result cache stats: {self.stats()}")
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        if "error" in result:
+            return
+        encoded = json.dumps(result)
+        if len(encoded) > self.max_bytes:
+            return
+        now = self.clock()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (key, encoded, len(encoded), now, now)
+            )
+            self.counters["stores"] += 1
+            expired = self.connection.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl,)).rowcount
+            self.counters["expirations"] += expired
+            self._evict()
+
+    def _evict(self):
+        total = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self.connection.execute("SELECT key, size FROM results ORDER BY last_used_at").fetchall():
+            self.connection.execute("DELETE FROM results WHERE key = ?", (key,))
+            self.counters["evictions"] += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        with self.lock:
+            entries, size = self.connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+            return dict(self.counters, entries=entries, bytes=size)
+
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Return the process-wide result cache, opening it on first use."""
+    global _result_cache
+    with _result_cache_lock:
+        if _result_cache is None:
+            _result_cache = ResultCache()
+        return _result_cache
@@ -0,0 +1,183 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_PORT = int(os.getenv("COCORE_METRICS_PORT", "0"))  # 0 leaves the endpoint off
+METRICS_HOST = os.getenv("COCORE_METRICS_HOST", "0.0.0.0")
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labels)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for name, key, extra, value in self.samples():
+            lines.append(f"{name}{format_labels(self.labels, key, extra)} {format_value(value)}")
+        return "\n".join(lines)
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from function when scraped."""
+
+    type = "gauge"
+
+    def __init__(self, name, documentation, labels=(), function=None):
+        super().__init__(name, documentation, labels)
+        self.function = function
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self.key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        if self.function is None:
+            return super().samples()
+        try:
+            value = self.function()
+        except Exception as e:
+            print(f"Error reading metric {self.name}: {e}")
+            return []
+        # A function of a labelled gauge returns {label values: value}
+        values = value if isinstance(value, dict) else {(): value}
+        return [(self.name, tuple(map(str, key)), (), value) for key, value in values.items()]
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self.key(labels)
+        with self.lock:
+            counts, total = self.values.get(key, ([0] * len(self.buckets), 0.0))
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            self.values[key] = (counts, total + value)
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, (counts, total) in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key, [("le", format_value(bound))], cumulative))
+                samples.append((f"{self.name}_sum", key, (), total))
+                samples.append((f"{self.name}_count", key, (), cumulative))
+        return samples
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=(), function=None):
+        return self.register(Gauge(name, documentation, labels, function))
+
+    def histogram(self, name, documentation, labels=(), buckets=DURATION_BUCKETS):
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format."""
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+REGISTRY = MetricsRegistry()
+
+QUEUE_LEASE_SECONDS = REGISTRY.histogram(
+    "cocore_queue_lease_seconds", "Time taken to lease jobs from the Redis queue.", ["blocking"])
+QUEUE_LEASED = REGISTRY.counter("cocore_queue_leased_total", "Jobs leased from the Redis queue.")
+EXECUTIONS_IN_FLIGHT = REGISTRY.gauge(
+    "cocore_executions_in_flight", "Task executions currently running.", ["language"])
+EXECUTIONS = REGISTRY.counter(
+    "cocore_executions_total", "Finished task executions, by whether they returned an error.", ["language", "outcome"])
+PHASE_SECONDS = REGISTRY.histogram(
+    "cocore_phase_seconds", "Duration of each phase of a task execution.", ["language", "phase"])
+CACHE_LOOKUPS = REGISTRY.counter(
+    "cocore_cache_lookups_total", "Dependency, build artifact and result cache lookups.", ["cache", "result"])
+RESULT_POST_SECONDS = REGISTRY.histogram("cocore_result_post_seconds", "Time taken to post one result to the API.")
+RESULT_POST_FAILURES = REGISTRY.counter(
+    "cocore_result_post_failures_total", "Results that could not be posted, by why.", ["reason"])
+RESULTS_SPOOLED = REGISTRY.counter("cocore_results_spooled_total", "Results written to the disk spool.")
+# Read from the scheduler when scraped; the worker sets their functions once it is running
+CONCURRENCY_TARGET = REGISTRY.gauge("cocore_concurrency_target", "Executions the concurrency controller allows at once.")
+SCHEDULED_CPUS = REGISTRY.gauge("cocore_scheduled_cpus", "Cores reserved by running executions' estimated cost.")
+LANE_QUEUED = REGISTRY.gauge("cocore_lane_queued", "Prefetched executions waiting to start, by lane.", ["lane"])
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Scrapes would flood the worker's log
+
+_server = None
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST):
+    """Serve /metrics on port in a background thread, unless port is 0. Returns the server."""
+    global _server
+    if not port or _server is not None:
+        return _server
+    _server = ThreadingHTTPServer((host, port), MetricsHandler)
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{_server.server_port}/metrics")
+    return _server
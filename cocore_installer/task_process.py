@@ -0,0 +1,216 @@
+import os
+import signal
+import subprocess
+import threading
+import time
+from task_limits import BUILD_CPUS, BUILD_MEMORY_MAX_BYTES, BUILD_PIDS_MAX, ExecutionLimits
+from task_timings import record_usage, usage_from_rusage
+
+OUTPUT_MEMORY_LIMIT = int(os.getenv("COCORE_OUTPUT_MEMORY_BYTES", str(1024 * 1024)))
+OUTPUT_DISK_LIMIT = int(os.getenv("COCORE_OUTPUT_DISK_BYTES", str(100 * 1024 * 1024)))
+READ_CHUNK_BYTES = 64 * 1024
+
+class CapturedOutput:
+    """
+    Bounded capture of one output stream.
+
+    The first OUTPUT_MEMORY_LIMIT bytes are kept in memory, the next OUTPUT_DISK_LIMIT
+    bytes spill to a file, and anything beyond that is counted but discarded. The stream
+    is always drained, so a chatty task can never block on a full pipe or exhaust the
+    memory of the worker it shares with every other execution.
+    """
+
+    def __init__(self, spill_path):
+        self.spill_path = spill_path
+        self.head = bytearray()
+        self.size = 0
+        self.spilled = 0
+        self.spill_file = None
+        self.first_write_ns = None
+
+    def write(self, chunk):
+        if self.first_write_ns is None:
+            self.first_write_ns = time.perf_counter_ns()
+        self.size += len(chunk)
+        room = OUTPUT_MEMORY_LIMIT - len(self.head)
+        if room > 0:
+            self.head += chunk[:room]
+            chunk = chunk[room:]
+        room = OUTPUT_DISK_LIMIT - self.spilled
+        if chunk and room > 0:
+            if self.spill_file is None:
+                self.spill_file = open(self.spill_path, 'wb')
+            self.spill_file.write(chunk[:room])
+            self.spilled += min(len(chunk), room)
+
+    def close(self):
+        if self.spill_file is not None:
+            self.spill_file.close()
+
+    @property
+    def truncated(self):
+        return self.size > len(self.head)
+
+    def text(self):
+        text = self.head.decode(errors="replace")
+        if self.truncated:
+            note = f"\n[output truncated: {self.size} bytes total"
+            if self.spilled:
+                note += f", {self.spilled} bytes beyond the first {len(self.head)} kept in {self.spill_path}"
+            text += note + "]"
+        return text
+
+def drain(stream, captured):
+    """Copy stream into captured until EOF, then close both."""
+    try:
+        for chunk in iter(lambda: stream.read(READ_CHUNK_BYTES), b""):
+            captured.write(chunk)
+    finally:
+        stream.close()
+        captured.close()
+
+def _feed(stream, input_data):
+    try:
+        if input_data:
+            stream.write(input_data.encode())
+    except BrokenPipeError:
+        pass  # The child exited without reading all of its input
+    finally:
+        try:
+            stream.close()
+        except BrokenPipeError:
+            pass
+
+class ProcessResult(subprocess.CompletedProcess):
+    """
+    A CompletedProcess that also records whether the run was cut short by its limits and,
+    where it can be observed, the nanoseconds from spawning the process to its first byte.
+    """
+
+    def __init__(self, args, returncode, stdout=None, stderr=None, timed_out=False, oom_killed=False, first_byte_ns=None, usage=None, disk_exceeded=False):
+        super().__init__(args, returncode, stdout, stderr)
+        self.timed_out = timed_out
+        self.oom_killed = oom_killed
+        self.first_byte_ns = first_byte_ns
+        self.usage = usage
+        self.disk_exceeded = disk_exceeded
+
+def wait_with_usage(process, timeout=None):
+    """
+    Popen.wait() that reaps the process with wait4 so that its rusage is not lost.
+    Returns the exit code and a usage dict, or raises subprocess.TimeoutExpired.
+    """
+    if timeout is None:
+        _, status, rusage = os.wait4(process.pid, 0)
+    else:
+        # Poll like Popen.wait does when given a timeout
+        deadline = time.monotonic() + timeout
+        delay = 0.0005
+        while True:
+            pid, status, rusage = os.wait4(process.pid, os.WNOHANG)
+            if pid:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(process.args, timeout)
+            delay = min(delay * 2, remaining, 0.05)
+            time.sleep(delay)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage_from_rusage(rusage)
+
+def run_process(command, cwd, env=None, input_data=None, limits=None):
+    """
+    Run command to completion with stdin fed from input_data and stdout/stderr streamed
+    into CapturedOutput buffers that spill into cwd. Returns a ProcessResult whose
+    stdout/stderr hold the captured text.
+
+    With limits (an entered ExecutionLimits), the process runs in its own process group
+    under those limits and the whole group is killed once it exits, its wall-clock
+    timeout passes or cwd grows beyond the disk limit, so no descendant can outlive the
+    execution or hold its pipes open.
+    """
+    spawn_ns = time.perf_counter_ns()
+    popen_kwargs = dict(cwd=cwd, env=env, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    process = limits.spawn(command, **popen_kwargs) if limits else subprocess.Popen(command, **popen_kwargs)
+    stdout = CapturedOutput(os.path.join(cwd, ".cocore_stdout"))
+    stderr = CapturedOutput(os.path.join(cwd, ".cocore_stderr"))
+    threads = [
+        threading.Thread(target=_feed, args=(process.stdin, input_data), daemon=True),
+        threading.Thread(target=drain, args=(process.stdout, stdout), daemon=True),
+        threading.Thread(target=drain, args=(process.stderr, stderr), daemon=True),
+    ]
+    for thread in threads:
+        thread.start()
+    if limits:
+        limits.watch_disk(process.pid, cwd)
+    timed_out = False
+    try:
+        returncode, usage = wait_with_usage(process, limits.timeout if limits else None)
+    except subprocess.TimeoutExpired:
+        timed_out = True
+        limits.kill(process.pid)
+        returncode, usage = wait_with_usage(process)
+    if limits:
+        # The cgroup also counts descendants the process never waited for
+        usage.update(limits.usage())
+    record_usage(usage)
+    if returncode == -signal.SIGXCPU:
+        # The rlimit fallback's CPU limit is derived from the same time budget
+        timed_out = True
+    disk_exceeded = returncode == -signal.SIGXFSZ
+    if limits:
+        disk_exceeded = limits.unwatch_disk() or disk_exceeded
+        limits.kill(process.pid)
+    for thread in threads:
+        thread.join()
+    oom_killed = limits.oom_killed() if limits else False
+    first_writes = [output.first_write_ns for output in (stdout, stderr) if output.first_write_ns is not None]
+    first_byte_ns = min(first_writes) - spawn_ns if first_writes else None
+    return ProcessResult(command, returncode, stdout.text(), stderr.text(), timed_out, oom_killed, first_byte_ns, usage, disk_exceeded)
+
+def run_command(command, cwd=None, env=None, timeout=None):
+    """
+    subprocess.run(command, capture_output=True, text=True) for installs and compiles,
+    except that the command runs under the build limits (BUILD_MEMORY_MAX_BYTES,
+    BUILD_CPUS and BUILD_PIDS_MAX), and once it exits or times out its whole process
+    tree is killed, not just the command itself. A run cut short by its limits returns a
+    ProcessResult with timed_out or oom_killed set.
+    """
+    with ExecutionLimits(timeout, BUILD_MEMORY_MAX_BYTES, BUILD_CPUS, BUILD_PIDS_MAX) as limits:
+        process = limits.spawn(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        outputs = {}
+
+        def read_output(name, stream):
+            with stream:
+                outputs[name] = stream.read()
+
+        # Read the pipes on threads rather than with communicate(), which would reap the
+        # process itself and lose its rusage
+        threads = [
+            threading.Thread(target=read_output, args=("stdout", process.stdout), daemon=True),
+            threading.Thread(target=read_output, args=("stderr", process.stderr), daemon=True),
+        ]
+        for thread in threads:
+            thread.start()
+        timed_out = False
+        try:
+            returncode, usage = wait_with_usage(process, timeout)
+        except subprocess.TimeoutExpired:
+            timed_out = True
+            limits.kill(process.pid)
+            returncode, usage = wait_with_usage(process)
+        usage.update(limits.usage())
+        oom_killed = limits.oom_killed()
+        # Build tools can leave daemons behind that would hold the pipes open
+        limits.kill(process.pid)
+        for thread in threads:
+            thread.join()
+    record_usage(usage)
+    if returncode == -signal.SIGXCPU:
+        timed_out = True
+    stdout, stderr = outputs.get("stdout", ""), outputs.get("stderr", "")
+    if timed_out:
+        stderr += f"\n{command[0]} timed out after {timeout} seconds."
+    elif oom_killed:
+        stderr += f"\n{command[0]} exceeded the build memory limit of {BUILD_MEMORY_MAX_BYTES // (1024 * 1024)} MiB."
+    return ProcessResult(command, returncode, stdout, stderr, timed_out=timed_out, oom_killed=oom_killed, usage=usage)
@@ -0,0 +1,55 @@
+from task_host import HOST_ID
+
+class TaskQueue:
+    """
+    Lease-based consumption of a Redis job queue.
+
+    Jobs are moved atomically from the queue into a processing list owned by this host
+    instead of being popped, and are only removed from it once acked. A job that was in
+    flight when the worker died is therefore still in the processing list, and recover()
+    puts it back at the head of the queue when the worker starts again. One worker
+    process per host is assumed, since recover() reclaims every lease of the host.
+    """
+
+    def __init__(self, redis_client, queue_name, host_id=HOST_ID):
+        self.redis = redis_client
+        self.queue_name = queue_name
+        self.processing_name = f"{queue_name}:processing:{host_id}"
+
+    def recover(self):
+        """Return the jobs leased by a previous run of this host to the queue, oldest first at the head."""
+        leased = self.redis.llen(self.processing_name)
+        if not leased:
+            return 0
+        pipeline = self.redis.pipeline(transaction=False)
+        for _ in range(leased):
+            pipeline.lmove(self.processing_name, self.queue_name, "RIGHT", "LEFT")
+        recovered = sum(1 for moved in pipeline.execute() if moved is not None)
+        print(f"Recovered {recovered} in-flight task executions from {self.processing_name}")
+        return recovered
+
+    def lease(self, count, block, timeout=1):
+        """
+        Lease up to count raw jobs in one round trip after the first. With block, waits up
+        to timeout seconds for the first job to arrive.
+        """
+        leased = []
+        if block:
+            first = self.redis.blmove(self.queue_name, self.processing_name, timeout, "LEFT", "RIGHT")
+            if first is None:
+                return leased
+            leased.append(first)
+            count -= 1
+        if count > 0:
+            pipeline = self.redis.pipeline(transaction=False)
+            for _ in range(count):
+                pipeline.lmove(self.queue_name, self.processing_name, "LEFT", "RIGHT")
+            leased.extend(job for job in pipeline.execute() if job is not None)
+        return leased
+
+    def ack(self, jobs):
+        """Release the leases of finished jobs."""
+        pipeline = self.redis.pipeline(transaction=False)
+        for job in jobs:
+            pipeline.lrem(self.processing_name, 1, job)
+        pipeline.execute()
@@ -0,0 +1,191 @@
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from task_api import RETRY_STATUS_CODES
+from task_metrics import RESULT_POST_FAILURES, RESULT_POST_SECONDS, RESULTS_SPOOLED
+
+RESULT_QUEUE_SIZE = int(os.getenv("COCORE_RESULT_QUEUE_SIZE", "1000"))
+RESULT_BATCH_SIZE = int(os.getenv("COCORE_RESULT_BATCH_SIZE", "50"))
+RESULT_LINGER_SECONDS = float(os.getenv("COCORE_RESULT_LINGER_MS", "50")) / 1000
+RESULT_SENDERS = int(os.getenv("COCORE_RESULT_SENDERS", "8"))  # Concurrent uploads per batch
+RESULT_SPOOL_DIR = os.getenv("COCORE_RESULT_SPOOL_DIR", "/var/spool/cocore/results")
+SPOOL_RETRY_SECONDS = float(os.getenv("COCORE_RESULT_SPOOL_RETRY_SECONDS", "30"))
+
+class ResultReporter:
+    """
+    Uploads execution results in the background so that worker threads never wait on
+    the network.
+
+    submit() puts a result on a bounded queue and returns. A reporter thread collects up
+    to RESULT_BATCH_SIZE results, waiting at most RESULT_LINGER_SECONDS for a batch to
+    fill, and PATCHes them concurrently over the API client's pooled connections.
+    Results that cannot be delivered after the client's retries, or that arrive while
+    the queue is full, are spooled to RESULT_SPOOL_DIR. They are retried every
+    SPOOL_RETRY_SECONDS and after every successful batch, including spool files left by
+    a previous run of the worker. A result's on_done callback is called once it is safe:
+    delivered, rejected by the API, or written to the spool.
+    """
+
+    def __init__(self, client_factory, spool_dir=RESULT_SPOOL_DIR):
+        self.client_factory = client_factory
+        self.spool_dir = spool_dir
+        self.queue = queue.Queue(maxsize=RESULT_QUEUE_SIZE)
+        self.senders = ThreadPoolExecutor(max_workers=RESULT_SENDERS)
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.spool_lock = threading.Lock()
+        self.last_spool_retry = time.monotonic()
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.thread.start()
+
+    def submit(self, execution_id, result, on_done=None):
+        """Queue a result for upload; on_done() is called once it has been delivered or spooled."""
+        try:
+            self.queue.put_nowait((execution_id, result, on_done))
+        except queue.Full:
+            print(f"Result queue full, spooling result for task execution {execution_id}")
+            if self._spool(execution_id, result):
+                self._done(execution_id, on_done)
+
+    def close(self, timeout=30):
+        """Deliver or spool everything still queued, waiting at most timeout seconds."""
+        self.stopping.set()
+        self.thread.join(timeout)
+        # Anything the reporter did not get to survives on disk until the next start
+        while True:
+            try:
+                execution_id, result, on_done = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if self._spool(execution_id, result):
+                self._done(execution_id, on_done)
+        self.senders.shutdown(wait=False)
+
+    def _run(self):
+        # Results spooled by a previous run of the worker go out first
+        self._retry_spool()
+        while True:
+            batch = self._next_batch()
+            if batch:
+                delivered = all(self.senders.map(lambda item: self._report(*item), batch))
+                if delivered and self._spooled_files():
+                    self._retry_spool()
+            elif self.stopping.is_set():
+                return
+            if time.monotonic() - self.last_spool_retry >= SPOOL_RETRY_SECONDS:
+                self._retry_spool()
+
+    def _next_batch(self):
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=1))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + RESULT_LINGER_SECONDS
+        while len(batch) < RESULT_BATCH_SIZE:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _report(self, execution_id, result, on_done):
+        """Deliver one queued result, spooling it if that fails. Returns False if it was not delivered."""
+        delivered = self._deliver(execution_id, result)
+        if delivered or self._spool(execution_id, result):
+            self._done(execution_id, on_done)
+        return delivered
+
+    def _done(self, execution_id, on_done):
+        if on_done is None:
+            return
+        try:
+            on_done()
+        except Exception as e:
+            print(f"Error in result callback for task execution {execution_id}: {e}")
+            print(traceback.format_exc())
+
+    def _deliver(self, execution_id, result, spool_path=None):
+        """
+        PATCH one result, removing its spool file at spool_path once that is done with.
+        Returns False if it should be retried later.
+        """
+        try:
+            start_time = time.perf_counter_ns()
+            response = self.client_factory().patch(f"/task_executions/{execution_id}", json={"task_execution": result})
+            upload_microseconds = (time.perf_counter_ns() - start_time) / 1000
+            RESULT_POST_SECONDS.observe(upload_microseconds / 1000000)
+        except requests.RequestException as e:
+            print(f"Error posting task result for {execution_id}: {e}")
+            RESULT_POST_FAILURES.inc(reason="connection")
+            response = None
+        except Exception as e:
+            # Not a delivery problem, e.g. a result that cannot be serialized
+            print(f"Error posting task result for {execution_id}, dropping it: {e}")
+            print(traceback.format_exc())
+            RESULT_POST_FAILURES.inc(reason="invalid")
+            if spool_path is not None:
+                os.remove(spool_path)
+            return True
+
+        if response is not None and response.status_code == 200:
+            print(f"Task result posted successfully in {upload_microseconds:.0f}us")
+        elif response is not None and response.status_code not in RETRY_STATUS_CODES:
+            # The API rejected this result; sending it again would not change that
+            print(f"Failed to post task result: {response.status_code}")
+            RESULT_POST_FAILURES.inc(reason="rejected")
+        else:
+            if response is not None:
+                RESULT_POST_FAILURES.inc(reason="retryable_status")
+            return False
+        if spool_path is not None:
+            os.remove(spool_path)
+        return True
+
+    def _spool(self, execution_id, result):
+        """Write a result to the spool; False if that failed."""
+        path = os.path.join(self.spool_dir, f"{execution_id}.json")
+        try:
+            with self.spool_lock:
+                with open(path + ".tmp", 'w') as spool_file:
+                    json.dump({"id": execution_id, "result": result}, spool_file)
+                os.replace(path + ".tmp", path)
+            RESULTS_SPOOLED.inc()
+            return True
+        except Exception as e:
+            print(f"Error spooling result for task execution {execution_id}: {e}")
+            print(traceback.format_exc())
+            return False
+
+    def _spooled_files(self):
+        try:
+            return sorted(
+                os.path.join(self.spool_dir, name)
+                for name in os.listdir(self.spool_dir)
+                if name.endswith(".json")
+            )
+        except OSError:
+            return []
+
+    def _retry_spool(self):
+        self.last_spool_retry = time.monotonic()
+        for path in self._spooled_files():
+            try:
+                with open(path) as spool_file:
+                    spooled = json.load(spool_file)
+            except (OSError, ValueError) as e:
+                print(f"Dropping unreadable spooled result {path}: {e}")
+                os.remove(path)
+                continue
+            # Stop at the first failure; the API is still unreachable
+            if not self._deliver(spooled["id"], spooled["result"], spool_path=path):
+                return
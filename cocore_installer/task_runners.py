@@ -1,16 +1,32 @@
+import glob
 import os
-import subprocess
-import tempfile
+import shutil
 import json
 import time
 import traceback
-import requests
-from task_installers import TaskInstallers
-from task_extensions import DEMARCATION
+from python_fork_server import FORK_SERVER_ENABLED, PythonForkServer
+from task_cache import DependencyCache, builds_in_thread
+from task_installers import RUST_BUILD_PROFILE, RUST_TARGET_CACHE, TaskInstallers, toolchain_version
+from task_extensions import BATCH_ENV, DEMARCATION, RESULT_PATH_ENV, TaskExtensions
+from task_limits import BUILD_TIMEOUT_SECONDS, TASK_TIMEOUT_SECONDS, ExecutionLimits
+from task_process import run_command, run_process
+from task_timings import PhaseTimings
+from task_tracing import set_span_attribute, traced
+from task_workspaces import WORKSPACE_MAX_BYTES, TaskWorkspaces, WorkspaceQuotaExceeded
+from warm_runtime_workers import WARM_WORKERS_ENABLED, WarmRuntimeWorker
+
+ARTIFACT_CACHE = DependencyCache("artifacts", int(os.getenv("COCORE_ARTIFACT_CACHE_MAX_BYTES", str(5 * 1024 ** 3))))
+RESULT_FILE_NAME = ".cocore_result.json"
+TOOLCHAIN_VERSION_COMMANDS = {
+    "go": ("go", "version"),
+    "rust": ("rustc", "--version"),
+    "java": ("javac", "-version"),
+}
+
 class TaskRunners:
     
     @classmethod
-    def run_node_task(cls, task_requirements, task_code, args, task_extension):
+    def run_node_task(cls, task_requirements, task_code, args, task_extension, warm=False, batch=False):
         return cls.run_language_task(
             language="node",
             task_requirements=task_requirements,
@@ -19,11 +35,13 @@ class TaskRunners:
             task_extension=task_extension,
             installer=TaskInstallers.install_node_packages,
             interpreter_command="node",
-            file_extension=".js"
+            file_extension=".js",
+            warm_extension=TaskExtensions.node_module_extension() if warm else None,
+            batch=batch
         )
 
     @classmethod
-    def run_ruby_task(cls, task_requirements, task_code, args, task_extension):
+    def run_ruby_task(cls, task_requirements, task_code, args, task_extension, warm=False, batch=False):
         return cls.run_language_task(
             language="ruby",
             task_requirements=task_requirements,
@@ -32,11 +50,13 @@ class TaskRunners:
             task_extension=task_extension,
             installer=TaskInstallers.install_ruby_gems,
             interpreter_command="ruby",
-            file_extension=".rb"
+            file_extension=".rb",
+            warm_extension=TaskExtensions.ruby_module_extension() if warm else None,
+            batch=batch
         )
 
     @classmethod
-    def run_python_task(cls, task_requirements, task_code, args, task_extension):
+    def run_python_task(cls, task_requirements, task_code, args, task_extension, batch=False):
         return cls.run_language_task(
             language="python",
             task_requirements=task_requirements,
@@ -45,11 +65,12 @@ class TaskRunners:
             task_extension=task_extension,
             installer=TaskInstallers.install_python_packages,
             interpreter_command="python",
-            file_extension=".py"
+            file_extension=".py",
+            batch=batch
         )
 
     @classmethod
-    def run_go_task(cls, task_requirements, task_code, args, task_extension):
+    def run_go_task(cls, task_requirements, task_code, args, task_extension, batch=False):
         package_declaration, go_imports, go_non_import_code = cls.extract_go_package_imports_and_code(task_code)
         _, ext_go_imports, ext_go_non_import_code = cls.extract_go_package_imports_and_code(task_extension)
         
@@ -69,13 +90,15 @@ class TaskRunners:
             args=args,
             task_extension=task_extension,
             installer=TaskInstallers.install_go_modules,
-            interpreter_command="go run ./task_code.go",
+            interpreter_command=lambda artifact_dir, env: [os.path.join(artifact_dir, "task_binary")],
             file_extension=".go",
-            compile_required=False
+            compile_required=True,
+            compiler=cls.compile_go_binary,
+            batch=batch
         )
 
     @classmethod
-    def run_rust_task(cls, task_requirements, task_code, args, task_extension):
+    def run_rust_task(cls, task_requirements, task_code, args, task_extension, batch=False):
         return cls.run_language_task(
             language="rust",
             task_requirements=task_requirements,
@@ -83,31 +106,16 @@ class TaskRunners:
             args=args,
             task_extension=task_extension,
             installer=TaskInstallers.install_rust_crates,
-            interpreter_command=lambda cargo_toml_path: f"cargo build --manifest-path {cargo_toml_path} && ./target/debug/temporary_package",
+            interpreter_command=lambda artifact_dir, env: [os.path.join(artifact_dir, "task_binary")],
             file_extension=".rs",
             setup_project_structure=cls.setup_rust_project_structure,
-            compile_required=True
+            compile_required=True,
+            compiler=cls.compile_rust_binary,
+            batch=batch
         )
 
     @classmethod
-    def run_java_task(cls, task_requirements, task_code, args, task_extension):
-        # Integrate task_code into the TaskCode class within task_extension
-        combined_code = cls.combine_code_and_extension(task_code, task_extension)
-
-        return cls.run_language_task(
-            language="java",
-            task_requirements=task_requirements,
-            task_code=combined_code,  # Combined code is passed here
-            args=args,
-            task_extension="",  # No separate task_extension since it is already combined
-            installer=TaskInstallers.install_java_dependencies,
-            interpreter_command="javac task_code.java && java TaskCode",  # Ensure consistent naming
-            file_extension=".java",
-            compile_required=True
-        )
-
-    @classmethod
-    def run_java_task(cls, task_requirements, task_code, args, task_extension):
+    def run_java_task(cls, task_requirements, task_code, args, task_extension, batch=False):
         # Extract imports and method definitions from the provided task_code
         task_code_lines = task_code.strip().splitlines()
         imports = set()
@@ -138,48 +146,13 @@ class TaskRunners:
             args=args,
             task_extension="",
             installer=TaskInstallers.install_java_dependencies,
-            interpreter_command="javac task_code.java && java TaskCode",
+            interpreter_command=cls.java_run_command,
             file_extension=".java",
-            compile_required=True
+            compile_required=True,
+            compiler=cls.compile_java_classes,
+            batch=batch
         )
 
-    @classmethod
-    def combine_code_and_extension(cls, task_code, task_extension):
-        # Extract imports and code from both task_code and task_extension
-        imports, non_import_code = cls.extract_imports_and_code(task_code)
-        ext_imports, non_import_extension = cls.extract_imports_and_code(task_extension)
-
-        # Combine all imports at the top, ensuring uniqueness
-        all_imports = "\n".join(sorted(imports.union(ext_imports)))
-
-        # Combine the task_code and task_extension inside the TaskCode class
-        combined_code = f"""
-{all_imports}
-
-public class TaskCode {{
-{non_import_code}
-
-{non_import_extension}
-}}
-"""
-
-        return combined_code
-
-    @classmethod
-    def extract_imports_and_code(cls, code):
-        """Extract import statements and the rest of the code separately."""
-        imports = set()
-        non_import_code = []
-
-        for line in code.splitlines():
-            if line.strip().startswith("import "):
-                imports.add(line.strip())
-            else:
-                non_import_code.append(line)
-
-        return imports, "\n".join(non_import_code)
-
-
     @classmethod
     def extract_go_package_imports_and_code(cls, code):
         """Extract Go package declaration, import statements, and the rest of the code separately."""
@@ -195,14 +168,12 @@ public class TaskCode {{
                 if not package_declaration:
                     package_declaration = line.strip()
             elif stripped_line.startswith("import "):
-                in_import_block = True
                 # Single-line import statement or start of multi-line import block
                 if stripped_line.startswith("import ("):
-                    continue  # Start of a multi-line import block
+                    in_import_block = True  # Start of a multi-line import block
                 elif stripped_line.startswith("import \""):
                     imports.add(stripped_line.replace("import", "").strip().replace("\"", ""))
                 else:
-                    in_import_block = False
                     non_import_code.append(line)
             elif in_import_block:
                 # Inside a multi-line import block
@@ -220,36 +191,56 @@ public class TaskCode {{
         return package_declaration, imports, "\n".join(non_import_code)
 
     @classmethod
-    def run_language_task(cls, language, task_requirements, task_code, args, task_extension, installer, interpreter_command, file_extension, setup_project_structure=None, compile_required=False):
+    @traced("run_language_task")
+    def run_language_task(cls, language, task_requirements, task_code, args, task_extension, installer, interpreter_command, file_extension, setup_project_structure=None, compile_required=False, compiler=None, warm_extension=None, batch=False):
+        set_span_attribute("language", language)
+        set_span_attribute("batch_size", len(args) if batch else None)
+        timings = PhaseTimings()
         try:
-            temp_dir = tempfile.mkdtemp()
-            print(temp_dir)
-            if setup_project_structure:
-                setup_project_structure(temp_dir, task_code, task_extension, task_requirements)
-            else:
-                cls.setup_generic_project_structure(temp_dir, task_code, task_extension, file_extension)
-            temp_dir_with_deps = installer(temp_dir, task_requirements)
-            if not temp_dir_with_deps:
-                return {
-                    "error": "PackageInstallationError",
-                    "error_message": f"Failed to install one or more packages for {file_extension}."
-                }
-            return cls.run_generic_task(
-                language=language,
-                task_code=task_code,
-                args=args,
-                interpreter_command=interpreter_command,
-                file_extension=file_extension,
-                temp_dir=temp_dir,
-                task_extension=task_extension,
-                compile_required=compile_required
-            )
+            with TaskWorkspaces.acquire() as temp_dir:
+                print(temp_dir)
+                with timings.phase("workspace_setup"):
+                    if setup_project_structure:
+                        setup_project_structure(temp_dir, task_code, task_extension, task_requirements)
+                    else:
+                        cls.setup_generic_project_structure(temp_dir, task_code, task_extension, file_extension)
+                builds_before = builds_in_thread()
+                with timings.phase("install"):
+                    task_env = installer(temp_dir, task_requirements)
+                timings.flag("install_cache_hit", builds_in_thread() == builds_before)
+                if task_env is None:
+                    result = {
+                        "error": "PackageInstallationError",
+                        "error_message": f"Failed to install one or more packages for {file_extension}."
+                    }
+                else:
+                    result = cls.run_generic_task(
+                        language=language,
+                        task_code=task_code,
+                        args=args,
+                        interpreter_command=interpreter_command,
+                        file_extension=file_extension,
+                        temp_dir=temp_dir,
+                        task_extension=task_extension,
+                        compile_required=compile_required,
+                        env=task_env,
+                        task_requirements=task_requirements,
+                        compiler=compiler,
+                        warm_extension=warm_extension,
+                        batch=batch,
+                        timings=timings
+                    )
+            result["timings"] = timings.to_dict()
+            result["resource_usage"] = timings.usage_dict()
+            return result
 
         except Exception as e:
             return {
                 "error": str(e),
                 "error_message": f"An error occurred while executing the task.",
-                "traceback": traceback.format_exc()
+                "traceback": traceback.format_exc(),
+                "timings": timings.to_dict(),
+                "resource_usage": timings.usage_dict()
             }
 
     @classmethod
@@ -275,6 +266,19 @@ public class TaskCode {{
             main_rs_file.write("\n")
             main_rs_file.write(task_extension)
 
+    @classmethod
+    def read_result(cls, result_path, stdout):
+        # Parsed once from the result channel; stdout is only scanned for code that bypasses the extensions
+        try:
+            with open(result_path) as result_file:
+                result_json = result_file.read()
+        except FileNotFoundError:
+            return cls.parsed_output(stdout.strip())
+        try:
+            return json.loads(result_json)
+        except ValueError:
+            return result_json
+
     @classmethod
     def parsed_output(cls, output):
         parsers = [
@@ -290,9 +294,118 @@ public class TaskCode {{
         return output
 
     @classmethod
-    def run_generic_task(cls, language, task_code, args, interpreter_command, file_extension, temp_dir, task_extension, compile_required=False):
+    def compile_go_binary(cls, temp_dir, artifact_dir, env):
+        # Resolve the modules the code actually imports, then build a standalone binary
+        tidy_process = run_command(["go", "mod", "tidy"], cwd=temp_dir, env=env, timeout=BUILD_TIMEOUT_SECONDS)
+        if tidy_process.returncode != 0:
+            return tidy_process
+        binary_path = os.path.join(artifact_dir, "task_binary")
+        return run_command(["go", "build", "-o", binary_path, "./task_code.go"], cwd=temp_dir, env=env, timeout=BUILD_TIMEOUT_SECONDS)
+
+    @classmethod
+    def compile_rust_binary(cls, temp_dir, artifact_dir, env):
+        # CARGO_TARGET_DIR points at the prebuilt dependency skeleton, so only the task crate is compiled.
+        # The target dir is shared, so the crate gets a name unique to this source; otherwise cargo
+        # could consider another task's build fresh or overwrite the binary before it is collected.
+        crate_name = f"task_{os.path.basename(artifact_dir)[:16]}"
+        cargo_toml_path = os.path.join(temp_dir, "Cargo.toml")
+        with open(cargo_toml_path) as cargo_toml_file:
+            cargo_toml_content = cargo_toml_file.read()
+        with open(cargo_toml_path, 'w') as cargo_toml_file:
+            cargo_toml_file.write(cargo_toml_content.replace('name = "temporary_package"', f'name = "{crate_name}"'))
+
+        env = dict(env or os.environ)
+        skeleton_dir = os.path.dirname(env.get("CARGO_TARGET_DIR", ""))
+        # The skeleton's entry is locked for the build, so it cannot be evicted underneath it
+        with RUST_TARGET_CACHE.in_use(os.path.basename(skeleton_dir)) as entry_dir:
+            if entry_dir:
+                target_dir = os.path.join(entry_dir, "target")
+            else:
+                # Evicted since the install step: build the dependencies in the workspace instead
+                target_dir = os.path.join(temp_dir, "target")
+            env["CARGO_TARGET_DIR"] = target_dir
+            command = ["cargo", "build", "--profile", RUST_BUILD_PROFILE, "--manifest-path", cargo_toml_path]
+            compile_process = run_command(command, cwd=temp_dir, env=env, timeout=BUILD_TIMEOUT_SECONDS)
+            # Cargo names the output directory "debug" for the dev profile
+            profile_dir = os.path.join(target_dir, "debug" if RUST_BUILD_PROFILE == "dev" else RUST_BUILD_PROFILE)
+            if compile_process.returncode == 0:
+                shutil.move(os.path.join(profile_dir, crate_name), os.path.join(artifact_dir, "task_binary"))
+            # Drop what the task crate left in the shared target dir, which would otherwise grow with every build
+            for subdir in ("", "deps", ".fingerprint", "build", "incremental"):
+                for path in glob.glob(os.path.join(profile_dir, subdir, crate_name + "*")):
+                    if os.path.isdir(path) and not os.path.islink(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+        return compile_process
+
+    @classmethod
+    def compile_java_classes(cls, temp_dir, artifact_dir, env):
+        # The resolved dependency jars are on CLASSPATH; the classes land in the artifact dir
+        return run_command(["javac", "-d", artifact_dir, "task_code.java"], cwd=temp_dir, env=env, timeout=BUILD_TIMEOUT_SECONDS)
+
+    @classmethod
+    def java_run_command(cls, artifact_dir, env):
+        classpath = os.pathsep.join(filter(None, [artifact_dir, env.get("CLASSPATH")]))
+        return ["java", "-cp", classpath, "TaskCode"]
+
+    @classmethod
+    def compile_with_cache(cls, language, source_code, task_requirements, temp_dir, compiler, env, dependency_env=None):
+        """
+        Build the task with compiler(temp_dir, artifact_dir, env) unless an artifact for the
+        same source, requirements, dependency environment and toolchain already exists.
+        Returns the artifact directory (None on failure) and the compile process, which is
+        None on a cache hit.
+        """
+        compile_processes = []
+
+        def build_artifact(artifact_dir):
+            compile_process = compiler(temp_dir, artifact_dir, env)
+            compile_processes.append(compile_process)
+            return compile_process.returncode == 0
+
+        toolchain = toolchain_version(*TOOLCHAIN_VERSION_COMMANDS[language])
+        dependency_items = sorted((dependency_env or {}).items())
+        key = DependencyCache.key_for(language, toolchain, source_code, task_requirements or "", *dependency_items)
+        artifact_dir = ARTIFACT_CACHE.get_or_build(key, build_artifact)
+        return artifact_dir, (compile_processes[0] if compile_processes else None)
+
+    @classmethod
+    def run_forked_python(cls, code_path, temp_dir, args_json, env, run_env, limits=None):
+        try:
+            fork_server = PythonForkServer.for_environment(env)
+        except Exception as e:
+            print(f"Python fork server unavailable, spawning a new interpreter: {e}")
+            process_env = dict(os.environ, **(env or {}), **run_env)
+            return run_process(["python", code_path], temp_dir, process_env, args_json, limits)
+        return fork_server.run(code_path, temp_dir, args_json, run_env, limits)
+
+    @classmethod
+    def run_warm_task(cls, language, task_code, warm_extension, file_extension, args, temp_dir, env, task_requirements, result_path, batch=False, timeout=None):
+        # Loaded as a module by a long-lived runtime instead of being run as a script
+        module_source = task_code + "\n" + warm_extension
+        code_hash = DependencyCache.key_for(language, module_source)
+        module_path = os.path.join(temp_dir, f"task_module_{code_hash[:16]}{file_extension}")
+        with open(module_path, 'w') as module_file:
+            module_file.write(module_source)
+        pool_key = DependencyCache.key_for(language, task_requirements or "", *sorted((env or {}).items()))
+        return WarmRuntimeWorker.run(language, pool_key, env, module_path, code_hash, args, temp_dir, result_path, batch, timeout)
+
+    @classmethod
+    @traced("run_generic_task")
+    def run_generic_task(cls, language, task_code, args, interpreter_command, file_extension, temp_dir, task_extension, compile_required=False, env=None, task_requirements=None, compiler=None, warm_extension=None, batch=False, timings=None):
+        set_span_attribute("warm", warm_extension is not None and WARM_WORKERS_ENABLED)
+        timings = timings or PhaseTimings()
         try:
             start_time = time.perf_counter_ns()
+            # Environment variables provided by the installer, e.g. the cached dependency paths
+            process_env = dict(os.environ, **(env or {}))
+            # The extensions write the result here rather than printing it among the task's output
+            result_path = os.path.join(temp_dir, RESULT_FILE_NAME)
+            # Variables that only the run itself sees, not the compile step
+            run_env = {RESULT_PATH_ENV: result_path}
+            if batch:
+                run_env[BATCH_ENV] = "1"
 
             # Ensure the temporary directory exists (though it should already be created by the caller)
             os.makedirs(temp_dir, exist_ok=True)
@@ -300,41 +413,73 @@ public class TaskCode {{
             # Create the full path to the code file within the temporary directory
             temp_code_file_path = os.path.join(temp_dir, f"task_code{file_extension}")
             # Write the task code to the file within the temporary directory
-            with open(temp_code_file_path, 'w') as temp_code_file:
-                temp_code_file.write(task_code)
-                temp_code_file.write("\n")
-                if language != "go":
-                    temp_code_file.write(task_extension)
+            source_code = task_code + "\n"
+            if language != "go":
+                source_code += task_extension
+            with timings.phase("workspace_setup"):
+                with open(temp_code_file_path, 'w') as temp_code_file:
+                    temp_code_file.write(source_code)
 
             args_json = json.dumps(args)
             if compile_required:
-                # Dynamically determine the command if interpreter_command is a lambda
-                if language == "rust":
-                    cargo_toml_path = os.path.join(temp_dir, "Cargo.toml")
-                    interpreter_command = interpreter_command(cargo_toml_path)
-
-                compile_command, run_command = interpreter_command.split("&&")
-                compile_command = compile_command.strip().split()
-                run_command = run_command.strip().split()
-
-                compile_process = subprocess.run(compile_command, capture_output=True, text=True, cwd=temp_dir)
-                if compile_process.returncode != 0:
+                with timings.phase("compile"):
+                    artifact_dir, compile_process = cls.compile_with_cache(language, source_code, task_requirements, temp_dir, compiler, process_env, env)
+                timings.flag("compile_cache_hit", compile_process is None)
+                if not artifact_dir:
                     return {
                         "error": "CompilationError",
                         "error_message": f"Compilation failed with exit code {compile_process.returncode}",
                         "error_details": compile_process.stderr
                     }
-                command = run_command + [args_json]
-            elif language == 'go':
-                command = interpreter_command.split()
+                # Compiled languages build their command as argv, so paths may contain spaces
+                command = interpreter_command(artifact_dir, process_env)
             else:
                 command = interpreter_command.split() + [temp_code_file_path]
             # else:
             #     command = interpreter_command.split() + [temp_code_file_path, args_json]
-            result = subprocess.run(command, cwd=temp_dir, capture_output=True, text=True)
+            # The extensions read the input arguments from stdin
+            # A batch gets the time budget of all of its items
+            limits = ExecutionLimits(timeout=TASK_TIMEOUT_SECONDS * (max(len(args), 1) if batch else 1), disk_max=WORKSPACE_MAX_BYTES)
+            with timings.phase("run"):
+                if warm_extension is not None and WARM_WORKERS_ENABLED:
+                    result = cls.run_warm_task(language, task_code, warm_extension, file_extension, args, temp_dir, env, task_requirements, result_path, batch, limits.timeout)
+                else:
+                    with limits:
+                        if language == "python" and FORK_SERVER_ENABLED:
+                            result = cls.run_forked_python(temp_code_file_path, temp_dir, args_json, env, run_env, limits)
+                        else:
+                            result = run_process(command, temp_dir, dict(process_env, **run_env), args_json, limits)
+            timings.add("first_byte", result.first_byte_ns)
 
             end_time = time.perf_counter_ns()
             execution_time_microseconds = (end_time - start_time) / 1000
+            if result.timed_out:
+                return {
+                    "error": "TimeoutError",
+                    "error_message": f"Task exceeded its time limit of {limits.timeout:g} seconds",
+                    "error_details": result.stderr
+                }
+            if result.oom_killed:
+                return {
+                    "error": "OOMKilled",
+                    "error_message": f"Task exceeded its memory limit of {limits.memory_max // (1024 * 1024)} MiB",
+                    "error_details": result.stderr
+                }
+            if result.disk_exceeded:
+                return {
+                    "error": "WorkspaceQuotaExceeded",
+                    "error_message": f"Task was stopped for writing more than its {WORKSPACE_MAX_BYTES} byte workspace quota",
+                    "error_details": result.stderr
+                }
+            # The run is only sampled while it runs, so catch anything written since the last look
+            try:
+                TaskWorkspaces.check_quota(temp_dir)
+            except WorkspaceQuotaExceeded as e:
+                return {
+                    "error": "WorkspaceQuotaExceeded",
+                    "error_message": str(e),
+                    "error_details": result.stderr
+                }
             if result.returncode != 0:
                 return {
                     "error": "ExecutionError",
@@ -342,9 +487,10 @@ public class TaskCode {{
                     "error_details": result.stderr
                 }
 
-            output = result.stdout.strip()
+            with timings.phase("parse"):
+                output = cls.read_result(result_path, result.stdout)
             return {
-                "output": TaskRunners.parsed_output(output),
+                "output": output,
                 "execution_length": execution_time_microseconds,
             }
         except Exception as e:
@@ -0,0 +1,91 @@
+import contextlib
+import threading
+import time
+from task_tracing import set_span_attribute, span
+
+# Counters that add up across processes; max_rss_bytes is a high-water mark instead
+USAGE_COUNTERS = (
+    "user_cpu_seconds",
+    "system_cpu_seconds",
+    "block_read_bytes",
+    "block_write_bytes",
+    "voluntary_context_switches",
+    "involuntary_context_switches",
+)
+BLOCK_BYTES = 512  # Unit of ru_inblock and ru_oublock
+
+_active = threading.local()
+
+def usage_from_rusage(rusage):
+    return {
+        "user_cpu_seconds": rusage.ru_utime,
+        "system_cpu_seconds": rusage.ru_stime,
+        "max_rss_bytes": rusage.ru_maxrss * 1024,  # Reported in KiB on Linux
+        "block_read_bytes": rusage.ru_inblock * BLOCK_BYTES,
+        "block_write_bytes": rusage.ru_oublock * BLOCK_BYTES,
+        "voluntary_context_switches": rusage.ru_nvcsw,
+        "involuntary_context_switches": rusage.ru_nivcsw,
+    }
+
+def combine_usage(total, usage):
+    combined = dict(total)
+    for name, value in usage.items():
+        if name in USAGE_COUNTERS:
+            combined[name] = combined.get(name, 0) + value
+        else:
+            combined[name] = max(combined.get(name, 0), value)
+    return combined
+
+def record_usage(usage):
+    """Attribute the resources used by a finished subprocess to the calling thread's current phase."""
+    timings = getattr(_active, "timings", None)
+    if timings is not None and usage:
+        timings.add_usage(usage)
+
+class PhaseTimings:
+    """
+    Monotonic durations of the phases of one execution, reported in microseconds like
+    execution_length. A phase timed more than once accumulates.
+
+    While a phase is being timed, the subprocesses the same thread runs report what they
+    consumed through record_usage(), which is aggregated per phase in the same way. Each
+    phase is traced as a span, and flags become attributes of the enclosing span.
+    """
+
+    def __init__(self):
+        self.durations = {}
+        self.flags = {}
+        self.usage = {}
+        self.current_phase = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        previous = getattr(_active, "timings", None), self.current_phase
+        _active.timings, self.current_phase = self, name
+        start = time.perf_counter_ns()
+        try:
+            # Every timed phase is also a span of the execution's trace
+            with span(name):
+                yield
+        finally:
+            self.add(name, time.perf_counter_ns() - start)
+            _active.timings, self.current_phase = previous
+
+    def add(self, name, nanoseconds):
+        if nanoseconds is not None:
+            self.durations[name] = self.durations.get(name, 0) + nanoseconds
+
+    def add_usage(self, usage):
+        self.usage[self.current_phase] = combine_usage(self.usage.get(self.current_phase, {}), usage)
+
+    def flag(self, name, value):
+        self.flags[name] = value
+        set_span_attribute(name, value)
+
+    def to_dict(self):
+        timings = {name: nanoseconds / 1000 for name, nanoseconds in self.durations.items()}
+        timings.update(self.flags)
+        return timings
+
+    def usage_dict(self):
+        return dict(self.usage)
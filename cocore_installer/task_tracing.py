@@ -0,0 +1,156 @@
+import contextlib
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import threading
+import time
+from task_host import HOST_ID
+
+TRACE_FILE = os.getenv("COCORE_TRACE_FILE", "")  # Empty leaves tracing off, e.g. /var/log/cocore/traces.jsonl
+TRACE_MAX_BYTES = int(os.getenv("COCORE_TRACE_MAX_MB", "64")) * 1024 * 1024
+TRACE_BACKUPS = int(os.getenv("COCORE_TRACE_BACKUPS", "5"))
+SERVICE_NAME = "cocore-task-worker"
+SPAN_KIND_INTERNAL = 1
+STATUS_ERROR = 2
+
+_current = threading.local()
+_logger = None
+_logger_lock = threading.Lock()
+
+def otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}  # OTLP JSON encodes 64 bit integers as strings
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+def otlp_attributes(attributes):
+    return [{"key": key, "value": otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+class Span:
+    """
+    One timed operation of a trace. Spans opened on the same thread nest; a span opened
+    with no span current starts a new trace, and the whole trace is written once that
+    root span ends.
+    """
+
+    def __init__(self, name, parent=None, start_ns=None, **attributes):
+        self.name = name
+        self.parent = parent
+        self.root = parent.root if parent else self
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes)
+        self.error = None
+        if not parent:
+            self.finished = []
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def end(self, end_ns=None):
+        self.end_ns = end_ns or time.time_ns()
+        self.root.finished.append(self)
+        if self.root is self:
+            export(self.finished)
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": SPAN_KIND_INTERNAL,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": otlp_attributes(self.attributes),
+        }
+        if self.parent:
+            span["parentSpanId"] = self.parent.span_id
+        if self.error:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+def current_span():
+    return getattr(_current, "span", None)
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """Time the block as a child of the thread's current span, or as the root of a new trace."""
+    if not TRACE_FILE:
+        yield Span(name, **attributes)
+        return
+    parent = current_span()
+    opened = Span(name, parent, **attributes)
+    _current.span = opened
+    try:
+        yield opened
+    except BaseException as e:
+        opened.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current.span = parent
+        opened.end()
+
+def record_span(name, start_ns, end_ns, **attributes):
+    """Add a child span for something that already happened, e.g. time spent queued."""
+    parent = current_span()
+    if TRACE_FILE and parent is not None:
+        Span(name, parent, start_ns, **attributes).end(end_ns)
+
+def set_span_attribute(key, value):
+    if current_span() is not None:
+        current_span().set_attribute(key, value)
+
+def traced(name):
+    """Decorator running the function in a span called name. A returned result with an error fails the span."""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name) as opened:
+                result = function(*args, **kwargs)
+                if isinstance(result, dict) and "error" in result:
+                    opened.error = str(result["error"])
+                return result
+        return wrapper
+    return decorator
+
+def trace_logger():
+    global _logger
+    with _logger_lock:
+        if _logger is None:
+            _logger = logging.getLogger("cocore.traces")
+            _logger.propagate = False
+            _logger.setLevel(logging.INFO)
+            try:
+                os.makedirs(os.path.dirname(TRACE_FILE) or ".", exist_ok=True)
+                handler = logging.handlers.RotatingFileHandler(
+                    TRACE_FILE, maxBytes=TRACE_MAX_BYTES, backupCount=TRACE_BACKUPS
+                )
+                handler.setFormatter(logging.Formatter("%(message)s"))
+                _logger.addHandler(handler)
+            except OSError as e:
+                print(f"Error opening trace file {TRACE_FILE}, traces are not written: {e}")
+                _logger.addHandler(logging.NullHandler())
+        return _logger
+
+def export(spans):
+    """Write one trace as a line of OTLP JSON, the format of an OTLP/HTTP trace export request."""
+    try:
+        request = {
+            "resourceSpans": [{
+                "resource": {"attributes": otlp_attributes({"service.name": SERVICE_NAME, "host.name": HOST_ID})},
+                "scopeSpans": [{
+                    "scope": {"name": "cocore_installer"},
+                    "spans": [span.to_otlp() for span in spans],
+                }],
+            }]
+        }
+        trace_logger().info(json.dumps(request, separators=(",", ":")))
+    except Exception as e:
+        print(f"Error writing trace: {e}")
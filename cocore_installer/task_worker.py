@@ -1,19 +1,34 @@
+import functools
 import os
 import subprocess
 import psutil
 import sys
 import asyncio
+import collections
 import json
 import ssl
-import requests
 import tempfile
+import threading
 import time
 import traceback
 import redis
 import signal
 from cryptography.fernet import Fernet
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from task_api import get_api_client
+from task_cache import DependencyCache
+from task_concurrency import get_concurrency_controller
+from task_history import get_execution_history
+from task_lanes import ExecutionLanes
+from task_memo import RESULT_CACHE_ENABLED, ResultCache, get_result_cache
+from task_metrics import (
+    CACHE_LOOKUPS, CONCURRENCY_TARGET, EXECUTIONS, EXECUTIONS_IN_FLIGHT, LANE_QUEUED, PHASE_SECONDS,
+    QUEUE_LEASE_SECONDS, QUEUE_LEASED, SCHEDULED_CPUS, start_metrics_server,
+)
+from task_queue import TaskQueue
+from task_reporter import ResultReporter
 from task_runners import TaskRunners
+from task_tracing import record_span, span
 from task_extensions import TaskExtensions
 MAX_THREADS = 10
 LANGUAGE_MAP = {
@@ -31,22 +46,25 @@ CLIENT_CERT_FILE = f"{CERT_DIR}/client.crt"
 CLIENT_KEY_FILE = f"{CERT_DIR}/client.key"
 CA_CERT_FILE = f"{CERT_DIR}/ca.crt"
 MAX_THREADS = psutil.cpu_count(logical=True)
-CPU_THRESHOLD = 80.0  # CPU usage threshold in percentage
+# Cheap executions spend most of their time starting processes and waiting, so more of them
+# than there are cores may run at once; the scheduler packs them by their estimated cost
+MAX_CONCURRENCY = int(os.getenv("COCORE_MAX_CONCURRENCY", str(MAX_THREADS * 4)))
+CPU_CAPACITY = float(os.getenv("COCORE_CPU_CAPACITY", str(MAX_THREADS)))  # Cores the scheduler hands out
+MEMORY_CAPACITY_BYTES = int(psutil.virtual_memory().total * float(os.getenv("COCORE_MEMORY_FRACTION", "0.8")))
+SCHEDULER_MAX_WAIT_SECONDS = float(os.getenv("COCORE_SCHEDULER_MAX_WAIT_SECONDS", "5"))  # Before a large job stops smaller ones overtaking it
+BATCH_MAX_SIZE = int(os.getenv("COCORE_BATCH_MAX_SIZE", "32"))  # Executions of one task run in a single process
+PREFETCH_SIZE = int(os.getenv("COCORE_PREFETCH_SIZE", str(max(1, MAX_THREADS // 4))))  # Executions held locally beyond free slots
+MAX_PREFETCHED = int(os.getenv("COCORE_MAX_PREFETCHED", str(MAX_CONCURRENCY * 2)))  # Including those waiting on a busy lane
+BLOCKED_LEASE_TIMEOUT_SECONDS = 0.1  # How long to wait for new work before re-offering prefetched work that did not fit
 def connect_to_redis():
     auth_key = load_auth_key()
     redis_url = os.getenv('REDIS_SERVER', 'redis://scheduler.cocore.io:6379/0')
     client = redis.Redis.from_url(redis_url, username=auth_key, password=auth_key)
     return client, f'job_queue:{auth_key}'
 
-def monitor_cpu_usage():
-    return psutil.cpu_percent(interval=1)
-
-def should_launch_more_threads():
-    current_cpu_usage = monitor_cpu_usage()
-    print(f"Current CPU usage: {current_cpu_usage}%")
-    return current_cpu_usage < CPU_THRESHOLD
-
+@functools.lru_cache(maxsize=None)
 def load_auth_key():
+    # Decrypted once; the key does not change while the worker runs
     try:
         with open(SECRET_KEY_FILE, "rb") as key_file:
             key = key_file.read()
@@ -54,13 +72,29 @@ def load_auth_key():
         with open(AUTH_KEY_FILE, "rb") as file:
             encrypted_key = file.read()
         auth_key = cipher_suite.decrypt(encrypted_key).decode()
-        print(f"Auth Key: {auth_key}")  # Add this line for debugging
         return auth_key
     except Exception as e:
         print(f"Error loading auth key: {e}")
         print(traceback.format_exc())
         sys.exit(1)
 
+def api_client():
+    return get_api_client(load_auth_key(), MAX_CONCURRENCY)
+
+_result_reporter = None
+_result_reporter_lock = threading.Lock()
+
+def result_reporter():
+    global _result_reporter
+    with _result_reporter_lock:
+        if _result_reporter is None:
+            _result_reporter = ResultReporter(api_client)
+        return _result_reporter
+
+def flush_results():
+    if _result_reporter is not None:
+        _result_reporter.close()
+
 def send_specs(auth_key, cpu, ram):
     payload = {
         "cpu": cpu,
@@ -93,79 +127,32 @@ def get_system_resources():
     total_memory = psutil.virtual_memory().total // (1024 * 1024)  # Convert bytes to MiB
     return total_cpus, total_memory
 
-def fetch_task_execution(execution_id):
-    try:
-        url = f"https://cocore.io/task_executions/{execution_id}.json"
-        headers = {
-            "Authorization": f"Bearer {load_auth_key()}"
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        else:
-            raise Exception(f"Failed to fetch task execution: {response.status_code}")
-    except Exception as e:
-        print(f"Error fetching task execution: {e}")
-        print(traceback.format_exc())
-        raise
-
-def run_task(task_language_id, task_requirements, task_code, input_args):
+def run_task(task_language_id, task_requirements, task_code, input_args, pure=False, batch=False):
     task_language = LANGUAGE_MAP.get(str(task_language_id))
     if "python" in task_language:
-        return TaskRunners.run_python_task(task_requirements, task_code, input_args, TaskExtensions.python_extension(input_args))
+        return TaskRunners.run_python_task(task_requirements, task_code, input_args, TaskExtensions.python_extension(), batch=batch)
     elif "node" in task_language:
-        return TaskRunners.run_node_task(task_requirements, task_code, input_args, TaskExtensions.node_extension(input_args))
+        return TaskRunners.run_node_task(task_requirements, task_code, input_args, TaskExtensions.node_extension(), warm=pure, batch=batch)
     elif "ruby" in task_language:
-        return TaskRunners.run_ruby_task(task_requirements, task_code, input_args, TaskExtensions.ruby_extension(input_args))
+        return TaskRunners.run_ruby_task(task_requirements, task_code, input_args, TaskExtensions.ruby_extension(), warm=pure, batch=batch)
     elif "go" in task_language:
-        return TaskRunners.run_go_task(task_requirements, task_code, input_args, TaskExtensions.go_extension(input_args))
+        return TaskRunners.run_go_task(task_requirements, task_code, input_args, TaskExtensions.go_extension(), batch=batch)
     elif "rust" in task_language:
-        return TaskRunners.run_rust_task(task_requirements, task_code, input_args, TaskExtensions.rust_extension(input_args))
+        return TaskRunners.run_rust_task(task_requirements, task_code, input_args, TaskExtensions.rust_extension(), batch=batch)
     elif "java" in task_language:
-        return TaskRunners.run_java_task(task_requirements, task_code, input_args, TaskExtensions.java_extension(input_args))
+        return TaskRunners.run_java_task(task_requirements, task_code, input_args, TaskExtensions.java_extension(), batch=batch)
     else:
         return {"error": "UnsupportedLanguage", "error_message": f"Language '{task_language}' is not supported."}
 
-async def process_task_execution_concurrently(execution_id, executor):
-    executor.submit(process_task_execution, execution_id)
-    return future.result()
-
-async def process_all_pending_tasks_concurrently():
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        tasks = []
-        while True:
-            task_execution = await fetch_next_task_execution()
-            if task_execution is None:
-                print("No more pending task executions found.")
-                break
-
-            execution_id = task_execution['id']
-
-            if should_launch_more_threads():
-                # Start a new asyncio task to process the execution concurrently
-                task = asyncio.create_task(process_task_execution_concurrently(execution_id, executor))
-                tasks.append(task)
-
-            await asyncio.sleep(1)  # Add delay to avoid spamming the server
-
-        # Await all tasks to ensure they complete
-        for task in tasks:
-            await task
-
 async def set_host_status(status):
     set_host_status_sync(status)
 
 def set_host_status_sync(status):
     try:
-        url = f"https://cocore.io/set_host_status"
-        headers = {
-            "Authorization": f"Bearer {load_auth_key()}",
-            "Content-Type": "application/json"
-        }
         payload = {
             "status": status
         }
-        response = requests.post(url, headers=headers, json=payload)
+        response = api_client().post("/set_host_status", json=payload)
         if response.status_code == 200:
             print(f"Host status set to {status} successfully")
         else:
@@ -174,115 +161,416 @@ def set_host_status_sync(status):
         print(f"Error setting host status to {status}: {e}")
         print(traceback.format_exc())
 
-def process_task_execution_by_task_execution(task_execution):
+def execution_span_attributes(task_execution):
+    task = task_execution['task']
+    return {
+        "execution_id": task_execution.get("id"),
+        "task_id": task.get("id"),
+        "language": task_language_name(task_execution),
+        "pure": task.get("pure", False),
+        "deterministic": task.get("deterministic", False),
+    }
+
+def process_task_execution_by_task_execution(task_execution, leased_at_ns=None):
+    with span("task_execution", **execution_span_attributes(task_execution)) as execution_span:
+        if leased_at_ns:
+            record_span("dequeue", leased_at_ns, execution_span.start_ns)
+        try:
+            execution_id = task_execution["id"]
+            task_language = task_execution['task']['language']
+            task_code = task_execution['task']['code']
+            task_requirements = task_execution['task']['requirements']
+            input_args = task_execution['input'] or []
+            # Pure tasks keep no state between calls, so they may share a warm runtime
+            pure = task_execution['task'].get('pure', False)
+            result = run_task(task_language, task_requirements, task_code, input_args, pure)
+            post_task_result(execution_id, result)
+            record_task_history(task_execution, result)
+            record_task_metrics(task_execution, result)
+            record_run_latency(task_execution, result)
+            memoize_result(task_execution, result)
+        except Exception as e:
+            print(f"Error processing task execution: {e}")
+            print(traceback.format_exc())
+            raise
+
+_result_callbacks = {}
+_result_callbacks_lock = threading.Lock()
+
+def expect_result(execution_id, on_done):
+    """Have on_done() called once the next result posted for execution_id is delivered or spooled."""
+    with _result_callbacks_lock:
+        _result_callbacks.setdefault(execution_id, []).append(on_done)
+
+def take_result_callback(execution_id):
+    """Remove and return the oldest callback expect_result() registered for execution_id, or None."""
+    with _result_callbacks_lock:
+        callbacks = _result_callbacks.get(execution_id)
+        if not callbacks:
+            return None
+        on_done = callbacks.pop(0)
+        if not callbacks:
+            del _result_callbacks[execution_id]
+        return on_done
+
+def post_task_result(execution_id, result):
+    # Uploaded in the background so the execution slot is free as soon as the task exits
+    with span("report", execution_id=execution_id, error=result.get("error")):
+        result_reporter().submit(execution_id, result, on_done=take_result_callback(execution_id))
+
+def parse_task_execution(task_execution_raw):
+    """
+    Decode a leased job, raising ValueError unless it has the fields that scheduling and
+    running an execution rely on.
+    """
+    task_execution = json.loads(task_execution_raw)
+    if not isinstance(task_execution, dict) or not isinstance(task_execution.get("task"), dict):
+        raise ValueError("not a task execution object")
+    task = task_execution["task"]
+    missing = [name for name in ("id", "input") if name not in task_execution]
+    missing += [f"task.{name}" for name in ("language", "code", "requirements") if name not in task]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    if isinstance(task_execution["id"], bool) or not isinstance(task_execution["id"], (int, str)):
+        raise ValueError("id is not an integer or string")
+    if not isinstance(task["code"], str):
+        raise ValueError("task.code is not a string")
+    if task_execution["input"] is not None and not isinstance(task_execution["input"], list):
+        raise ValueError("input is not a list")
+    return task_execution
+
+def task_batch_key(task_execution):
+    task = task_execution['task']
+    return (str(task['language']), task['code'], json.dumps(task['requirements'], sort_keys=True))
+
+def task_history_key(task_execution):
+    return DependencyCache.key_for(*task_batch_key(task_execution))
+
+def task_language_name(task_execution):
+    return LANGUAGE_MAP.get(str(task_execution['task']['language']), "unknown")
+
+def record_task_history(task_execution, result):
+    # The history only steers scheduling, so failing to record it must not fail the execution
     try:
-        execution_id = task_execution["id"]
-        task_language = task_execution['task']['language']
-        task_code = task_execution['task']['code']
-        task_requirements = task_execution['task']['requirements']
-        input_args = task_execution['input'] or []
-        result = run_task(task_language, task_requirements, task_code, input_args)
-        result_url = f"https://cocore.io/task_executions/{execution_id}"
-        headers = {
-            "Authorization": f"Bearer {load_auth_key()}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "task_execution": result
-        }
-        response = requests.patch(result_url, headers=headers, json=payload)
-        if response.status_code == 200:
-            print("Task result posted successfully")
-        else:
-            print(f"Failed to post task result: {response.status_code}")
+        get_execution_history().record(task_history_key(task_execution), task_language_name(task_execution), result)
     except Exception as e:
-        print(f"Error processing task execution: {e}")
-        print(traceback.format_exc())
-        raise
+        print(f"Error recording execution history: {e}")
 
-def process_task_execution(execution_id):
-    try:
-        task_execution = fetch_task_execution(execution_id)
-        task_language = task_execution['task']['language']
-        task_code = task_execution['task']['code']
-        task_requirements = task_execution['task']['requirements']
-        input_args = task_execution['input'] or []
-        result = run_task(task_language, task_requirements, task_code, input_args)
-
-        result_url = f"https://cocore.io/task_executions/{execution_id}"
-        headers = {
-            "Authorization": f"Bearer {load_auth_key()}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "task_execution": result
-        }
-        response = requests.patch(result_url, headers=headers, json=payload)
-        if response.status_code == 200:
-            print("Task result posted successfully")
+def record_task_metrics(task_execution, result, executions=1):
+    language = task_language_name(task_execution)
+    EXECUTIONS.inc(executions, language=language, outcome="error" if "error" in result else "success")
+    for phase, value in (result.get("timings") or {}).items():
+        if isinstance(value, bool):
+            # Flags such as install_cache_hit record how a cache lookup went
+            CACHE_LOOKUPS.inc(cache=phase[:-len("_cache_hit")], result="hit" if value else "miss")
         else:
-            print(f"Failed to post task result: {response.status_code}")
+            PHASE_SECONDS.observe(value / 1000000, language=language, phase=phase)
+
+def record_run_latency(task_execution, result):
+    """
+    Report how long a single execution's run phase took to the concurrency controller,
+    which reads the same task slowing down on the same input as contention.
+    """
+    timings = result.get("timings") or {}
+    # A run after an install or compile, or one that failed, is not comparable
+    if "error" in result or "run" not in timings:
+        return
+    if not timings.get("install_cache_hit", True) or not timings.get("compile_cache_hit", True):
+        return
+    get_concurrency_controller(MAX_CONCURRENCY).record_latency(result_cache_key(task_execution), timings["run"] / 1000000)
+
+def memoizable(task_execution):
+    # Deterministic tasks opt in to memoization, and memoize: false opts one back out
+    task = task_execution['task']
+    return RESULT_CACHE_ENABLED and task.get('deterministic', False) and task.get('memoize', True)
+
+def result_cache_key(task_execution):
+    task = task_execution['task']
+    return ResultCache.key_for(str(task['language']), task['code'], task['requirements'], task_execution['input'] or [])
+
+def memoize_result(task_execution, result):
+    if not memoizable(task_execution):
+        return
+    try:
+        # Timings and resource usage describe the run that produced the result, not later hits
+        stored = {key: value for key, value in result.items() if key not in ("timings", "resource_usage")}
+        get_result_cache().put(result_cache_key(task_execution), stored)
     except Exception as e:
-        print(f"Error processing task execution: {e}")
-        print(traceback.format_exc())
-        raise
+        print(f"Error memoizing result of task execution {task_execution['id']}: {e}")
 
-async def fetch_next_task_execution():
+def post_memoized_result(task_execution):
+    """Post the memoized result of a deterministic task execution; False if there is none."""
+    if not memoizable(task_execution):
+        return False
     try:
-        url = "https://cocore.io/task_executions/next.json"
-        headers = {
-            "Authorization": f"Bearer {load_auth_key()}",
-            "Content-Type": "application/json"
-        }
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 404:
-            return None  # No task execution found
-        else:
-            raise Exception(f"Failed to fetch next task execution: {response.status_code}")
+        result = get_result_cache().get(result_cache_key(task_execution))
     except Exception as e:
-        print(f"Error fetching next task execution: {e}")
-        print(traceback.format_exc())
-        raise
+        print(f"Error looking up memoized result of task execution {task_execution['id']}: {e}")
+        return False
+    CACHE_LOOKUPS.inc(cache="result", result="miss" if result is None else "hit")
+    if result is None:
+        return False
+    with span("task_execution", result_cache_hit=True, **execution_span_attributes(task_execution)):
+        post_task_result(task_execution["id"], dict(result, timings={"result_cache_hit": True}))
+    return True
+
+def estimate_task_cost(group):
+    """The TaskCost of running a group from group_task_executions, from the history of its task."""
+    return get_execution_history().estimate(task_history_key(group[0]), task_language_name(group[0]))
+
+def group_task_executions(task_executions):
+    """
+    Group executions of the same pure task so that each group can run in one process.
+    Anything else, including tasks not marked pure, runs on its own.
+    """
+    groups = {}
+    singles = []
+    for task_execution in task_executions:
+        if task_execution['task'].get('pure', False):
+            groups.setdefault(task_batch_key(task_execution), []).append(task_execution)
+        else:
+            singles.append([task_execution])
+    batches = []
+    for group in groups.values():
+        batches.extend(group[i:i + BATCH_MAX_SIZE] for i in range(0, len(group), BATCH_MAX_SIZE))
+    return batches + singles
+
+def process_task_execution_batch(task_executions, leased_at_ns=None):
+    """
+    Run a group from group_task_executions. A group of more than one execution is
+    passed to the task as a single batch, and each item's result is posted on its own.
+    If the batch as a whole fails, its executions are retried one at a time so that
+    one bad input cannot fail its neighbours. leased_at_ns, the wall clock time the group
+    was leased, lets its trace show how long it was queued.
+    """
+    if len(task_executions) == 1:
+        return process_task_execution_by_task_execution(task_executions[0], leased_at_ns)
 
-async def process_all_pending_tasks():
-    while True:
+    attributes = dict(execution_span_attributes(task_executions[0]), execution_id=None)
+    with span("task_execution_batch", batch_size=len(task_executions), **attributes) as batch_span:
+        if leased_at_ns:
+            record_span("dequeue", leased_at_ns, batch_span.start_ns)
+        task = task_executions[0]['task']
         try:
-            task_execution = await fetch_next_task_execution()
-            if task_execution is None:
-                print("No more pending task executions found.")
-                break
-            execution_id = task_execution['id']
-            await process_task_execution(execution_id)
-            await asyncio.sleep(1)  # Add delay to avoid spamming the server
+            batch_args = [task_execution['input'] or [] for task_execution in task_executions]
+            result = run_task(task['language'], task['requirements'], task['code'], batch_args, True, batch=True)
+            outputs = result.get("output")
+            if "error" in result or not isinstance(outputs, list) or len(outputs) != len(task_executions):
+                raise Exception(f"Batch did not return one output per execution: {result.get('error_message', outputs)}")
         except Exception as e:
-            print(f"Error processing pending tasks: {e}")
-            print(traceback.format_exc())
+            print(f"Batch of {len(task_executions)} executions failed, running them individually: {e}")
+            for task_execution in task_executions:
+                try:
+                    process_task_execution_by_task_execution(task_execution)
+                except Exception:
+                    pass  # Already logged
+            return
+
+        record_task_history(task_executions[0], result)
+        record_task_metrics(task_executions[0], result, executions=len(task_executions))
+        execution_length = result["execution_length"] // len(task_executions)
+        for task_execution, output in zip(task_executions, outputs):
+            try:
+                # Phase timings and resource usage cover the whole batch
+                post_task_result(task_execution["id"], {
+                    "output": output,
+                    "execution_length": execution_length,
+                    "timings": result.get("timings"),
+                    "resource_usage": result.get("resource_usage"),
+                })
+                memoize_result(task_execution, {"output": output, "execution_length": execution_length})
+            except Exception as e:
+                print(f"Error posting result for task execution {task_execution['id']}: {e}")
+                print(traceback.format_exc())
+
+class ExecutionSlots:
+    """
+    Tracks the executions that are running so the listener only starts work the host can take.
+
+    Each execution holds the CPU cores and memory its task is estimated to need. A new one
+    is started while the concurrency controller admits another execution and its cost fits
+    in what is left of CPU_CAPACITY and MEMORY_CAPACITY_BYTES, so many cheap executions can
+    share the host while a heavy one gets room to itself. An execution always starts on an
+    idle host, however large its estimate.
+    """
+
+    def __init__(self, controller, cpu_capacity=CPU_CAPACITY, memory_capacity=MEMORY_CAPACITY_BYTES):
+        self.controller = controller
+        self.cpu_capacity = cpu_capacity
+        self.memory_capacity = memory_capacity
+        self.in_use = 0
+        self.cpus = 0.0
+        self.memory_bytes = 0
+        self.releases = 0
+        self.condition = threading.Condition()
+        controller.on_change(self.notify)
+
+    def free(self):
+        with self.condition:
+            return max(self.controller.target - self.in_use, 0)
+
+    def try_acquire(self, cost):
+        """Reserve cost for an execution if it fits; False if it has to wait."""
+        with self.condition:
+            if self.in_use and (
+                not self.controller.admit(self.in_use)
+                or self.cpus + cost.cpus > self.cpu_capacity
+                or self.memory_bytes + cost.memory_bytes > self.memory_capacity
+            ):
+                return False
+            self.in_use += 1
+            self.cpus += cost.cpus
+            self.memory_bytes += cost.memory_bytes
+            return True
+
+    def release(self, cost):
+        with self.condition:
+            self.in_use -= 1
+            self.cpus -= cost.cpus
+            self.memory_bytes -= cost.memory_bytes
+            self.releases += 1
+            self.condition.notify_all()
+
+    def notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def wait_for_release(self, timeout, releases=None):
+        """
+        Block until a slot may be free or timeout passes; True if the controller admits
+        another execution. With releases, also waits until an execution has finished since
+        self.releases had that value.
+        """
+        with self.condition:
+            if not self.controller.admit(self.in_use) or self.releases == releases:
+                self.condition.wait(timeout)
+            return self.controller.admit(self.in_use)
 
 def task_listener():
     redis_client, queue_name = connect_to_redis()
-    
-    with ThreadPoolExecutor(max_workers=MAX_THREADS) as executor:
-        futures = []
-        
+    task_queue = TaskQueue(redis_client, queue_name)
+    task_queue.recover()
+    controller = get_concurrency_controller(MAX_CONCURRENCY)
+    slots = ExecutionSlots(controller)
+    lanes = ExecutionLanes(slots.cpu_capacity)
+    CONCURRENCY_TARGET.function = lambda: controller.target
+    SCHEDULED_CPUS.function = lambda: slots.cpus
+    LANE_QUEUED.function = lambda: {(name,): lane["queued"] for name, lane in lanes.stats().items()}
+    # Executions leased from Redis that have not finished yet, with their raw jobs and when
+    # they were leased
+    prefetched = collections.deque()
+    leased_jobs = {}
+    blocked_releases = None
+
+    def release_lease(task_execution_raw):
+        # A job stays leased until its result is delivered or spooled, so that if the worker
+        # dies before then, recover() hands the job out again
+        def release():
+            try:
+                task_queue.ack([task_execution_raw])
+            except Exception as e:
+                print(f"Error acking task execution: {e}")
+                print(traceback.format_exc())
+        return release
+
+    def finish(group, lane, cost, started):
+        def done(future):
+            slots.release(cost)
+            lanes.finish(lane, cost.cpus, time.monotonic() - started)
+            EXECUTIONS_IN_FLIGHT.dec(len(group), language=task_language_name(group[0]))
+            for task_execution in group:
+                leased_jobs.pop(id(task_execution), None)
+                # An execution that failed without posting a result is done with all the same
+                unreported = take_result_callback(task_execution["id"])
+                if unreported is not None:
+                    unreported()
+        return done
+
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as executor:
+        def wanted():
+            # Executions waiting on a lane at or over its budget may wait for a long time, so
+            # they do not use up the prefetch allowance and the listener keeps leasing past them
+            blocked = sum(
+                1 for task_execution in prefetched
+                if lanes.over_budget(lanes.lane_for(task_language_name(task_execution)))
+            )
+            return min(slots.free() + PREFETCH_SIZE - (len(prefetched) - blocked), MAX_PREFETCHED - len(prefetched))
+
         while True:
-            if should_launch_more_threads():
-                # Use BLPOP to block until a task is available
-                _, task_execution_raw = redis_client.blpop(queue_name, timeout=0)
-                if task_execution_raw:
-                    task_execution = json.loads(task_execution_raw)
-                    future = executor.submit(process_task_execution_by_task_execution, task_execution)
-                    futures.append(future)
-                else:
-                    print("No task found in the queue.")
-            # Clean up completed futures
-            futures = [f for f in futures if not f.done()]
-            time.sleep(1)  # Avoid spamming Redis with requests
+            # When nothing prefetched fitted last time and no more may be leased, only a
+            # finished execution can change that
+            if not slots.wait_for_release(timeout=1, releases=blocked_releases if wanted() <= 0 else None):
+                continue
+
+            count = wanted()
+            if count > 0:
+                # Only block on Redis when there is nothing local to start, or briefly when
+                # nothing local fitted
+                block = not prefetched or blocked_releases is not None
+                timeout = BLOCKED_LEASE_TIMEOUT_SECONDS if prefetched else 1
+                finished_raw = []
+                lease_started = time.perf_counter()
+                leased = task_queue.lease(count, block=block, timeout=timeout)
+                QUEUE_LEASE_SECONDS.observe(time.perf_counter() - lease_started, blocking=str(block).lower())
+                QUEUE_LEASED.inc(len(leased))
+                for task_execution_raw in leased:
+                    try:
+                        task_execution = parse_task_execution(task_execution_raw)
+                    except ValueError as e:
+                        print(f"Dropping malformed task execution ({e}): {task_execution_raw!r}")
+                        finished_raw.append(task_execution_raw)
+                        continue
+                    # One bad job must not take the listener down, or recover() would hand
+                    # it straight back after the restart
+                    try:
+                        expect_result(task_execution["id"], release_lease(task_execution_raw))
+                        # A memoized result is posted straight away, without taking a slot
+                        if post_memoized_result(task_execution):
+                            continue
+                        leased_jobs[id(task_execution)] = (task_execution, task_execution_raw, time.monotonic())
+                        prefetched.append(task_execution)
+                    except Exception as e:
+                        print(f"Dropping task execution {task_execution['id']}: {e}")
+                        print(traceback.format_exc())
+                        take_result_callback(task_execution["id"])
+                        finished_raw.append(task_execution_raw)
+                if finished_raw:
+                    task_queue.ack(finished_raw)
+            if not prefetched:
+                blocked_releases = None
+                continue
+
+            # Repeated pure tasks among the prefetched executions are run as batches, and
+            # groups are offered oldest first within their language's lane, lane by lane,
+            # and started wherever their estimated cost fits
+            groups = group_task_executions(list(prefetched))
+            groups.sort(key=lambda group: leased_jobs[id(group[0])][2])
+            prefetched.clear()
+            releases = slots.releases
+            started_any = False
+            reserved = False
+            for lane, group in lanes.order([(task_language_name(group[0]), group) for group in groups]):
+                if not reserved:
+                    cost = estimate_task_cost(group)
+                    if lanes.admits(lane, cost.cpus) and slots.try_acquire(cost):
+                        leased_at = leased_jobs[id(group[0])][2]
+                        lanes.start(lane, cost.cpus, time.monotonic() - leased_at)
+                        EXECUTIONS_IN_FLIGHT.inc(len(group), language=task_language_name(group[0]))
+                        leased_at_ns = time.time_ns() - int((time.monotonic() - leased_at) * 1000000000)
+                        future = executor.submit(process_task_execution_batch, group, leased_at_ns)
+                        future.add_done_callback(finish(group, lane, cost, time.monotonic()))
+                        started_any = True
+                        continue
+                    # Keep cheaper work from overtaking a large job forever: once it has
+                    # waited long enough, nothing behind it starts until it fits
+                    reserved = time.monotonic() - leased_jobs[id(group[0])][2] >= SCHEDULER_MAX_WAIT_SECONDS
+                prefetched.extend(group)
+            blocked_releases = None if started_any or not prefetched else releases
 
 def shutdown_handler(signal_received, frame):
     """Handle shutdown signals and set host status to offline."""
     print(f"Received exit signal {signal_received}...")
+    flush_results()
     set_host_status("offline")
     sys.exit(0)
 
@@ -292,8 +580,10 @@ async def main():
     auth_key = load_auth_key()
     send_specs(auth_key, total_cpus, total_memory)
 
+    start_metrics_server()  # Only if COCORE_METRICS_PORT is set
+
     try:
-        await process_all_pending_tasks_concurrently()  # Process all pending tasks concurrently
+        # Work that was in flight before a restart is recovered from Redis by the listener
         task_listener()  # Start listening for new tasks
     except Exception as e:
         print(f"Exception occurred in main loop: {e}")
@@ -311,4 +601,5 @@ if __name__ == "__main__":
     try:
         asyncio.run(main())  # Run the main event loop
     finally:
+        flush_results()
         set_host_status_sync("offline")
\ No newline at end of file
@@ -0,0 +1,154 @@
+import os
+import queue
+import shutil
+import tempfile
+import threading
+import traceback
+import psutil
+from task_cache import directory_size
+
+def _default_workspace_root():
+    # /dev/shm is tmpfs on practically every Linux host, which keeps the many small
+    # files a task writes out of the page cache writeback path entirely
+    if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+        return "/dev/shm/cocore_workspaces"
+    return os.path.join(tempfile.gettempdir(), "cocore_workspaces")
+
+WORKSPACE_ROOT = os.getenv("COCORE_WORKSPACE_DIR", _default_workspace_root())
+WORKSPACE_POOL_SIZE = int(os.getenv("COCORE_WORKSPACE_POOL_SIZE", "16"))  # Clean directories kept ready for reuse
+WORKSPACE_MAX_BYTES = int(os.getenv("COCORE_WORKSPACE_MAX_MB", "512")) * 1024 * 1024
+WORKSPACE_STATS_INTERVAL = int(os.getenv("COCORE_WORKSPACE_STATS_INTERVAL", "100"))  # Releases between stats reports
+
+class WorkspaceQuotaExceeded(Exception):
+    pass
+
+class TaskWorkspaces:
+    """
+    Hands out per-execution working directories under WORKSPACE_ROOT.
+
+    Released workspaces are emptied by a background thread, off the execution path, and
+    kept in a pool of up to WORKSPACE_POOL_SIZE clean directories that the next
+    executions reuse. A workspace that grew beyond WORKSPACE_MAX_BYTES is discarded
+    rather than recycled. Each worker process gets its own subdirectory of the root;
+    those left behind by processes that no longer exist are removed on first use.
+    """
+
+    _lock = threading.Lock()
+    _idle = []
+    _cleanup_queue = queue.Queue()
+    _cleaner = None
+    _root = None
+    _stats = {
+        "acquired": 0,
+        "created": 0,
+        "reused": 0,
+        "released": 0,
+        "recycled": 0,
+        "discarded": 0,
+        "quota_exceeded": 0,
+        "cleanup_failures": 0,
+        "bytes_cleaned": 0,
+    }
+
+    @classmethod
+    def acquire(cls):
+        """Return a context manager that yields an empty workspace and always releases it."""
+        return _Workspace(cls)
+
+    @classmethod
+    def checkout(cls):
+        root = cls._ensure_started()
+        with cls._lock:
+            cls._stats["acquired"] += 1
+            if cls._idle:
+                cls._stats["reused"] += 1
+                return cls._idle.pop()
+            cls._stats["created"] += 1
+        return tempfile.mkdtemp(prefix="ws_", dir=root)
+
+    @classmethod
+    def release(cls, path):
+        with cls._lock:
+            cls._stats["released"] += 1
+        cls._cleanup_queue.put(path)
+
+    @classmethod
+    def check_quota(cls, path):
+        """Raise WorkspaceQuotaExceeded if the workspace at path is larger than WORKSPACE_MAX_BYTES."""
+        size = directory_size(path)
+        if size > WORKSPACE_MAX_BYTES:
+            with cls._lock:
+                cls._stats["quota_exceeded"] += 1
+            raise WorkspaceQuotaExceeded(f"Task workspace uses {size} bytes, more than the {WORKSPACE_MAX_BYTES} byte quota.")
+        return size
+
+    @classmethod
+    def stats(cls):
+        with cls._lock:
+            return dict(cls._stats, idle=len(cls._idle), pending_cleanup=cls._cleanup_queue.qsize())
+
+    @classmethod
+    def _ensure_started(cls):
+        with cls._lock:
+            if cls._cleaner is None:
+                cls._root = os.path.join(WORKSPACE_ROOT, str(os.getpid()))
+                os.makedirs(cls._root, exist_ok=True)
+                cls._remove_orphans()
+                cls._cleaner = threading.Thread(target=cls._clean_forever, daemon=True)
+                cls._cleaner.start()
+            return cls._root
+
+    @classmethod
+    def _remove_orphans(cls):
+        for name in os.listdir(WORKSPACE_ROOT):
+            if name.isdigit() and not psutil.pid_exists(int(name)):
+                shutil.rmtree(os.path.join(WORKSPACE_ROOT, name), ignore_errors=True)
+
+    @classmethod
+    def _clean_forever(cls):
+        while True:
+            path = cls._cleanup_queue.get()
+            try:
+                cls._clean(path)
+            except Exception as e:
+                with cls._lock:
+                    cls._stats["cleanup_failures"] += 1
+                print(f"Error cleaning workspace {path}: {e}")
+                print(traceback.format_exc())
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def _clean(cls, path):
+        size = directory_size(path)
+        over_quota = size > WORKSPACE_MAX_BYTES
+        for entry in os.scandir(path):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+        with cls._lock:
+            cls._stats["bytes_cleaned"] += size
+            recycle = not over_quota and len(cls._idle) < WORKSPACE_POOL_SIZE
+            if recycle:
+                cls._idle.append(path)
+                cls._stats["recycled"] += 1
+            else:
+                cls._stats["discarded"] += 1
+            report = cls._stats["released"] % WORKSPACE_STATS_INTERVAL == 0
+        if not recycle:
+            shutil.rmtree(path, ignore_errors=True)
+        if report:
+            print(f"Workspace stats: {cls.stats()}")
+
+class _Workspace:
+    def __init__(self, workspaces):
+        self.workspaces = workspaces
+        self.path = None
+
+    def __enter__(self):
+        self.path = self.workspaces.checkout()
+        return self.path
+
+    def __exit__(self, *exc_info):
+        self.workspaces.release(self.path)
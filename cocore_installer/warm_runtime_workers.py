@@ -0,0 +1,309 @@
+import collections
+import json
+import os
+import select
+import subprocess
+import threading
+import time
+import psutil
+from task_limits import ExecutionLimits
+from task_process import OUTPUT_MEMORY_LIMIT, ProcessResult
+from task_timings import USAGE_COUNTERS, record_usage
+from task_workspaces import WORKSPACE_MAX_BYTES
+
+WARM_WORKERS_ENABLED = os.getenv("COCORE_WARM_WORKERS", "1") == "1"
+MAX_EXECUTIONS_PER_WORKER = int(os.getenv("COCORE_WARM_WORKER_MAX_EXECUTIONS", "1000"))
+MAX_WORKER_RSS_BYTES = int(os.getenv("COCORE_WARM_WORKER_MAX_RSS_MB", "512")) * 1024 * 1024
+MAX_IDLE_WORKERS_PER_SET = int(os.getenv("COCORE_WARM_WORKERS_PER_SET", "4"))
+MAX_IDLE_WORKERS = int(os.getenv("COCORE_WARM_WORKERS_MAX", "16"))  # Across all dependency sets
+WORKER_IDLE_SECONDS = float(os.getenv("COCORE_WARM_WORKER_IDLE_SECONDS", "300"))
+
+# Both hosts read one JSON request per line on stdin and answer with one JSON line on the
+# response fd, so anything the task prints outside of run() can never corrupt the protocol.
+# The result itself goes to the request's result file, like the script extensions write it.
+# Captured output is capped at COCORE_OUTPUT_MEMORY_BYTES.
+NODE_HOST = """
+const fs = require('fs');
+const readline = require('readline');
+const responseFd = Number(process.env.COCORE_RESPONSE_FD);
+const outputLimit = Number(process.env.COCORE_OUTPUT_MEMORY_BYTES);
+const modules = new Map();
+readline.createInterface({ input: process.stdin }).on('line', (line) => {
+  const request = JSON.parse(line);
+  let output = '';
+  const write = process.stdout.write;
+  process.stdout.write = (chunk) => {
+    if (output.length < outputLimit) output += String(chunk).slice(0, outputLimit - output.length);
+    return true;
+  };
+  let response;
+  try {
+    process.chdir(request.cwd);
+    if (!modules.has(request.code_hash)) {
+      modules.set(request.code_hash, require(request.module_path));
+    }
+    const run = modules.get(request.code_hash).run;
+    const orNull = (value) => (value === undefined ? null : value);
+    const result = request.batch
+      ? request.args.map((itemArgs) => orNull(run(...itemArgs)))
+      : orNull(run(...request.args));
+    fs.writeFileSync(request.result_path, JSON.stringify(result));
+    response = JSON.stringify({ ok: true, output });
+  } catch (e) {
+    response = JSON.stringify({ ok: false, output, error: String((e && e.stack) || e) });
+  } finally {
+    process.stdout.write = write;
+  }
+  fs.writeSync(responseFd, response + '\\n');
+});
+"""
+
+RUBY_HOST = """
+require 'json'
+require 'stringio'
+
+class BoundedOutput < StringIO
+  def write(*chunks)
+    room = Integer(ENV['COCORE_OUTPUT_MEMORY_BYTES']) - string.bytesize
+    super(chunks.map(&:to_s).join.byteslice(0, [room, 0].max))
+  end
+end
+
+responses = IO.new(Integer(ENV['COCORE_RESPONSE_FD']), 'w')
+responses.sync = true
+modules = {}
+STDIN.each_line do |line|
+  request = JSON.parse(line)
+  captured = BoundedOutput.new
+  original_stdout = $stdout
+  $stdout = captured
+  begin
+    Dir.chdir(request['cwd'])
+    mod = modules[request['code_hash']] ||= Module.new.tap do |m|
+      m.module_eval(File.read(request['module_path']), request['module_path'])
+    end
+    task = Object.new.extend(mod)
+    result = request['batch'] ? request['args'].map { |item_args| task.run(*item_args) } : task.run(*request['args'])
+    File.write(request['result_path'], JSON.generate(result))
+    response = JSON.generate({ ok: true, output: captured.string })
+  rescue Exception => e
+    response = JSON.generate({ ok: false, output: captured.string, error: e.full_message(highlight: false) })
+  ensure
+    $stdout = original_stdout
+  end
+  responses.puts(response)
+end
+"""
+
+HOST_COMMANDS = {
+    "node": ["node", "-e", NODE_HOST],
+    "ruby": ["ruby", "-e", RUBY_HOST],
+}
+
+class WarmRuntimeWorker:
+    """
+    A long-lived Node or Ruby process that loads task code as a module and calls its
+    run(...args) once per request, instead of booting a fresh runtime per execution.
+
+    Idle workers are pooled per dependency set and recycled after
+    MAX_EXECUTIONS_PER_WORKER calls or once their RSS exceeds MAX_WORKER_RSS_BYTES. At
+    most MAX_IDLE_WORKERS are kept idle in all, evicting those of the least recently
+    used dependency sets first, and a worker left idle for WORKER_IDLE_SECONDS is stopped.
+    """
+
+    _idle = collections.OrderedDict()  # Least recently used dependency set first
+    _idle_lock = threading.Lock()
+    _reaper = None
+
+    @classmethod
+    def run(cls, language, pool_key, env, module_path, code_hash, args, cwd, result_path, batch=False, timeout=None):
+        """
+        Run a task module in a pooled worker, with its result written to result_path, and
+        return a ProcessResult. With batch, args is a list of argument lists. A call that
+        takes longer than timeout seconds kills the worker.
+        """
+        worker = cls._checkout(language, pool_key, env)
+        counters_before = worker.counters()
+        worker.limits.watch_disk(worker.process.pid, cwd)
+        try:
+            response = worker.call({
+                "module_path": module_path,
+                "code_hash": code_hash,
+                "args": args,
+                "cwd": cwd,
+                "result_path": result_path,
+                "batch": batch,
+            }, timeout)
+        except Exception:
+            worker.stop()
+            raise
+
+        disk_exceeded = worker.limits.unwatch_disk()
+        command = [language, module_path]
+        usage = worker.usage_since(counters_before)
+        record_usage(usage)
+        if response is None:
+            timed_out = worker.timed_out
+            oom_killed = worker.limits.oom_killed()
+            worker.stop()
+            return ProcessResult(command, 1, "", "Warm worker terminated unexpectedly.", timed_out, oom_killed, usage=usage, disk_exceeded=disk_exceeded)
+        cls._checkin(pool_key, worker)
+        if not response["ok"]:
+            return ProcessResult(command, 1, response["output"], response["error"], usage=usage)
+        return ProcessResult(command, 0, response["output"], "", usage=usage)
+
+    @classmethod
+    def _checkout(cls, language, pool_key, env):
+        dead = []
+        worker = None
+        with cls._idle_lock:
+            idle = cls._idle.get(pool_key, [])
+            while idle:
+                candidate = idle.pop()
+                if candidate.process.poll() is None:
+                    worker = candidate
+                    break
+                dead.append(candidate)
+            if not idle:
+                cls._idle.pop(pool_key, None)
+        for candidate in dead:
+            candidate.stop()
+        return worker or cls(language, env)
+
+    @classmethod
+    def _checkin(cls, pool_key, worker):
+        if worker.executions >= MAX_EXECUTIONS_PER_WORKER or worker.rss() > MAX_WORKER_RSS_BYTES:
+            worker.stop()
+            return
+        worker.idle_since = time.monotonic()
+        with cls._idle_lock:
+            if cls._reaper is None:
+                cls._reaper = threading.Thread(target=cls._reap_forever, daemon=True)
+                cls._reaper.start()
+            idle = cls._idle.setdefault(pool_key, [])
+            cls._idle.move_to_end(pool_key)
+            stopped = [] if len(idle) < MAX_IDLE_WORKERS_PER_SET else [worker]
+            if not stopped:
+                idle.append(worker)
+            stopped += cls._evict()
+        for idle_worker in stopped:
+            idle_worker.stop()
+
+    @classmethod
+    def _evict(cls):
+        """Remove the workers over the idle limits from the pool and return them; call with _idle_lock held."""
+        evicted = []
+        now = time.monotonic()
+        for pool_key, idle in list(cls._idle.items()):
+            expired = [worker for worker in idle if now - worker.idle_since >= WORKER_IDLE_SECONDS]
+            evicted += expired
+            idle[:] = [worker for worker in idle if worker not in expired]
+            if not idle:
+                del cls._idle[pool_key]
+        total = sum(len(idle) for idle in cls._idle.values())
+        while total > MAX_IDLE_WORKERS:
+            pool_key, idle = next(iter(cls._idle.items()))
+            evicted.append(idle.pop(0))  # The longest idle worker of the least recently used set
+            if not idle:
+                del cls._idle[pool_key]
+            total -= 1
+        return evicted
+
+    @classmethod
+    def _reap_forever(cls):
+        # Stops idle workers even when no more executions come along to check them in
+        while True:
+            time.sleep(min(WORKER_IDLE_SECONDS, 60))
+            with cls._idle_lock:
+                evicted = cls._evict()
+            for worker in evicted:
+                worker.stop()
+
+    def __init__(self, language, env):
+        # Memory, process and file size limits cover the worker for its whole life; the
+        # wall-clock and workspace limits are applied per call instead
+        self.limits = ExecutionLimits(timeout=None, disk_max=WORKSPACE_MAX_BYTES).create()
+        response_read_fd, response_write_fd = os.pipe()
+        try:
+            process_env = dict(
+                os.environ,
+                **(env or {}),
+                COCORE_RESPONSE_FD=str(response_write_fd),
+                COCORE_OUTPUT_MEMORY_BYTES=str(OUTPUT_MEMORY_LIMIT),
+            )
+            self.process = self.limits.spawn(
+                HOST_COMMANDS[language],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(response_write_fd,),
+                text=True,
+                env=process_env,
+            )
+        except Exception:
+            os.close(response_read_fd)
+            self.limits.remove()
+            raise
+        finally:
+            os.close(response_write_fd)
+        self.responses = os.fdopen(response_read_fd, 'r')
+        self.executions = 0
+        self.timed_out = False
+        self.idle_since = None
+
+    def call(self, request, timeout=None):
+        self.executions += 1
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        # Responses are written as single lines, so once one is readable it can be read whole
+        readable, _, _ = select.select([self.responses], [], [], timeout)
+        if not readable:
+            self.timed_out = True
+            return None
+        line = self.responses.readline()
+        return json.loads(line) if line else None
+
+    def counters(self):
+        """Cumulative resource counters of the worker process, or {} once it has exited."""
+        try:
+            process = psutil.Process(self.process.pid)
+            with process.oneshot():
+                cpu_times = process.cpu_times()
+                io_counters = process.io_counters()
+                ctx_switches = process.num_ctx_switches()
+                return {
+                    "user_cpu_seconds": cpu_times.user,
+                    "system_cpu_seconds": cpu_times.system,
+                    "block_read_bytes": io_counters.read_bytes,
+                    "block_write_bytes": io_counters.write_bytes,
+                    "voluntary_context_switches": ctx_switches.voluntary,
+                    "involuntary_context_switches": ctx_switches.involuntary,
+                    "max_rss_bytes": process.memory_info().rss,
+                }
+        except psutil.Error:
+            return {}
+
+    def usage_since(self, before):
+        """Usage of the calls made since counters() returned before; RSS is the worker's current size."""
+        after = self.counters()
+        usage = {name: value - before[name] for name, value in after.items() if name in USAGE_COUNTERS and name in before}
+        if "max_rss_bytes" in after:
+            usage["max_rss_bytes"] = after["max_rss_bytes"]
+        return usage
+
+    def rss(self):
+        try:
+            return psutil.Process(self.process.pid).memory_info().rss
+        except psutil.Error:
+            return 0
+
+    def stop(self):
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        if self.process.poll() is None:
+            self.limits.kill(self.process.pid)
+            self.process.wait()
+        self.limits.remove()
+        self.responses.close()
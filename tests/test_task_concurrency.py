@@ -0,0 +1,70 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+if psutil:
+    import task_concurrency
+    from task_concurrency import ConcurrencyController
+
+def samples(**overrides):
+    return dict({"cpu_percent": 10.0, "memory_percent": 10.0, "load_per_cpu": 0.1, "run_queue_per_cpu": 0.0}, **overrides)
+
+@unittest.skipUnless(psutil, "psutil is not installed")
+class ConcurrencyControllerTest(unittest.TestCase):
+    def setUp(self):
+        # Keep the sampler thread asleep so that only the test drives the controller
+        with mock.patch.object(task_concurrency, "SAMPLE_INTERVAL_SECONDS", 3600):
+            self.controller = ConcurrencyController(8)
+
+    def test_latency_compared_once_there_is_a_baseline(self):
+        for seconds in (1.0, 5.0):
+            self.controller.record_latency("task", seconds)
+        self.assertEqual(self.controller.latency_inflation, 1.0)
+
+    def test_one_fast_run_does_not_look_like_a_slowdown(self):
+        for seconds in (1.0, 1.1, 0.9, 0.1, 1.0, 1.05, 0.95, 1.0):
+            self.controller.record_latency("task", seconds)
+        self.assertLess(self.controller.latency_inflation, 1.25)
+
+    def test_sustained_slowdown_inflates_latency(self):
+        for _ in range(5):
+            self.controller.record_latency("task", 1.0)
+        for _ in range(5):
+            self.controller.record_latency("task", 3.0)
+        self.assertGreaterEqual(self.controller.latency_inflation, task_concurrency.LATENCY_INFLATION_THRESHOLD)
+
+    def test_tasks_have_separate_baselines(self):
+        for _ in range(5):
+            self.controller.record_latency("fast", 0.01)
+            self.controller.record_latency("slow", 10.0)
+        self.assertAlmostEqual(self.controller.latency_inflation, 1.0)
+
+    def test_busy_cpu_alone_is_not_overload(self):
+        self.assertIsNone(self.controller._overload(samples(cpu_percent=100.0, run_queue_per_cpu=1.0)))
+
+    def test_busy_cpu_with_run_queue_is_overload(self):
+        self.assertIn("runnable per core", self.controller._overload(samples(cpu_percent=100.0, run_queue_per_cpu=2.0)))
+
+    def test_busy_cpu_with_slower_tasks_is_overload(self):
+        self.controller.latency_inflation = 1.5
+        self.assertIn("slower", self.controller._overload(samples(cpu_percent=100.0)))
+        self.assertIsNone(self.controller._overload(samples(cpu_percent=50.0)))
+
+    def test_adjust_grows_when_all_slots_used_and_cuts_on_overload(self):
+        self.controller.admit(self.controller.target)
+        self.controller._adjust(samples(cpu_percent=95.0))
+        self.assertEqual(self.controller.target, 5)
+        self.controller._adjust(samples(memory_percent=99.0))
+        self.assertEqual(self.controller.target, 3)
+        self.assertTrue(self.controller.overloaded)
+
+if __name__ == "__main__":
+    unittest.main()
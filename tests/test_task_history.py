@@ -0,0 +1,53 @@
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+if psutil:
+    import task_history
+    from task_history import ExecutionHistory
+
+def result(run_seconds, cpu_seconds, max_rss_bytes, install_cache_hit=True):
+    return {
+        "output": None,
+        "timings": {"run": run_seconds * 1000000, "install_cache_hit": install_cache_hit},
+        "resource_usage": {"run": {"user_cpu_seconds": cpu_seconds, "max_rss_bytes": max_rss_bytes}},
+    }
+
+@unittest.skipUnless(psutil, "psutil is not installed")
+class ExecutionHistoryTest(unittest.TestCase):
+    def setUp(self):
+        temp_dir = tempfile.mkdtemp(prefix="cocore_history_test_")
+        self.addCleanup(shutil.rmtree, temp_dir, ignore_errors=True)
+        self.history = ExecutionHistory(os.path.join(temp_dir, "history.sqlite3"))
+        self.addCleanup(self.history.connection.close)
+
+    def test_smooths_costs_across_runs(self):
+        with mock.patch.object(task_history, "HISTORY_SMOOTHING", 0.25):
+            self.history.record("task", "python", result(2.0, 1.0, 1000))
+            self.history.record("task", "python", result(6.0, 5.0, 200))
+        stats = self.history.stats("task")
+        self.assertEqual(stats["runs"], 2)
+        self.assertAlmostEqual(stats["seconds"], 3.0)
+        self.assertAlmostEqual(stats["cpu_seconds"], 2.0)
+        self.assertEqual(stats["peak_rss_bytes"], 750)
+        self.assertEqual(stats["install_hits"], 2)
+
+    def test_cold_runs_also_update_language_estimate(self):
+        self.history.record("task", "node", result(4.0, 2.0, 1000, install_cache_hit=False))
+        self.assertEqual(self.history.stats(task_history.cold_key("node"))["runs"], 1)
+        estimate = self.history.estimate("unseen", "node")
+        self.assertAlmostEqual(estimate.seconds, 4.0)
+        self.assertAlmostEqual(estimate.cpus, 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,161 @@
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+import task_limits
+import task_runners
+import task_workspaces
+from task_extensions import TaskExtensions
+from task_limits import ExecutionLimits
+from task_process import ProcessResult, run_command, run_process
+from task_runners import TaskRunners
+
+MiB = 1024 * 1024
+
+def process_state(pid):
+    """The state letter of pid in /proc, or None once it is gone."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat:
+            return stat.read().rsplit(")", 1)[1].split()[0]
+    except FileNotFoundError:
+        return None
+
+class LimitsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp(prefix="cocore_limits_test_")
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        # The rlimit fallback, which is what runs wherever cgroup v2 cannot be delegated
+        for patcher in (
+            mock.patch.object(task_limits, "cgroups_available", lambda: False),
+            mock.patch.object(task_limits, "DISK_CHECK_INTERVAL_SECONDS", 0.05),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+class ExecutionLimitsTest(LimitsTestCase):
+    def run_limited(self, command, timeout=10, memory_max=256 * MiB, disk_max=None):
+        with ExecutionLimits(timeout, memory_max, 1, 64, disk_max=disk_max) as limits:
+            return run_process(command, self.temp_dir, limits=limits)
+
+    def test_limits_are_in_place_before_command_runs(self):
+        result = self.run_limited(["cat", "/proc/self/limits"], memory_max=64 * MiB, disk_max=8 * MiB)
+        limits = {line[:26].strip(): line[26:].split() for line in result.stdout.splitlines()[1:]}
+        self.assertEqual(limits["Max data size"][:2], [str(64 * MiB)] * 2)
+        self.assertEqual(limits["Max file size"][:2], [str(8 * MiB)] * 2)
+        self.assertEqual(limits["Max cpu time"][:2], ["10", "11"])
+
+    def test_runs_in_own_process_group(self):
+        result = self.run_limited(["sh", "-c", "echo $$; ps -o pgid= -p $$"])
+        pid, pgid = result.stdout.split()
+        self.assertEqual(pid, pgid)
+        self.assertNotEqual(int(pgid), os.getpgid(0))
+
+    def test_timeout_kills_children(self):
+        child_pid_path = os.path.join(self.temp_dir, "child_pid")
+        start = time.monotonic()
+        result = self.run_limited(["sh", "-c", f"sleep 60 & echo $! > {child_pid_path}; sleep 60"], timeout=0.5)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(result.timed_out)
+        with open(child_pid_path) as child_pid_file:
+            child_pid = int(child_pid_file.read())
+        # Killed, if perhaps not yet reaped by whatever adopted it
+        deadline = time.monotonic() + 5
+        while process_state(child_pid) not in (None, "Z") and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertIn(process_state(child_pid), (None, "Z"))
+
+    def test_memory_limit(self):
+        result = self.run_limited([sys.executable, "-c", f"bytearray({256 * MiB})"], memory_max=64 * MiB)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertIn("MemoryError", result.stderr)
+        self.assertFalse(result.timed_out)
+
+    def test_file_larger_than_disk_limit(self):
+        result = self.run_limited(["sh", "-c", "exec head -c 2097152 /dev/zero > big"], disk_max=1 * MiB)
+        self.assertTrue(result.disk_exceeded)
+        self.assertLessEqual(os.path.getsize(os.path.join(self.temp_dir, "big")), 1 * MiB)
+
+    def test_files_adding_up_to_more_than_disk_limit(self):
+        code = (
+            "import time\n"
+            "for i in range(20):\n"
+            "    with open(f'f{i}', 'wb') as f:\n"
+            "        f.write(b'x' * 102400)\n"
+            "time.sleep(60)\n"
+        )
+        start = time.monotonic()
+        result = self.run_limited([sys.executable, "-c", code], disk_max=1 * MiB)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(result.disk_exceeded)
+        self.assertFalse(result.timed_out)
+
+    def test_limits_do_not_leak_into_parent(self):
+        before = [task_limits.resource.getrlimit(limit) for limit in (task_limits.resource.RLIMIT_DATA, task_limits.resource.RLIMIT_FSIZE)]
+        self.run_limited(["true"], memory_max=64 * MiB, disk_max=1 * MiB)
+        after = [task_limits.resource.getrlimit(limit) for limit in (task_limits.resource.RLIMIT_DATA, task_limits.resource.RLIMIT_FSIZE)]
+        self.assertEqual(before, after)
+
+    def test_run_command_timeout(self):
+        start = time.monotonic()
+        result = run_command(["sh", "-c", "sleep 60 & sleep 60"], self.temp_dir, timeout=0.5)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(result.timed_out)
+        self.assertIn("timed out after 0.5 seconds", result.stderr)
+
+class RunGenericTaskLimitsTest(LimitsTestCase):
+    def setUp(self):
+        super().setUp()
+        for patcher in (
+            mock.patch.object(task_runners, "FORK_SERVER_ENABLED", False),
+            mock.patch.object(task_runners, "TASK_TIMEOUT_SECONDS", 0.5),
+            mock.patch.object(task_runners, "WORKSPACE_MAX_BYTES", 1 * MiB),
+            mock.patch.object(task_workspaces, "WORKSPACE_MAX_BYTES", 1 * MiB),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def run_task(self, task_code, args=()):
+        return TaskRunners.run_generic_task(
+            language="python",
+            task_code=task_code,
+            args=list(args),
+            interpreter_command=sys.executable,
+            file_extension=".py",
+            temp_dir=self.temp_dir,
+            task_extension=TaskExtensions.python_extension(),
+        )
+
+    def test_output(self):
+        self.assertEqual(self.run_task("def run(a, b):\n    return a + b\n", [1, 2])["output"], 3)
+
+    def test_timeout_error(self):
+        result = self.run_task("import time\ndef run():\n    time.sleep(60)\n")
+        self.assertEqual(result["error"], "TimeoutError")
+        self.assertEqual(result["error_message"], "Task exceeded its time limit of 0.5 seconds")
+
+    def test_workspace_quota_exceeded(self):
+        code = (
+            "def run():\n"
+            "    for i in range(20):\n"
+            "        with open(f'f{i}', 'wb') as f:\n"
+            "            f.write(b'x' * 102400)\n"
+        )
+        result = self.run_task(code)
+        self.assertEqual(result["error"], "WorkspaceQuotaExceeded")
+
+    def test_oom_killed(self):
+        # Only a cgroup's memory.events can tell an OOM kill apart, so fake the run's result
+        killed = ProcessResult(["python"], -9, "", "", oom_killed=True)
+        with mock.patch.object(task_runners, "run_process", return_value=killed):
+            result = self.run_task("def run():\n    return 1\n")
+        self.assertEqual(result["error"], "OOMKilled")
+        self.assertEqual(result["error_message"], f"Task exceeded its memory limit of {task_limits.TASK_MEMORY_MAX_BYTES // MiB} MiB")
+
+if __name__ == "__main__":
+    unittest.main()
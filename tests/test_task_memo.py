@@ -0,0 +1,96 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+from task_memo import ResultCache
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def size_of(result):
+    return len(json.dumps(result))
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def cache(self, ttl=60, max_bytes=1024 * 1024):
+        return ResultCache(":memory:", ttl=ttl, max_bytes=max_bytes, clock=self.clock)
+
+    def test_hit_and_miss(self):
+        cache = self.cache()
+        cache.put("a", {"output": 1})
+        self.assertEqual(cache.get("a"), {"output": 1})
+        self.assertIsNone(cache.get("b"))
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["stores"], stats["entries"]), (1, 1, 1, 1))
+
+    def test_errors_are_not_stored(self):
+        cache = self.cache()
+        cache.put("a", {"error": "ExecutionError"})
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["stores"], 0)
+
+    def test_entries_expire_after_ttl(self):
+        cache = self.cache(ttl=60)
+        cache.put("a", {"output": 1})
+        self.clock.now += 60
+        self.assertEqual(cache.get("a"), {"output": 1})
+        self.clock.now += 1
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["expirations"], 1)
+        self.assertEqual(cache.stats()["entries"], 0)
+
+    def test_use_does_not_extend_ttl(self):
+        cache = self.cache(ttl=60)
+        cache.put("a", {"output": 1})
+        self.clock.now += 50
+        cache.get("a")
+        self.clock.now += 20
+        self.assertIsNone(cache.get("a"))
+
+    def test_store_removes_expired_entries(self):
+        cache = self.cache(ttl=60)
+        cache.put("a", {"output": 1})
+        self.clock.now += 61
+        cache.put("b", {"output": 2})
+        self.assertEqual(cache.stats()["entries"], 1)
+        self.assertEqual(cache.stats()["expirations"], 1)
+
+    def test_evicts_least_recently_used_over_max_bytes(self):
+        entry_size = size_of({"output": "x" * 10})
+        cache = self.cache(max_bytes=entry_size * 2)
+        cache.put("a", {"output": "a" * 10})
+        self.clock.now += 1
+        cache.put("b", {"output": "b" * 10})
+        self.clock.now += 1
+        cache.get("a")  # b is now the least recently used
+        self.clock.now += 1
+        cache.put("c", {"output": "c" * 10})
+        self.assertEqual(cache.get("a"), {"output": "a" * 10})
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), {"output": "c" * 10})
+        self.assertEqual(cache.stats()["evictions"], 1)
+        self.assertLessEqual(cache.stats()["bytes"], entry_size * 2)
+
+    def test_result_larger_than_cache_is_not_stored(self):
+        cache = self.cache(max_bytes=10)
+        cache.put("a", {"output": "x" * 100})
+        self.assertIsNone(cache.get("a"))
+
+    def test_key_ignores_input_key_order(self):
+        first = ResultCache.key_for("1", "code", "", [{"a": 1, "b": 2}])
+        second = ResultCache.key_for("1", "code", "", [{"b": 2, "a": 1}])
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, ResultCache.key_for("1", "code", "", [{"a": 1, "b": 3}]))
+        self.assertNotEqual(first, ResultCache.key_for("1", "other code", "", [{"a": 1, "b": 2}]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+from task_queue import TaskQueue
+
+@unittest.skipUnless(fakeredis, "fakeredis is not installed")
+class TaskQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.redis = fakeredis.FakeRedis()
+        self.queue = TaskQueue(self.redis, "jobs", host_id="host-1")
+        self.redis.rpush("jobs", b"a", b"b", b"c")
+
+    def queued(self):
+        return self.redis.lrange("jobs", 0, -1)
+
+    def processing(self):
+        return self.redis.lrange("jobs:processing:host-1", 0, -1)
+
+    def test_lease_moves_jobs_to_processing_list(self):
+        self.assertEqual(self.queue.lease(2, block=False), [b"a", b"b"])
+        self.assertEqual(self.queued(), [b"c"])
+        self.assertEqual(self.processing(), [b"a", b"b"])
+
+    def test_blocking_lease_returns_waiting_jobs(self):
+        self.assertEqual(self.queue.lease(5, block=True, timeout=1), [b"a", b"b", b"c"])
+        self.assertEqual(self.queued(), [])
+
+    def test_lease_of_empty_queue(self):
+        self.redis.delete("jobs")
+        self.assertEqual(self.queue.lease(3, block=False), [])
+        self.assertEqual(self.processing(), [])
+
+    def test_ack_releases_only_acked_jobs(self):
+        self.queue.lease(3, block=False)
+        self.queue.ack([b"b"])
+        self.assertEqual(self.processing(), [b"a", b"c"])
+        self.queue.ack([b"a", b"c"])
+        self.assertEqual(self.processing(), [])
+
+    def test_recover_returns_unacked_jobs_to_head_in_order(self):
+        self.queue.lease(2, block=False)
+        self.queue.ack([b"a"])
+        self.redis.rpush("jobs", b"d")
+        # A restarted worker gets back what the previous one had leased but not acked
+        restarted = TaskQueue(self.redis, "jobs", host_id="host-1")
+        self.assertEqual(restarted.recover(), 1)
+        self.assertEqual(self.queued(), [b"b", b"c", b"d"])
+        self.assertEqual(self.processing(), [])
+        self.assertEqual(restarted.lease(1, block=False), [b"b"])
+
+    def test_recover_leaves_other_hosts_leases(self):
+        other = TaskQueue(self.redis, "jobs", host_id="host-2")
+        other.lease(1, block=False)
+        self.assertEqual(self.queue.recover(), 0)
+        self.assertEqual(self.redis.lrange("jobs:processing:host-2", 0, -1), [b"a"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,193 @@
+import json
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+import task_api
+import task_reporter
+from task_api import CocoreApiClient
+from task_reporter import ResultReporter
+
+class FakeApi(BaseHTTPRequestHandler):
+    """
+    Records every PATCH and answers with the next of the server's status codes, then 200.
+    While the server has gates left, each request waits for the next one to be set first.
+    """
+
+    def do_PATCH(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.server.lock:
+            self.server.requests.append((self.path, body))
+            status = self.server.statuses.pop(0) if self.server.statuses else 200
+            gate = self.server.gates.pop(0) if self.server.gates else None
+        if gate is not None:
+            gate.wait(10)
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def wait_for(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for condition")
+        time.sleep(0.01)
+
+class ResultReporterTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApi)
+        self.server.lock = threading.Lock()
+        self.server.requests = []
+        self.server.statuses = []
+        self.server.gates = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = CocoreApiClient("test-key", 4, base_url=f"http://127.0.0.1:{self.server.server_port}")
+        self.spool_dir = tempfile.mkdtemp(prefix="cocore_spool_test_")
+        for patcher in (
+            mock.patch.object(task_api, "API_MAX_RETRIES", 2),
+            mock.patch.object(task_api, "API_BACKOFF_SECONDS", 0),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.reporters = []
+
+    def tearDown(self):
+        for reporter in self.reporters:
+            reporter.close(timeout=5)
+        self.server.shutdown()
+        self.server.server_close()
+        for name in os.listdir(self.spool_dir):
+            os.remove(os.path.join(self.spool_dir, name))
+        os.rmdir(self.spool_dir)
+
+    def reporter(self):
+        reporter = ResultReporter(lambda: self.client, spool_dir=self.spool_dir)
+        self.reporters.append(reporter)
+        return reporter
+
+    def spooled(self):
+        return sorted(name for name in os.listdir(self.spool_dir) if name.endswith(".json"))
+
+    def test_delivers_submitted_results(self):
+        reporter = self.reporter()
+        for execution_id in range(5):
+            reporter.submit(execution_id, {"output": execution_id})
+        wait_for(lambda: len(self.server.requests) == 5)
+        self.assertEqual(
+            sorted(self.server.requests),
+            [(f"/task_executions/{i}", {"task_execution": {"output": i}}) for i in range(5)],
+        )
+        self.assertEqual(self.spooled(), [])
+
+    def test_next_batch_collects_up_to_batch_size(self):
+        reporter = self.reporter()
+        # Stop the reporter thread so that the queue is only read here
+        reporter.stopping.set()
+        reporter.thread.join()
+        with mock.patch.object(task_reporter, "RESULT_BATCH_SIZE", 3):
+            for execution_id in range(5):
+                reporter.queue.put((execution_id, {"output": execution_id}, None))
+            self.assertEqual([item[0] for item in reporter._next_batch()], [0, 1, 2])
+            self.assertEqual([item[0] for item in reporter._next_batch()], [3, 4])
+        self.assertEqual(reporter._next_batch(), [])
+
+    def test_retries_retryable_status(self):
+        self.server.statuses = [503, 502]
+        reporter = self.reporter()
+        reporter.submit(1, {"output": 1})
+        wait_for(lambda: len(self.server.requests) == 3)
+        time.sleep(0.2)
+        self.assertEqual(self.spooled(), [])
+
+    def test_spools_result_it_cannot_deliver(self):
+        self.server.statuses = [503] * 3
+        with mock.patch.object(task_reporter, "SPOOL_RETRY_SECONDS", 3600):
+            reporter = self.reporter()
+            reporter.submit(7, {"output": 7})
+            wait_for(lambda: self.spooled() == ["7.json"])
+            with open(os.path.join(self.spool_dir, "7.json")) as spool_file:
+                self.assertEqual(json.load(spool_file), {"id": 7, "result": {"output": 7}})
+            # Not retried before SPOOL_RETRY_SECONDS have passed since the last retry
+            time.sleep(1.5)
+            self.assertEqual(self.spooled(), ["7.json"])
+            self.assertEqual(len(self.server.requests), 3)
+            reporter.last_spool_retry -= 3600
+            wait_for(lambda: self.spooled() == [])
+        self.assertEqual(self.server.requests[-1], ("/task_executions/7", {"task_execution": {"output": 7}}))
+
+    def test_does_not_spool_rejected_result(self):
+        self.server.statuses = [422]
+        reporter = self.reporter()
+        reporter.submit(3, {"output": 3})
+        wait_for(lambda: len(self.server.requests) == 1)
+        time.sleep(0.2)
+        self.assertEqual(self.spooled(), [])
+
+    def test_replays_spool_left_by_previous_run(self):
+        with open(os.path.join(self.spool_dir, "9.json"), 'w') as spool_file:
+            json.dump({"id": 9, "result": {"output": 9}}, spool_file)
+        self.reporter()
+        wait_for(lambda: self.spooled() == [])
+        self.assertEqual(self.server.requests, [("/task_executions/9", {"task_execution": {"output": 9}})])
+
+    def test_on_done_waits_for_delivery(self):
+        delivered = threading.Event()
+        first_response = threading.Event()
+        self.server.statuses = [503]
+        self.server.gates = [first_response]
+        reporter = self.reporter()
+        reporter.submit(4, {"output": 4}, on_done=delivered.set)
+        wait_for(lambda: len(self.server.requests) == 1)
+        self.assertFalse(delivered.wait(0.2))
+        first_response.set()
+        self.assertTrue(delivered.wait(10))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_on_done_after_spooling(self):
+        spooled = []
+        self.server.statuses = [503] * 3
+        with mock.patch.object(task_reporter, "SPOOL_RETRY_SECONDS", 3600):
+            reporter = self.reporter()
+            reporter.submit(5, {"output": 5}, on_done=lambda: spooled.append(self.spooled()))
+            wait_for(lambda: spooled)
+        self.assertEqual(spooled, [["5.json"]])
+
+    def test_on_done_after_rejection(self):
+        done = threading.Event()
+        self.server.statuses = [400]
+        reporter = self.reporter()
+        reporter.submit(6, {"output": 6}, on_done=done.set)
+        self.assertTrue(done.wait(10))
+        self.assertEqual(self.spooled(), [])
+
+    def test_no_on_done_when_spooling_fails(self):
+        done = threading.Event()
+        self.server.statuses = [503] * 3
+        reporter = self.reporter()
+        with mock.patch.object(reporter, "spool_dir", os.path.join(self.spool_dir, "missing")):
+            reporter.submit(8, {"output": 8}, on_done=done.set)
+            wait_for(lambda: len(self.server.requests) == 3)
+            self.assertFalse(done.wait(0.5))
+
+    def test_spools_when_queue_is_full(self):
+        reporter = self.reporter()
+        reporter.stopping.set()
+        reporter.thread.join()
+        reporter.queue = queue.Queue(maxsize=1)
+        reporter.submit(1, {"output": 1})
+        reporter.submit(2, {"output": 2})
+        self.assertEqual(self.spooled(), ["2.json"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,19 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+from task_runners import TaskRunners
+
+class JavaRunCommandTest(unittest.TestCase):
+    def test_paths_with_spaces_stay_one_argument(self):
+        classpath = os.pathsep.join(["/cache dir/java/a.jar", "/cache dir/java/b.jar"])
+        command = TaskRunners.java_run_command("/cache dir/artifacts/key", {"CLASSPATH": classpath})
+        self.assertEqual(command, ["java", "-cp", os.pathsep.join(["/cache dir/artifacts/key", classpath]), "TaskCode"])
+
+    def test_without_dependencies(self):
+        self.assertEqual(TaskRunners.java_run_command("/artifacts", {}), ["java", "-cp", "/artifacts", "TaskCode"])
+
+if __name__ == "__main__":
+    unittest.main()
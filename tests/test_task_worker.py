@@ -0,0 +1,72 @@
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cocore_installer"))
+
+import task_worker
+from task_worker import parse_task_execution, record_run_latency
+
+def job(**overrides):
+    task_execution = {
+        "id": 1,
+        "input": [1, 2],
+        "task": {"language": 1, "code": "def run(a, b):\n    return a + b\n", "requirements": ""},
+    }
+    task_execution.update(overrides)
+    return json.dumps(task_execution)
+
+class ParseTaskExecutionTest(unittest.TestCase):
+    def test_accepts_well_formed_job(self):
+        self.assertEqual(parse_task_execution(job())["id"], 1)
+        self.assertIsNone(parse_task_execution(job(input=None))["input"])
+
+    def test_rejects_malformed_jobs(self):
+        for raw in (
+            b"not json",
+            b"\xff",
+            json.dumps([1, 2]),
+            json.dumps("job"),
+            job(task="code"),
+            job(id=None),
+            job(id=True),
+            job(input={"a": 1}),
+            job(task={"language": 1, "code": "x"}),
+            job(task={"language": 1, "code": None, "requirements": ""}),
+            json.dumps({"task": {"language": 1, "code": "x", "requirements": ""}, "input": []}),
+        ):
+            with self.subTest(raw=raw):
+                with self.assertRaises(ValueError):
+                    parse_task_execution(raw)
+
+class RecordRunLatencyTest(unittest.TestCase):
+    def setUp(self):
+        self.controller = mock.Mock()
+        patcher = mock.patch.object(task_worker, "get_concurrency_controller", return_value=self.controller)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_records_run_phase_keyed_by_input(self):
+        timings = {"install": 5000000.0, "run": 250000.0, "install_cache_hit": True}
+        record_run_latency(parse_task_execution(job(input=[1, 2])), {"output": 3, "timings": timings})
+        record_run_latency(parse_task_execution(job(input=[3, 4])), {"output": 7, "timings": timings})
+        (first_key, first_seconds), _ = self.controller.record_latency.call_args_list[0]
+        (second_key, _), _ = self.controller.record_latency.call_args_list[1]
+        self.assertEqual(first_seconds, 0.25)
+        self.assertNotEqual(first_key, second_key)
+
+    def test_skips_cache_misses_and_errors(self):
+        for result in (
+            {"output": 3, "timings": {"run": 1.0, "install_cache_hit": False}},
+            {"output": 3, "timings": {"run": 1.0, "install_cache_hit": True, "compile_cache_hit": False}},
+            {"error": "TimeoutError", "timings": {"run": 1.0}},
+            {"output": 3, "timings": {"result_cache_hit": True}},
+        ):
+            with self.subTest(result=result):
+                record_run_latency(parse_task_execution(job()), result)
+        self.controller.record_latency.assert_not_called()
+
+if __name__ == "__main__":
+    unittest.main()